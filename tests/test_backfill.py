@@ -0,0 +1,26 @@
+from multiprocessing import Pool
+import time
+
+from weatherforecast.backfill_forecasts import _imap_bounded
+
+
+def square(x):
+    return x * x
+
+
+def test_imap_bounded_only_reads_ahead_a_few_tasks():
+    pulled = []
+
+    def tasks():
+        for i in range(20):
+            pulled.append(i)
+            yield i
+
+    with Pool(2) as pool:
+        results = []
+        for result in _imap_bounded(pool, square, tasks(), max_pending=3):
+            time.sleep(0.01)  # a slow consumer
+            # one more task may be taken from the iterator while waiting for a slot
+            assert len(pulled) <= len(results) + 3 + 1
+            results.append(result)
+    assert results == [i * i for i in range(20)]
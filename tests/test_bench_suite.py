@@ -0,0 +1,16 @@
+import pytest
+
+from weatherforecast.benchmarks.bench_suite import bench_flow, synthetic_cities
+from weatherforecast.utils.location_utility import CityIndex
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "file"])
+@pytest.mark.parametrize("extraction", ["columnar", "objects", "pipelined"])
+def test_every_flow_variant_runs(backend, extraction):
+    locations = CityIndex(synthetic_cities(3, num_countries=1)).locations
+    results = bench_flow(backend, extraction, locations, runs=2, change_ratio=0.5, trace_memory=False)
+
+    first_run, second_run = results
+    assert first_run["items"] == first_run["details"]["written"] > 0
+    # the second run only writes what changed
+    assert 0 < second_run["details"]["written"] < first_run["details"]["written"]
@@ -0,0 +1,36 @@
+from datetime import date
+
+from sqlalchemy import create_engine, inspect
+from timely_beliefs import DBTimedBelief
+from timely_beliefs.db_base import Base as TBBase
+
+from weatherforecast.utils.db_schema import (
+    BELIEF_INDEXES,
+    belief_table_is_partitioned,
+    ensure_future_partitions,
+    month_starts,
+    setup_schema,
+)
+
+
+def test_belief_indexes_are_created_once(tmp_path):
+    engine = create_engine("sqlite:///%s" % (tmp_path / "forecasts.db"))
+    for _ in range(2):  # e.g. a second start of the scheduler
+        setup_schema(engine, TBBase.metadata, create_indexes=True, partition_months_ahead=3)
+
+    index_names = {
+        index["name"] for index in inspect(engine).get_indexes(DBTimedBelief.__tablename__)
+    }
+    assert set(BELIEF_INDEXES) <= index_names
+    # partitions are only made on PostgreSQL
+    assert not belief_table_is_partitioned(engine)
+    ensure_future_partitions(engine, 3)
+
+
+def test_month_starts_run_over_the_year():
+    assert month_starts(date(2019, 11, 17), 3) == [
+        date(2019, 11, 1),
+        date(2019, 12, 1),
+        date(2020, 1, 1),
+        date(2020, 2, 1),
+    ]
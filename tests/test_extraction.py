@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+import pytz
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from timely_beliefs.db_base import Base as TBBase
+
+from weatherforecast.benchmarks.fake_darksky import make_forecast_payload
+from weatherforecast.utils import Settings, dbconfig
+from weatherforecast.utils.file_store import PartitionedFileStore
+from weatherforecast.utils.helping_tables_utility import create_sensor_location_id
+from weatherforecast.utils.weather_forecast_utility import (
+    create_forecasts_from_responses,
+    forecast_frame_from_responses,
+)
+
+FIRST_HOUR = datetime(2019, 3, 1, 11, tzinfo=pytz.utc)
+LOCATIONS = pd.DataFrame(
+    {"latitude": [52.0, 53.0], "longitude": [4.0, 5.0], "location_name": ["Amsterdam", "Groningen"]}
+)
+
+
+def open_store(persistence_type, tmp_path):
+    conf_file_path = str(tmp_path / "configuration.ini")
+    with open(conf_file_path, "w") as conf_file:
+        conf_file.write(
+            "[DARK_SKY]\nAPI_KEY: fake-key\n\n[PERSISTENCE]\ntype: %s\nbulk_insert: yes\n" % persistence_type
+        )
+    settings = Settings(conf_file_path)
+    if persistence_type == "file":
+        return settings, PartitionedFileStore(str(tmp_path / "forecasts"), sensor_ids=create_sensor_location_id)
+    engine = create_engine("sqlite:///%s" % (tmp_path / "forecasts.db"))
+    TBBase.metadata.create_all(engine)
+    session = sessionmaker(bind=engine, expire_on_commit=False)()
+    dbconfig.create_darksky_source(session)
+    dbconfig.sensor_registry.warm(session)
+    return settings, session
+
+
+@pytest.mark.parametrize("persistence_type", ["file", "db"])
+def test_columnar_extraction_gives_the_same_beliefs_as_belief_objects(persistence_type, tmp_path):
+    settings, store = open_store(persistence_type, tmp_path)
+    belief_time = FIRST_HOUR - timedelta(minutes=20)
+    responses = [
+        (belief_time, make_forecast_payload((latitude, longitude), FIRST_HOUR, num_hours=5))
+        for latitude, longitude in zip(LOCATIONS["latitude"], LOCATIONS["longitude"])
+    ]
+    sensor_names = ["temperature", "windSpeed"]
+
+    beliefs = create_forecasts_from_responses(LOCATIONS, responses, sensor_names, 3, settings, store=store)
+    frame = forecast_frame_from_responses(LOCATIONS, responses, sensor_names, 3, settings, store=store)
+
+    assert len(frame) == len(beliefs) == 2 * 3 * 2
+    assert list(
+        zip(frame["event_start"], frame["belief_horizon"], frame["sensor_id"], frame["event_value"])
+    ) == [(fc.event_start, fc.belief_horizon, fc.sensor.id, fc.event_value) for fc in beliefs]
+    assert (frame["belief_time"] == belief_time).all()
+    assert set(frame["source_id"]) == {"DarkSky" if persistence_type == "file" else beliefs[0].source.id}
@@ -0,0 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from weatherforecast.benchmarks.fake_darksky import FakeDarkSky
+
+
+def call_quietly(provider: FakeDarkSky, location):
+    try:
+        provider("fake-key", location, exclude=["minutely", "daily"])
+    except Exception:
+        pass
+
+
+def test_calls_and_failures_are_counted_across_threads():
+    provider = FakeDarkSky(num_hours=1, failure_ratio=0.3, seed=7)
+    locations = [(float(i % 90), float(i % 180)) for i in range(2000)]
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(lambda location: call_quietly(provider, location), locations))
+
+    assert provider.calls == len(locations)
+    # which calls fail depends only on the seed and the call count, not on the order of the threads
+    sequential = FakeDarkSky(num_hours=1, failure_ratio=0.3, seed=7)
+    for location in locations:
+        call_quietly(sequential, location)
+    assert provider.failures == sequential.failures
@@ -0,0 +1,20 @@
+from weatherforecast.utils.weather_forecast_utility import fetch_forecasts
+
+
+def failing_for(bad_location):
+    def provider(api_key, location):
+        if location == bad_location:
+            raise Exception("Connection refused")
+        return {"hourly": {"data": []}, "latitude": location[0]}
+
+    return provider
+
+
+def test_one_failing_location_does_not_drop_the_others():
+    locations = [(52.0, 4.0), (53.0, 5.0), (54.0, 6.0)]
+    for max_workers in (1, 3):
+        fetched = fetch_forecasts(
+            "fake-key", locations, max_workers=max_workers, provider=failing_for((53.0, 5.0))
+        )
+        assert [forecast is None for _, forecast in fetched] == [False, True, False]
+        assert fetched[2][1]["latitude"] == 54.0
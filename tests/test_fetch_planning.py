@@ -0,0 +1,193 @@
+from datetime import date, datetime, timedelta
+import json
+import random
+import time
+
+import pandas as pd
+import pytest
+import pytz
+import requests
+
+from weatherforecast.benchmarks.bench_fetch_planning import VirtualClock
+from weatherforecast.benchmarks.fake_darksky import FakeDarkSky
+from weatherforecast.utils import Settings, weather_forecast_utility
+from weatherforecast.utils.fetch_planning import (
+    STATE_TIME_FORMAT,
+    DailyQuota,
+    FetchPlanner,
+    QuotaExceeded,
+    TokenBucket,
+    backoff_delays,
+)
+
+NOW = datetime(2019, 3, 1, 12, tzinfo=pytz.utc)
+
+
+def write_settings(directory, retries=2, dark_sky="", sections=""):
+    conf_file_path = str(directory / "configuration.ini")
+    with open(conf_file_path, "w") as conf_file:
+        conf_file.write(
+            "[DARK_SKY]\nAPI_KEY: fake-key\nretries: %d\nretry_delay_seconds: 1\n%s\n%s"
+            % (retries, dark_sky, sections)
+        )
+    return Settings(conf_file_path)
+
+
+def locations(num_locations):
+    return pd.DataFrame(
+        {
+            "latitude": [52.0 + i for i in range(num_locations)],
+            "longitude": [4.0 + i for i in range(num_locations)],
+            "location_name": ["City %d" % i for i in range(num_locations)],
+            "location_key": ["city%d" % i for i in range(num_locations)],
+        }
+    )
+
+
+def planner_for(tmp_path, settings, provider, clock=None):
+    if clock is None:
+        clock = VirtualClock()
+    return FetchPlanner(
+        settings,
+        str(tmp_path / "fetch_state.json"),
+        provider,
+        now=lambda: NOW,
+        clock=clock,
+        sleep=clock.sleep,
+        rng=random.Random(169),
+    )
+
+
+def test_token_bucket_paces_calls_after_a_burst():
+    clock = VirtualClock()
+    bucket = TokenBucket(rate=2, capacity=2, clock=clock, sleep=clock.sleep)
+    for _ in range(2):
+        bucket.acquire()
+    assert clock.now == 0  # the burst
+    for _ in range(4):
+        bucket.acquire()
+    assert clock.now == pytest.approx(2.0)  # then two calls per second
+
+
+def test_token_bucket_keeps_pace_at_any_rate():
+    clock = VirtualClock()
+    bucket = TokenBucket(rate=10, clock=clock, sleep=clock.sleep)
+    for _ in range(500):
+        bucket.acquire()
+    # a burst of ten, then ten per second
+    assert clock.now == pytest.approx(49.0)
+
+
+def test_belief_times_are_taken_right_before_the_call_which_succeeds(tmp_path):
+    settings = write_settings(tmp_path, retries=3)
+    fake_darksky = FakeDarkSky(failure_ratio=0.3, seed=169)
+    answered_at = {}
+
+    def provider(api_key, location):
+        forecast = fake_darksky(api_key, location)
+        answered_at[location] = datetime.utcnow().replace(tzinfo=pytz.utc)
+        return forecast
+
+    planner = planner_for(tmp_path, settings, provider)
+    planner.sleep = lambda seconds: time.sleep(0.05)  # the backoff delays take a while
+    kept, fetched = planner.fetch(locations(12), "fake-key")
+
+    assert fake_darksky.failures > 0
+    for location, (belief_time, _) in zip(kept.itertuples(), fetched):
+        waited = answered_at[(location.latitude, location.longitude)] - belief_time
+        assert timedelta(0) <= waited < timedelta(seconds=0.04)
+
+
+def test_daily_quota_is_used_up_and_renewed_the_next_day():
+    quota = DailyQuota(2, day=date(2019, 3, 1), used=1)
+    quota.take(date(2019, 3, 1))
+    with pytest.raises(QuotaExceeded):
+        quota.take(date(2019, 3, 1))
+    quota.take(date(2019, 3, 2))
+    assert (quota.day, quota.used, quota.taken) == (date(2019, 3, 2), 1, 1)
+
+
+def test_backoff_delays_grow_within_their_jitter_and_maximum():
+    delays = backoff_delays(8, 1.0, max_delay=30.0, rng=random.Random(169))
+    for attempt, delay in enumerate(delays):
+        exponential = min(30.0, 2 ** attempt)
+        assert 0.5 * exponential <= delay <= 1.5 * exponential
+
+
+def test_plan_leaves_out_locations_which_are_not_due_and_orders_by_priority(tmp_path):
+    settings = write_settings(
+        tmp_path, sections="[REFRESH_HOURS]\ncity0: 6\ncity1: 6\n\n[PRIORITIES]\ncity3: 10\n"
+    )
+    with open(str(tmp_path / "fetch_state.json"), "w") as state_file:
+        json.dump(
+            dict(
+                last_fetched={
+                    # fetched an hour ago, so not due yet
+                    "City 0": (NOW - timedelta(hours=1)).strftime(STATE_TIME_FORMAT),
+                    # fetched a little less than six hours ago, which is close enough
+                    "City 1": (NOW - timedelta(hours=5, minutes=58)).strftime(STATE_TIME_FORMAT),
+                }
+            ),
+            state_file,
+        )
+    planner = planner_for(tmp_path, settings, FakeDarkSky())
+
+    assert planner.plan(locations(4))["location_name"].tolist() == ["City 3", "City 1", "City 2"]
+
+
+def test_one_failing_location_does_not_drop_the_others(tmp_path):
+    settings = write_settings(tmp_path, dark_sky="max_calls_per_second: 5\n")
+    fake_darksky = FakeDarkSky()
+
+    def provider(api_key, location):
+        if location == (53.0, 5.0):
+            raise Exception("Connection refused")
+        return fake_darksky(api_key, location)
+
+    clock = VirtualClock()
+    planner = planner_for(tmp_path, settings, provider, clock)
+    for max_workers in (1, 3):
+        kept, fetched = planner.fetch(locations(3), "fake-key", max_workers=max_workers)
+        assert kept["location_name"].tolist() == ["City 0", "City 2"]
+        assert all(forecast is not None for _, forecast in fetched)
+    assert clock.now > 0  # retries waited (on the virtual clock)
+
+
+def test_flaky_calls_are_retried(tmp_path):
+    settings = write_settings(tmp_path, retries=5)
+    provider = FakeDarkSky(failure_ratio=0.3, seed=169)
+    planner = planner_for(tmp_path, settings, provider)
+    kept, _ = planner.fetch(locations(20), "fake-key")
+    assert provider.failures > 0
+    assert kept.shape[0] == 20
+    assert planner.quota.taken == provider.calls
+
+
+def test_commit_without_marking_fetched_only_records_the_calls(tmp_path):
+    settings = write_settings(tmp_path, sections="[REFRESH_HOURS]\ncity0: 6\n")
+    planner = planner_for(tmp_path, settings, FakeDarkSky())
+    planner.fetch(locations(1), "fake-key")
+    planner.commit(mark_fetched=False)
+
+    planner = planner_for(tmp_path, settings, FakeDarkSky())
+    assert planner.quota.used == 1
+    assert planner.plan(locations(1)).shape[0] == 1  # still due
+
+    planner.fetch(locations(1), "fake-key")
+    planner.commit()
+    planner = planner_for(tmp_path, settings, FakeDarkSky())
+    assert planner.quota.used == 2
+    assert planner.plan(locations(1)).shape[0] == 0
+
+
+def test_a_failing_connection_is_an_ordinary_failed_call(monkeypatch):
+    timeouts = []
+
+    def get(url, params=None, headers=None, timeout=None):
+        timeouts.append(timeout)
+        raise requests.exceptions.ConnectionError("Connection refused")
+
+    monkeypatch.setattr(weather_forecast_utility.requests, "get", get)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        weather_forecast_utility.call_darksky("fake-key", (52.0, 4.0), timeout=3)
+    assert timeouts == [3]
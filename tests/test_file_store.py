@@ -0,0 +1,25 @@
+from datetime import datetime
+
+import pandas as pd
+import pytz
+
+from weatherforecast.utils import cols
+from weatherforecast.utils.file_store import PartitionedFileStore, migrate_from_csv
+
+
+def test_migration_keys_the_source_by_name(tmp_path):
+    legacy_path = tmp_path / "forecasts.csv"
+    pd.DataFrame(
+        [["2019-03-01 10:00:00+00:00", "2019-03-01 08:00:00+00:00", 1, "0123456789", 7.5]],
+        columns=cols,
+    ).to_csv(legacy_path, index=False)
+    store = PartitionedFileStore(str(tmp_path / "forecasts"))
+
+    assert migrate_from_csv(str(legacy_path), store) == 1
+
+    df = store.read(
+        datetime(2019, 3, 1, tzinfo=pytz.utc), datetime(2019, 3, 2, tzinfo=pytz.utc)
+    )
+    assert df["source"].tolist() == ["DarkSky"]
+    # a sensor id of digits only stays a string
+    assert df["sensor_id"].tolist() == ["0123456789"]
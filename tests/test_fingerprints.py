@@ -0,0 +1,45 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from timely_beliefs.db_base import Base as TBBase
+
+from weatherforecast.utils.file_store import PartitionedFileStore
+from weatherforecast.utils.fingerprints import FingerprintCache
+
+
+def test_workers_can_commit_fingerprints_of_the_same_location(tmp_path):
+    engine = create_engine("sqlite:///%s" % (tmp_path / "forecasts.db"))
+    TBBase.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    first, second = FingerprintCache(Session()), FingerprintCache(Session())
+    # both find no fingerprint for Amsterdam yet
+    assert first.load() == second.load() == {}
+
+    first.remember("Amsterdam", 100, "a")
+    first.commit()
+    second.remember("Amsterdam", 100, "b")
+    second.commit()
+
+    assert FingerprintCache(Session()).load() == {"Amsterdam": (100, "b")}
+
+
+def test_workers_keep_each_others_fingerprints_in_the_file(tmp_path):
+    store = PartitionedFileStore(str(tmp_path / "forecasts"))
+    first, second = FingerprintCache(store), FingerprintCache(store)
+    assert first.load() == second.load() == {}
+
+    first.remember("Amsterdam", 100, "a")
+    first.commit()
+    second.remember("Utrecht", 100, "b")
+    second.commit()
+
+    assert FingerprintCache(store).load() == {"Amsterdam": (100, "a"), "Utrecht": (100, "b")}
+
+
+def test_discarded_fingerprints_are_not_written(tmp_path):
+    store = PartitionedFileStore(str(tmp_path / "forecasts"))
+    cache = FingerprintCache(store)
+    cache.remember("Amsterdam", 100, "a")
+    cache.discard()
+    cache.commit()
+
+    assert FingerprintCache(store).load() == {}
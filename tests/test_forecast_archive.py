@@ -0,0 +1,50 @@
+from datetime import datetime
+import gzip
+import json
+
+from weatherforecast.backfill_forecasts import parse_archive_run
+from weatherforecast.utils.forecast_archive import ForecastArchive
+
+
+def response(value):
+    return {
+        "hourly": {"data": [{"time": 3600 * h, "temperature": value, "ozone": 1} for h in range(3)]},
+        "daily": {"data": []},
+    }
+
+
+def test_backfill_reads_the_runs_of_an_archive(tmp_path):
+    archive = ForecastArchive(str(tmp_path), segment_per_day=True)
+    archive.append_run(datetime(2019, 3, 1, 10), [((52.0, 4.0), response(1.0))])
+    archive.append_run(datetime(2019, 3, 1, 11), [((52.0, 4.0), response(2.0)), ((53.0, 5.0), response(3.0))])
+
+    runs = ForecastArchive(str(tmp_path)).runs()
+    assert list(runs) == ["2019-03-01T10-00-00", "2019-03-01T11-00-00"]
+
+    fetch_time, parsed = parse_archive_run(
+        (str(tmp_path), "2019-03-01T11-00-00", runs["2019-03-01T11-00-00"], 2, ["temperature"])
+    )
+    assert fetch_time == "2019-03-01T11-00-00"
+    assert [(latitude, longitude) for latitude, longitude, _ in parsed] == [(52.0, 4.0), (53.0, 5.0)]
+    # only the needed hours and sensors are kept
+    assert parsed[1][2] == {"hourly": {"data": [{"time": 0, "temperature": 3.0}, {"time": 3600, "temperature": 3.0}]}}
+
+
+def test_single_responses_are_read_back_from_their_segment(tmp_path):
+    archive = ForecastArchive(str(tmp_path))
+    first_fetch, second_fetch = datetime(2019, 3, 1, 10), datetime(2019, 3, 1, 11)
+    archive.append_run(first_fetch, [((52.0, 4.0), response(1.0)), ((53.0, 5.0), response(2.0))])
+    # the index is kept up to date by the archive which appends
+    archive.load_index()
+    archive.append_run(second_fetch, [((52.0, 4.0), response(3.0))])
+
+    assert archive.read(53.0, 5.0, first_fetch) == response(2.0)
+    assert archive.read(52.0, 4.0, second_fetch) == response(3.0)
+    # another archive reads the same responses from the index file
+    other_archive = ForecastArchive(str(tmp_path))
+    assert other_archive.read(52.0, 4.0, first_fetch) == response(1.0)
+    assert other_archive.load_index() == archive.load_index()
+    # each run is a segment, which as a whole is a valid gzip file of the responses
+    with gzip.open(str(tmp_path / "2019-03-01T10-00-00.json.gz"), "rt") as segment_file:
+        content = segment_file.read()
+    assert content == json.dumps(response(1.0)) + json.dumps(response(2.0))
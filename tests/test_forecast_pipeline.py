@@ -0,0 +1,100 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from weatherforecast.benchmarks.fake_darksky import FakeDarkSky
+from weatherforecast.utils import Settings
+from weatherforecast.utils.fetch_planning import FetchPlanner
+from weatherforecast.utils.file_store import PartitionedFileStore
+from weatherforecast.utils.forecast_pipeline import ForecastPipeline
+from weatherforecast.utils.helping_tables_utility import create_sensor_location_id
+
+
+def locations(num_locations):
+    return pd.DataFrame(
+        {
+            "latitude": [52.0 + i for i in range(num_locations)],
+            "longitude": [4.0 + i for i in range(num_locations)],
+            "location_name": ["City %d" % i for i in range(num_locations)],
+            "location_key": ["city%d" % i for i in range(num_locations)],
+        }
+    )
+
+
+class LosingPipeline(ForecastPipeline):
+    """Loses the response for the second location, as a bug might."""
+
+    def _put_response(self, position, fetched):
+        if position != 1:
+            super()._put_response(position, fetched)
+
+
+def run_pipeline(tmp_path, provider, num_locations, concurrency=3, pipeline_class=ForecastPipeline):
+    """Run the pipeline (in a thread, so a hanging run fails the test), returning the saved cities."""
+    conf_file_path = str(tmp_path / "configuration.ini")
+    with open(conf_file_path, "w") as conf_file:
+        conf_file.write(
+            "[DARK_SKY]\nAPI_KEY: fake-key\nconcurrency: %d\nretries: 2\nretry_delay_seconds: 0.01\n\n"
+            "[PERSISTENCE]\ntype: file\n\n"
+            "[PIPELINE]\nenabled: yes\nbatch_size: 2\nqueue_size: 2\n" % concurrency
+        )
+    settings = Settings(conf_file_path)
+    written = []
+
+    def write(frame, store, settings):
+        written.append(frame)
+        return store
+
+    pipeline = pipeline_class(
+        PartitionedFileStore(str(tmp_path / "forecasts"), sensor_ids=create_sensor_location_id),
+        settings,
+        FetchPlanner(settings, str(tmp_path / "fetch_state.json"), provider),
+        dedup=lambda frame, store, settings: frame,
+        write=write,
+        sensor_names=["temperature"],
+        num_hours=2,
+    )
+    outcome = []
+
+    def run():
+        try:
+            outcome.append(pipeline.run(locations(num_locations)))
+        except Exception as e:
+            outcome.append(e)
+
+    runner = threading.Thread(target=run, daemon=True)
+    runner.start()
+    runner.join(timeout=30)
+    assert not runner.is_alive(), "the pipeline hangs"
+    if isinstance(outcome[0], Exception):
+        raise outcome[0]
+    sensor_ids = set(pd.concat(written)["sensor_id"]) if written else set()
+    return [
+        "City %d" % i
+        for i in range(num_locations)
+        if create_sensor_location_id("temperature", "City %d" % i) in sensor_ids
+    ]
+
+
+def test_the_pipeline_saves_all_locations_despite_flaky_calls(tmp_path):
+    provider = FakeDarkSky(failure_ratio=0.3, seed=169)
+    assert run_pipeline(tmp_path, provider, 10, concurrency=1) == ["City %d" % i for i in range(10)]
+    assert provider.failures > 0
+
+
+@pytest.mark.parametrize("exception", [SystemExit(1), KeyboardInterrupt()])
+def test_a_provider_which_exits_does_not_hang_the_pipeline(tmp_path, exception):
+    fake_darksky = FakeDarkSky()
+
+    def provider(api_key, location):
+        if location == (53.0, 5.0):
+            raise exception
+        return fake_darksky(api_key, location)
+
+    assert run_pipeline(tmp_path, provider, 5) == ["City 0", "City 2", "City 3", "City 4"]
+
+
+def test_the_pipeline_stops_waiting_for_a_lost_location(tmp_path):
+    with pytest.raises(Exception, match="stopped before all locations were fetched"):
+        run_pipeline(tmp_path, FakeDarkSky(), 3, pipeline_class=LosingPipeline)
@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+
+import pytz
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from timely_beliefs import DBBeliefSource, DBTimedBelief
+from timely_beliefs.db_base import Base as TBBase
+
+from weatherforecast.utils.dbconfig import DBLocatedSensor
+from weatherforecast.utils.forecast_query import iter_forecasts, iter_latest_belief_frames
+
+EVENT_START = datetime(2019, 3, 1, 12, tzinfo=pytz.utc)
+
+
+def beliefs_session(tmp_path):
+    """Two events of one sensor, each with beliefs 6, 3 and 1 hours ahead (of knowledge time)."""
+    engine = create_engine("sqlite:///%s" % (tmp_path / "forecasts.db"))
+    TBBase.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    source = DBBeliefSource(name="DarkSky")
+    sensor = DBLocatedSensor(
+        name="temperature",
+        latitude=52.0,
+        longitude=4.0,
+        location_name="Amsterdam",
+        event_resolution=timedelta(hours=1),
+    )
+    session.add_all([source, sensor])
+    session.commit()
+    rows = [
+        dict(
+            event_start=EVENT_START + timedelta(hours=event),
+            belief_horizon=timedelta(hours=horizon),
+            cumulative_probability=0.5,
+            event_value=float(10 * event + horizon),
+            sensor_id=sensor.id,
+            source_id=source.id,
+        )
+        for event in (0, 1)
+        for horizon in (6, 3, 1)
+    ]
+    with engine.begin() as connection:
+        connection.execute(DBTimedBelief.__table__.insert(), rows)
+    return session, sensor
+
+
+def read(session, sensor, **as_of):
+    frames = list(
+        iter_latest_belief_frames(
+            session,
+            [sensor],
+            EVENT_START,
+            EVENT_START + timedelta(hours=2),
+            chunk=timedelta(hours=1),
+            **as_of
+        )
+    )
+    assert len(frames) == 2  # one per chunk
+    return [value for frame in frames for value in frame["event_value"]]
+
+
+def test_latest_beliefs_per_event(tmp_path):
+    session, sensor = beliefs_session(tmp_path)
+    assert read(session, sensor) == [1.0, 11.0]
+
+
+def test_latest_beliefs_as_of_a_belief_horizon(tmp_path):
+    session, sensor = beliefs_session(tmp_path)
+    assert read(session, sensor, belief_horizon=timedelta(hours=2)) == [3.0, 13.0]
+    assert read(session, sensor, belief_horizon=timedelta(hours=6)) == [6.0, 16.0]
+
+
+def test_latest_beliefs_as_of_a_belief_time(tmp_path):
+    session, sensor = beliefs_session(tmp_path)
+    # knowledge time of the first event is 13:00, of the second 14:00
+    belief_time = EVENT_START - timedelta(hours=1, minutes=30)
+    assert read(session, sensor, belief_time=belief_time) == [3.0, 16.0]
+
+
+def test_forecasts_come_as_a_beliefs_data_frame_per_sensor(tmp_path):
+    session, sensor = beliefs_session(tmp_path)
+    chunks = list(
+        iter_forecasts(
+            session,
+            ["temperature"],
+            ["Amsterdam"],
+            EVENT_START,
+            EVENT_START + timedelta(hours=2),
+            belief_horizon=timedelta(hours=2),
+        )
+    )
+    assert len(chunks) == 1
+    bdf = chunks[0][sensor]
+    assert bdf["event_value"].tolist() == [3.0, 13.0]
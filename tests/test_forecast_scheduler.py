@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+import logging
+
+import pandas as pd
+import pytz
+
+from weatherforecast import forecast_scheduler
+from weatherforecast.forecast_scheduler import ForecastScheduler, slot_of
+from weatherforecast.utils import Settings
+from weatherforecast.utils.cycle_lock import CycleLock
+
+LOCATIONS = pd.DataFrame({"latitude": [52.0], "longitude": [4.0], "location_name": ["Amsterdam"]})
+
+
+def make_scheduler(tmp_path, monkeypatch, cycles: list) -> ForecastScheduler:
+    conf_file_path = str(tmp_path / "configuration.ini")
+    with open(conf_file_path, "w") as conf_file:
+        conf_file.write("[DARK_SKY]\nAPI_KEY: fake-key\n\n[SCHEDULER]\ninterval_minutes: 60\n")
+    scheduler = ForecastScheduler(Settings(conf_file_path), state_path=str(tmp_path / "state.txt"))
+    scheduler.lock = CycleLock(str(tmp_path / "fetch_cycle.lock"))
+    monkeypatch.setattr(scheduler, "prepare", lambda: None)
+    monkeypatch.setattr(scheduler, "locations", lambda: LOCATIONS)
+
+    def run_forecast_cycle(store, locations, settings):
+        cycles.append(datetime.now(pytz.utc))
+        scheduler.stop()
+        return store
+
+    monkeypatch.setattr(forecast_scheduler, "run_forecast_cycle", run_forecast_cycle)
+    return scheduler
+
+
+def test_slots_are_aligned_to_the_hour():
+    moment = datetime(2019, 3, 1, 10, 47, tzinfo=pytz.utc)
+    assert slot_of(moment, timedelta(hours=1), timedelta(0)) == datetime(2019, 3, 1, 10, tzinfo=pytz.utc)
+    assert slot_of(moment, timedelta(hours=1), timedelta(minutes=5)) == datetime(
+        2019, 3, 1, 10, 5, tzinfo=pytz.utc
+    )
+    assert slot_of(moment.replace(minute=3), timedelta(hours=1), timedelta(minutes=5)) == datetime(
+        2019, 3, 1, 9, 5, tzinfo=pytz.utc
+    )
+    assert slot_of(moment, timedelta(minutes=15), timedelta(0)) == moment.replace(minute=45)
+
+
+def test_missed_slots_are_caught_up_on_with_one_cycle(tmp_path, monkeypatch, caplog):
+    cycles = []
+    scheduler = make_scheduler(tmp_path, monkeypatch, cycles)
+    current_slot = slot_of(datetime.now(pytz.utc), scheduler.interval, scheduler.offset)
+    scheduler.write_last_slot(current_slot - 3 * scheduler.interval)
+
+    caplog.set_level(logging.INFO)
+    scheduler.run()
+    assert len(cycles) == 1
+    assert "Catching up on 2 missed slot(s)" in caplog.text
+    assert scheduler.read_last_slot() == current_slot
+
+
+def test_cycles_do_not_overlap(tmp_path, monkeypatch):
+    cycles = []
+    scheduler = make_scheduler(tmp_path, monkeypatch, cycles)
+    slot = datetime(2019, 3, 1, 10, tzinfo=pytz.utc)
+
+    # e.g. a get_new_forecasts.py run started by cron
+    other_cycle = CycleLock(scheduler.lock.lock_path)
+    assert other_cycle.acquire()
+    assert not scheduler.run_cycle(slot)
+    assert cycles == []
+
+    other_cycle.release()
+    assert scheduler.run_cycle(slot)
+    assert len(cycles) == 1
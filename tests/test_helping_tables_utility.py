@@ -0,0 +1,50 @@
+import pandas as pd
+
+from weatherforecast.utils import helping_tables_utility, location_utility
+from weatherforecast.utils.helping_tables_utility import (
+    create_sensor_location_id,
+    create_sensor_location_id_mapping_table,
+    get_sensor_location_id_maps,
+    get_sensor_location_id_mapping_table,
+)
+from weatherforecast.utils.Sensor import SensorName
+from weatherforecast.utils.weather_forecast_utility import (
+    get_sensor_location_by_id,
+    get_sensor_location_id,
+)
+
+LOCATIONS = pd.DataFrame(
+    {
+        "latitude": [52.37, 51.92],
+        "longitude": [4.90, 4.48],
+        "location_name": ["Amsterdam_North Holland_Netherlands", "Rotterdam_South Holland_Netherlands"],
+    }
+)
+
+
+def test_sensor_ids_resolve_both_ways(tmp_path, monkeypatch):
+    monkeypatch.setattr(helping_tables_utility, "path_to_data", lambda: str(tmp_path))
+    monkeypatch.setattr(location_utility, "get_all_cities_locations", lambda: LOCATIONS.copy())
+    try:
+        table = create_sensor_location_id_mapping_table()
+        sensor_names = SensorName.ALL.value
+        assert table.shape[0] == len(LOCATIONS) * len(sensor_names)
+        # one row per location per sensor, with the ids made for single sensors
+        first_rows = table.iloc[: len(sensor_names)]
+        assert list(first_rows["sensor"]) == sensor_names
+        assert set(first_rows["location_name"]) == {LOCATIONS["location_name"][0]}
+        assert list(table["id"]) == [
+            create_sensor_location_id(sensor, location_name)
+            for sensor, location_name in zip(table["sensor"], table["location_name"])
+        ]
+
+        # the saved table is read back (through the cache) for the lookups
+        assert get_sensor_location_id_mapping_table()["id"].tolist() == table["id"].tolist()
+        for sensor, location_name in [(sensor_names[0], LOCATIONS["location_name"][1]),
+                                      (sensor_names[-1], LOCATIONS["location_name"][0])]:
+            sensor_id = get_sensor_location_id(sensor, location_name)
+            assert sensor_id == create_sensor_location_id(sensor, location_name)
+            assert get_sensor_location_by_id(sensor_id) == (sensor, location_name)
+    finally:
+        get_sensor_location_id_mapping_table.cache_clear()
+        get_sensor_location_id_maps.cache_clear()
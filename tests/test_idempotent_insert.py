@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+import pytz
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+from timely_beliefs import DBTimedBelief
+from timely_beliefs.db_base import Base as TBBase
+
+from weatherforecast.get_new_forecasts import save_forecast_frame, select_new_forecasts
+from weatherforecast.utils import Settings
+
+EVENT_START = datetime(2019, 3, 1, 10, tzinfo=pytz.utc)
+
+
+def write_config(directory, persistence):
+    conf_file_path = str(directory / "configuration.ini")
+    with open(conf_file_path, "w") as conf_file:
+        conf_file.write(
+            "[DARK_SKY]\nAPI_KEY: key\n\n[PERSISTENCE]\ntype: db\nidempotent_insert: yes\n%s"
+            % persistence
+        )
+    return conf_file_path
+
+
+def frame(horizons_and_values):
+    return pd.DataFrame(
+        {
+            "event_start": pd.to_datetime([EVENT_START] * len(horizons_and_values), utc=True),
+            "belief_time": pd.to_datetime(
+                [EVENT_START - timedelta(hours=h) for h, _ in horizons_and_values], utc=True
+            ),
+            "belief_horizon": pd.to_timedelta([timedelta(hours=h) for h, _ in horizons_and_values]),
+            "event_value": [value for _, value in horizons_and_values],
+            "sensor_id": 1,
+            "cumulative_probability": 0.5,
+            "source_id": 1,
+        }
+    )
+
+
+def test_idempotent_insert_needs_bulk_insert_for_belief_objects(tmp_path):
+    with pytest.raises(Exception, match="idempotent_insert"):
+        Settings(write_config(tmp_path, "bulk_insert: no\nextraction: objects\n"))
+    assert Settings(write_config(tmp_path, "bulk_insert: no\nextraction: columnar\n")).idempotent_insert
+    assert Settings(write_config(tmp_path, "bulk_insert: yes\nextraction: objects\n")).idempotent_insert
+
+
+def test_saving_the_same_beliefs_twice_skips_them(tmp_path):
+    settings = Settings(write_config(tmp_path, "extraction: columnar\n"))
+    engine = create_engine("sqlite://")
+    TBBase.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    beliefs = frame([(2, 1.0), (3, 2.0)])
+    session = save_forecast_frame(beliefs, session, settings)
+    # e.g. another worker which got there first
+    session = save_forecast_frame(beliefs, session, settings)
+    # a belief about the same event at another horizon is another belief
+    session = save_forecast_frame(frame([(1, 2.0)]), session, settings)
+
+    count = session.execute(select(func.count()).select_from(DBTimedBelief.__table__)).scalar()
+    assert count == 3
+
+
+def test_forecasts_are_new_if_they_differ_from_the_latest_known_belief():
+    known = frame([(3, 1.0), (5, 2.0)])
+    current = frame([(2, 1.0), (2, 7.0), (3, 9.0)])
+    new = select_new_forecasts(current, known, "belief_horizon", latest_is_smallest=True)
+    # the same value as the latest belief is not new, nor compared with a belief just as recent
+    assert new["event_value"].tolist() == [7.0, 9.0]
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+import pytz
+
+from weatherforecast import get_new_forecasts
+from weatherforecast.benchmarks.fake_darksky import FakeDarkSky
+from weatherforecast.get_new_forecasts import run_forecast_cycle
+from weatherforecast.utils import Settings, weather_forecast_utility
+from weatherforecast.utils.file_store import PartitionedFileStore
+from weatherforecast.utils.helping_tables_utility import create_sensor_location_id
+from weatherforecast.utils.weather_forecast_utility import darksky_provider
+
+LOCATIONS = pd.DataFrame(
+    {
+        "latitude": [52.0, 53.0],
+        "longitude": [4.0, 5.0],
+        "location_name": ["Amsterdam", "Groningen"],
+        "location_key": ["amsterdam", "groningen"],
+    }
+)
+
+
+def write_settings(directory, ingestion: str, sensors: str = "") -> Settings:
+    conf_file_path = str(directory / "configuration.ini")
+    with open(conf_file_path, "w") as conf_file:
+        conf_file.write(
+            "[DARK_SKY]\nAPI_KEY: fake-key\n\n[INGESTION]\n%s\n\n[SENSORS]\n%s\n\n"
+            "[PERSISTENCE]\ntype: file\nextraction: columnar\n" % (ingestion, sensors)
+        )
+    return Settings(conf_file_path)
+
+
+class FakeResponse:
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {}
+
+
+@pytest.mark.parametrize(
+    "ingestion, exclude, extend",
+    [
+        ("hours: 12", "currently,minutely,daily,alerts,flags", None),
+        ("hours: 72\nexclude: minutely, alerts", "minutely,alerts", "hourly"),
+    ],
+)
+def test_requests_ask_only_for_what_is_saved(ingestion, exclude, extend, tmp_path, monkeypatch):
+    requests_made = []
+    monkeypatch.setattr(
+        weather_forecast_utility.requests,
+        "get",
+        lambda url, params, **kwargs: requests_made.append(params) or FakeResponse(),
+    )
+    darksky_provider(write_settings(tmp_path, ingestion))("fake-key", (52.0, 4.0))
+
+    params = requests_made[0]
+    assert params.get("exclude") == exclude
+    assert params.get("extend") == extend
+
+
+def test_unknown_sensors_are_refused(tmp_path):
+    with pytest.raises(Exception, match="Unknown sensor"):
+        write_settings(tmp_path, "hours: 3", sensors="amsterdam: temperature, sunshine")
+
+
+def test_each_location_gets_its_own_sensors(tmp_path, monkeypatch):
+    monkeypatch.setattr(get_new_forecasts, "path_to_data", lambda: str(tmp_path))
+    settings = write_settings(
+        tmp_path, "hours: 3\nsensors: temperature, windSpeed", sensors="amsterdam: humidity"
+    )
+    store = PartitionedFileStore(str(tmp_path / "forecasts"), sensor_ids=create_sensor_location_id)
+    store = run_forecast_cycle(store, LOCATIONS, settings, provider=FakeDarkSky())
+
+    now = datetime.now(pytz.utc)
+    saved = store.read(now - timedelta(days=1), now + timedelta(days=1))
+    assert saved["sensor_id"].value_counts().to_dict() == {
+        create_sensor_location_id("humidity", "Amsterdam"): 3,
+        create_sensor_location_id("temperature", "Groningen"): 3,
+        create_sensor_location_id("windSpeed", "Groningen"): 3,
+    }
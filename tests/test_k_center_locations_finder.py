@@ -0,0 +1,37 @@
+import pandas as pd
+import pytest
+
+from weatherforecast.utils.haversine import haversine_distance_vec
+from weatherforecast.utils.k_center_locations_finder import KCenterLocationsFinder, coverage_radius_km
+
+CITIES = pd.DataFrame(
+    {
+        "location_name": ["Amsterdam", "Rotterdam", "Groningen", "Maastricht", "Utrecht", "Vlissingen"],
+        "latitude": [52.37, 51.92, 53.22, 50.85, 52.09, 51.44],
+        "longitude": [4.90, 4.48, 6.57, 5.69, 5.12, 3.57],
+    }
+)
+
+
+def test_k_center_picks_the_farthest_cities():
+    finder = KCenterLocationsFinder(CITIES, 3)
+    # Groningen is farthest from the mean coordinate, Vlissingen from Groningen,
+    # and Maastricht from both
+    selected = finder.find_optimal_locations()
+    assert list(selected["location_name"]) == ["Groningen", "Vlissingen", "Maastricht"]
+    # the same call as for the genetic search, which gives the same (deterministic) result
+    selected_again = finder.find_optimal_locations(population_size=10, generations=1, seed=1)
+    assert list(selected_again["location_name"]) == list(selected["location_name"])
+
+
+def test_too_few_cities_are_all_picked():
+    assert KCenterLocationsFinder(CITIES, 10).find_optimal_locations().equals(CITIES)
+
+
+def test_coverage_radius_is_the_distance_to_the_farthest_covered_city():
+    finder = KCenterLocationsFinder(CITIES, 3)
+    coordinates = finder.coordinates
+    # Amsterdam is the city farthest from its nearest pick (Vlissingen)
+    expected = haversine_distance_vec(52.37, 4.90, 51.44, 3.57)
+    assert coverage_radius_km(coordinates, [2, 5, 3]) == pytest.approx(expected, rel=1e-6)
+    assert coverage_radius_km(coordinates, list(range(len(CITIES)))) == pytest.approx(0, abs=1e-6)
@@ -0,0 +1,46 @@
+import pandas as pd
+
+from weatherforecast.utils import location_utility
+from weatherforecast.utils.location_utility import CityIndex
+
+CITIES = pd.DataFrame(
+    {
+        "continent_name": ["Europe", "Europe", "Europe", "North America"],
+        "country_name": ["Netherlands", "Netherlands", "Germany", "United States"],
+        "subdivision_1_name": ["North Holland", "South Holland", "", "Texas"],
+        "city_name": ["Amsterdam", "Rotterdam", "Berlin", "Amsterdam"],
+        "time_zone": ["Europe/Amsterdam", "Europe/Amsterdam", "Europe/Berlin", "America/Chicago"],
+        "is_in_european_union": [1, 1, 1, 0],
+        "latitude": [52.37, 51.92, 52.52, 29.0],
+        "longitude": [4.90, 4.48, 13.40, -96.0],
+    }
+)
+
+
+def test_lookups_find_the_same_cities_as_a_scan(monkeypatch):
+    monkeypatch.setattr(location_utility, "get_city_index", lambda: CityIndex(CITIES))
+
+    amsterdam = location_utility.get_city_location("Amsterdam", "Netherlands")
+    assert amsterdam.to_dict("records") == [
+        {"latitude": 52.37, "longitude": 4.90, "location_name": "Amsterdam_North Holland_Netherlands"}
+    ]
+    assert list(location_utility.get_city_location("Amsterdam", "United States", "Texas")["latitude"]) == [29.0]
+    assert location_utility.get_city_location("Amsterdam", "Germany").empty
+    assert location_utility.get_city_location("Amsterdam", "Netherlands", "Texas").empty
+
+    def names(locations):
+        return list(locations["location_name"])
+
+    assert names(location_utility.get_cities_locations_by_country("Netherlands")) == [
+        "Amsterdam_North Holland_Netherlands",
+        "Rotterdam_South Holland_Netherlands",
+    ]
+    assert names(location_utility.get_cities_locations_by_continent("Europe")) == names(
+        location_utility.get_cities_locations_in_european_union()
+    )
+    assert names(location_utility.get_cities_locations_by_time_zone("Europe/Berlin")) == ["Berlin__Germany"]
+    assert names(location_utility.get_cities_locations_by_subdivision("Texas")) == [
+        "Amsterdam_Texas_United States"
+    ]
+    assert location_utility.get_cities_locations_by_country("Belgium").empty
+    assert len(location_utility.get_all_cities_locations()) == len(CITIES)
@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta
+
+import pytz
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from timely_beliefs import DBBeliefSource, DBTimedBelief
+from timely_beliefs.db_base import Base as TBBase
+
+from weatherforecast.get_new_forecasts import db_forecast_is_new, db_forecasts_are_new
+from weatherforecast.utils.dbconfig import DBLocatedSensor
+
+EVENT_START = datetime(2019, 3, 1, 12, tzinfo=pytz.utc)
+
+
+def test_a_forecast_which_changes_back_is_new(tmp_path):
+    engine = create_engine("sqlite:///%s" % (tmp_path / "forecasts.db"))
+    TBBase.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    source = DBBeliefSource(name="DarkSky")
+    sensor = DBLocatedSensor(
+        name="temperature",
+        latitude=52.0,
+        longitude=4.0,
+        location_name="Amsterdam",
+        event_resolution=timedelta(minutes=15),
+    )
+
+    def belief(hours_before: int, value: float) -> DBTimedBelief:
+        return DBTimedBelief(
+            event_start=EVENT_START,
+            belief_time=EVENT_START - timedelta(hours=hours_before),
+            source=source,
+            sensor=sensor,
+            event_value=value,
+        )
+
+    # first x, then y
+    session.add_all([belief(3, 1.0), belief(2, 2.0)])
+    session.commit()
+
+    # x again differs from the latest belief (y), while y again does not
+    current_forecasts = [belief(1, 1.0), belief(1, 2.0)]
+    assert db_forecasts_are_new(session, current_forecasts) == [True, False]
+    assert [db_forecast_is_new(session, fc) for fc in current_forecasts] == [True, False]
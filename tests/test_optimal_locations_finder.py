@@ -0,0 +1,71 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("deap")
+pytest.importorskip("area")
+
+from weatherforecast.utils import optimal_locations_finder
+from weatherforecast.utils.haversine import haversine_distance_vec
+from weatherforecast.utils.optimal_locations_finder import OptimalLocationsFinder
+
+NEW_LOCATIONS_SIZE = 6
+
+
+def cities(num_cities: int = 40) -> pd.DataFrame:
+    rng = np.random.RandomState(169)
+    return pd.DataFrame(
+        {
+            "latitude": rng.uniform(50.8, 53.5, num_cities),
+            "longitude": rng.uniform(3.4, 7.2, num_cities),
+            "location_name": ["city_%d" % i for i in range(num_cities)],
+        }
+    )
+
+
+def original_fitness(finder: OptimalLocationsFinder, individual) -> float:
+    """The fitness as it was computed per individual, before the distance matrix"""
+    if len(individual) == 1:
+        return 0
+    if len(individual) > len(set(individual)):
+        return -6371
+    selected_locations = finder.locations.iloc[individual, :].copy()
+    locations_matrix = finder.create_locations_matrix(selected_locations)
+    distances = haversine_distance_vec(
+        locations_matrix["latitude_1"],
+        locations_matrix["longitude_1"],
+        locations_matrix["latitude_2"],
+        locations_matrix["longitude_2"],
+    )
+    fitness = distances.median()
+    if len(individual) > 4:
+        fitness += finder.calculate_area(selected_locations)
+    return fitness
+
+
+def population(num_cities: int) -> list:
+    random.seed(169)
+    individuals = [random.sample(range(num_cities), NEW_LOCATIONS_SIZE) for _ in range(50)]
+    # besides valid individuals, one with a repeated location and a smaller one
+    individuals.append([0, 1, 2, 2, 3, 4])
+    individuals.append([5, 6, 7])
+    return individuals
+
+
+@pytest.mark.parametrize("with_distance_matrix", [True, False])
+def test_batched_fitness_equals_the_original_fitness(with_distance_matrix, monkeypatch):
+    if not with_distance_matrix:
+        monkeypatch.setattr(optimal_locations_finder, "MAX_LOCATIONS_FOR_DISTANCE_MATRIX", 0)
+    locations = cities()
+    finder = OptimalLocationsFinder(locations, NEW_LOCATIONS_SIZE)
+    assert (finder.distances is not None) == with_distance_matrix
+    individuals = population(locations.shape[0])
+
+    expected = [original_fitness(finder, individual) for individual in individuals]
+    # the distance matrix is kept in single precision
+    assert [fitness for fitness, in finder.evaluate_population(individuals)] == pytest.approx(expected, rel=1e-5)
+    assert [finder._eval_solution(individual)[0] for individual in individuals] == pytest.approx(
+        expected, rel=1e-5
+    )
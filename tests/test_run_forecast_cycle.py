@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytz
+
+from weatherforecast import get_new_forecasts
+from weatherforecast.benchmarks.fake_darksky import FakeDarkSky
+from weatherforecast.get_new_forecasts import run_forecast_cycle
+from weatherforecast.utils import Settings
+from weatherforecast.utils.file_store import PartitionedFileStore
+from weatherforecast.utils.helping_tables_utility import create_sensor_location_id
+
+
+def write_settings(directory, pipelined=False):
+    conf_file_path = str(directory / "configuration.ini")
+    with open(conf_file_path, "w") as conf_file:
+        conf_file.write(
+            "[DARK_SKY]\nAPI_KEY: fake-key\nconcurrency: 2\n\n"
+            "[PERSISTENCE]\ntype: file\nextraction: columnar\nskip_unchanged: no\n\n"
+            "[PIPELINE]\nenabled: %s\n" % ("yes" if pipelined else "no")
+        )
+    return Settings(conf_file_path)
+
+
+def locations(num_locations):
+    return pd.DataFrame(
+        {
+            "latitude": [52.0 + i for i in range(num_locations)],
+            "longitude": [4.0 + i for i in range(num_locations)],
+            "location_name": ["City %d" % i for i in range(num_locations)],
+            "location_key": ["city%d" % i for i in range(num_locations)],
+        }
+    )
+
+
+def test_a_file_store_can_make_its_own_sensor_ids(tmp_path, monkeypatch):
+    # no sensor/location mapping table in this data directory
+    monkeypatch.setattr(get_new_forecasts, "path_to_data", lambda: str(tmp_path))
+    store = PartitionedFileStore(
+        str(tmp_path / "forecasts"), sensor_ids=create_sensor_location_id
+    )
+    for pipelined in (False, True):
+        settings = write_settings(tmp_path, pipelined=pipelined)
+        (tmp_path / settings.fetch_state_path).unlink(missing_ok=True)  # due again
+        store = run_forecast_cycle(store, locations(2), settings, provider=FakeDarkSky())
+
+    now = datetime.now(pytz.utc)
+    df = store.read(now - timedelta(days=1), now + timedelta(days=3))
+    assert set(df["sensor_id"]) >= {
+        create_sensor_location_id("temperature", "City 0"),
+        create_sensor_location_id("temperature", "City 1"),
+    }
+
+
+def test_a_failing_run_report_does_not_fail_the_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(get_new_forecasts, "path_to_data", lambda: str(tmp_path))
+    monkeypatch.setattr(
+        get_new_forecasts, "_fetch_and_save", lambda store, *args: store
+    )
+    (tmp_path / "not_a_directory").write_text("")
+    conf_file_path = str(tmp_path / "configuration.ini")
+    with open(conf_file_path, "w") as conf_file:
+        conf_file.write(
+            "[DARK_SKY]\nAPI_KEY: fake-key\n\n"
+            "[REPORTING]\nrun_report: not_a_directory/runs.jsonl\n"
+        )
+    store = PartitionedFileStore(str(tmp_path / "forecasts"))
+
+    assert run_forecast_cycle(store, pd.DataFrame(), Settings(conf_file_path)) is store
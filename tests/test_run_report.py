@@ -0,0 +1,52 @@
+import json
+
+import pandas as pd
+
+from weatherforecast import get_new_forecasts
+from weatherforecast.benchmarks.fake_darksky import FakeDarkSky
+from weatherforecast.get_new_forecasts import run_forecast_cycle
+from weatherforecast.utils import Settings
+from weatherforecast.utils.file_store import PartitionedFileStore
+from weatherforecast.utils.helping_tables_utility import create_sensor_location_id
+
+LOCATIONS = pd.DataFrame(
+    {"latitude": [52.0, 53.0], "longitude": [4.0, 5.0], "location_name": ["Amsterdam", "Groningen"]}
+)
+
+
+def test_the_run_report_counts_beliefs_per_run_and_per_city(tmp_path, monkeypatch):
+    monkeypatch.setattr(get_new_forecasts, "path_to_data", lambda: str(tmp_path))
+    conf_file_path = str(tmp_path / "configuration.ini")
+    with open(conf_file_path, "w") as conf_file:
+        conf_file.write(
+            "[DARK_SKY]\nAPI_KEY: fake-key\n\n"
+            "[INGESTION]\nhours: 3\nsensors: temperature, windSpeed\n\n"
+            "[PERSISTENCE]\ntype: file\nextraction: columnar\n\n"
+            "[REPORTING]\nrun_report: %s\nprometheus_textfile: %s\n"
+            % (tmp_path / "runs.jsonl", tmp_path / "weatherforecast.prom")
+        )
+    settings = Settings(conf_file_path)
+    store = PartitionedFileStore(str(tmp_path / "forecasts"), sensor_ids=create_sensor_location_id)
+    provider = FakeDarkSky()
+
+    store = run_forecast_cycle(store, LOCATIONS, settings, provider=provider)
+    (tmp_path / settings.fetch_state_path).unlink()  # due again
+    # the same forecasts again, which are all known
+    run_forecast_cycle(store, LOCATIONS, settings, provider=provider)
+
+    with open(str(tmp_path / "runs.jsonl")) as report_file:
+        first_run, second_run = [json.loads(line) for line in report_file]
+    assert first_run["counters"]["darksky_requests"] == 2
+    assert first_run["counters"]["beliefs_created"] == first_run["counters"]["beliefs_written"] == 2 * 3 * 2
+    assert first_run["counters"].get("beliefs_deduped", 0) == 0
+    assert first_run["cities"]["Groningen"]["beliefs_written"] == 3 * 2
+    assert second_run["counters"]["beliefs_deduped"] == 2 * 3 * 2
+    assert second_run["counters"].get("beliefs_written", 0) == 0
+    assert second_run["cities"]["Amsterdam"]["beliefs_deduped"] == 3 * 2
+    stages = first_run["stages"]
+    assert {"create_forecast_frame", "filter_out_known_forecast_frame", "save_forecast_frame"} <= set(stages)
+    assert stages["call_darksky"]["calls"] == 2
+
+    # the textfile is of the last run
+    prometheus_lines = (tmp_path / "weatherforecast.prom").read_text().splitlines()
+    assert 'weatherforecast_city_beliefs_deduped{city="Amsterdam"} 6' in prometheus_lines
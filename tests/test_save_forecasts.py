@@ -0,0 +1,43 @@
+import logging
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+from timely_beliefs import DBTimedBelief
+from timely_beliefs.db_base import Base as TBBase
+
+from weatherforecast import get_new_forecasts
+from weatherforecast.benchmarks.fake_darksky import FakeDarkSky
+from weatherforecast.get_new_forecasts import run_forecast_cycle
+from weatherforecast.utils import Settings, dbconfig
+
+
+@pytest.mark.parametrize("bulk_insert", ["yes", "no"])
+def test_belief_objects_are_inserted(bulk_insert, tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(get_new_forecasts, "path_to_data", lambda: str(tmp_path))
+    conf_file_path = str(tmp_path / "configuration.ini")
+    with open(conf_file_path, "w") as conf_file:
+        conf_file.write(
+            "[DARK_SKY]\nAPI_KEY: fake-key\n\n"
+            "[INGESTION]\nhours: 3\nsensors: temperature, windSpeed\n\n"
+            "[PERSISTENCE]\ntype: db\nbulk_insert: %s\nextraction: objects\n" % bulk_insert
+        )
+    settings = Settings(conf_file_path)
+    engine = create_engine("sqlite:///%s" % (tmp_path / "forecasts.db"))
+    TBBase.metadata.create_all(engine)
+    session = sessionmaker(bind=engine, expire_on_commit=False)()
+    dbconfig.create_darksky_source(session)
+    dbconfig.sensor_registry.warm(session)
+    locations = pd.DataFrame(
+        {"latitude": [52.0], "longitude": [4.0], "location_name": ["Amsterdam"]}
+    )
+
+    caplog.set_level(logging.DEBUG)  # the novelty check logs each belief
+    provider = FakeDarkSky()
+    session = run_forecast_cycle(session, locations, settings, provider=provider)
+    # the same forecasts again are all known
+    session = run_forecast_cycle(session, locations, settings, provider=provider)
+
+    count = session.execute(select(func.count()).select_from(DBTimedBelief.__table__)).scalar()
+    assert count == 3 * 2
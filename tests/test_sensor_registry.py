@@ -0,0 +1,44 @@
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from timely_beliefs.db_base import Base as TBBase
+
+from weatherforecast.utils.dbconfig import SensorRegistry
+
+LOCATIONS = [(52.37, 4.90, "Amsterdam"), (51.92, 4.48, "Rotterdam")]
+
+
+def test_known_sensors_need_no_queries(tmp_path):
+    engine = create_engine("sqlite:///%s" % (tmp_path / "forecasts.db"))
+    TBBase.metadata.create_all(engine)
+    session = sessionmaker(bind=engine, expire_on_commit=False)()
+    statements = []
+    event.listen(
+        engine,
+        "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement.lstrip().split()[0].upper()),
+    )
+    commits = []
+    event.listen(engine, "commit", lambda conn: commits.append(conn))
+
+    registry = SensorRegistry()
+    sensors = registry.get_or_create_sensors_for_locations(
+        session, LOCATIONS, sensor_names_per_location=[["temperature", "windSpeed"], ["temperature"]]
+    )
+    assert [[sensor.name for sensor in location_sensors] for location_sensors in sensors] == [
+        ["temperature", "windSpeed"],
+        ["temperature"],
+    ]
+    assert sensors[0][0].location_name == "Amsterdam"
+    # one query to warm the registry, and the missing sensors are created together
+    assert statements.count("SELECT") == 1
+    assert len(commits) == 1
+
+    statements.clear()
+    again = registry.get_or_create_sensors_for_locations(session, LOCATIONS[:1], ["temperature", "windSpeed"])
+    assert again == sensors[:1]
+    assert statements == []
+
+    # another process warms its registry with the sensors which were created
+    other_registry = SensorRegistry()
+    other_registry.warm(sessionmaker(bind=engine)())
+    assert set(other_registry.sensors.keys()) == set(registry.sensors.keys())
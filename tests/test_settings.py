@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from weatherforecast import utils
+from weatherforecast.forecast_scheduler import ForecastScheduler
+from weatherforecast.utils import Settings, get_settings
+
+
+def write_config(path, concurrency):
+    with open(path, "w") as conf_file:
+        conf_file.write("[DARK_SKY]\nAPI_KEY: key\nconcurrency: %d\n" % concurrency)
+
+
+def test_settings_are_only_reparsed_on_request(tmp_path, monkeypatch):
+    conf_file_path = str(tmp_path / "configuration.ini")
+    write_config(conf_file_path, 2)
+    monkeypatch.setattr(utils, "_settings", Settings(conf_file_path))
+
+    write_config(conf_file_path, 4)
+    os.utime(conf_file_path, (1, 1))  # a different modification time, also on coarse file systems
+    assert get_settings().concurrency == 2
+    assert get_settings(reload=True).concurrency == 4
+
+
+def test_an_invalid_edit_keeps_the_previous_settings(tmp_path):
+    conf_file_path = str(tmp_path / "configuration.ini")
+    write_config(conf_file_path, 2)
+    settings = Settings(conf_file_path)
+
+    with open(conf_file_path, "w") as conf_file:
+        conf_file.write("[DARK_SKY]\nAPI_KEY: key\nconcurrency: many\n")
+    os.utime(conf_file_path, (1, 1))
+    with pytest.raises(ValueError):
+        settings.reload_if_changed()
+    assert settings.concurrency == 2
+    # the edit is parsed again on the next reload, also if it was not changed since
+    with pytest.raises(ValueError):
+        settings.reload_if_changed()
+
+    write_config(conf_file_path, 4)
+    os.utime(conf_file_path, (2, 2))
+    assert settings.reload_if_changed()
+    assert settings.concurrency == 4
+
+
+def test_the_scheduler_goes_on_with_the_previous_settings(tmp_path, caplog):
+    conf_file_path = str(tmp_path / "configuration.ini")
+    write_config(conf_file_path, 2)
+    scheduler = ForecastScheduler(Settings(conf_file_path), state_path=str(tmp_path / "state.txt"))
+
+    with open(conf_file_path, "w") as conf_file:
+        conf_file.write("[DARK_SKY\nAPI_KEY: key\n")
+    os.utime(conf_file_path, (1, 1))
+    scheduler.reload_settings()
+    assert scheduler.settings.concurrency == 2
+    assert "Cannot reload the configuration file" in caplog.text
@@ -0,0 +1,93 @@
+import pandas as pd
+from sqlalchemy import MetaData, create_engine, func, select
+from sqlalchemy.sql.elements import TextClause
+from timely_beliefs.db_base import Base as TBBase
+
+from weatherforecast.utils import dbconfig
+from weatherforecast.utils.dbconfig import DBForecastFingerprint, DBLocationClaim
+from weatherforecast.utils.sharding import LocationClaims, select_shard
+
+LOCATIONS = pd.DataFrame({"location_name": ["Amsterdam", "Berlin", "Cairo", "Delhi", "Essen"]})
+
+
+def sqlite_engine(tmp_path):
+    engine = create_engine("sqlite:///%s" % (tmp_path / "claims.db"))
+    TBBase.metadata.create_all(engine)
+    return engine
+
+
+def test_shards_split_the_locations():
+    shards = [select_shard(LOCATIONS, index, 3) for index in range(3)]
+    names = [name for shard in shards for name in shard["location_name"]]
+    assert sorted(names) == list(LOCATIONS["location_name"])
+
+
+def test_claims_fall_back_to_a_table_on_sqlite(tmp_path):
+    engine = sqlite_engine(tmp_path)
+    first, second = LocationClaims(engine), LocationClaims(engine)
+    second.worker = "other-worker"
+
+    first_batch = first.claim(LOCATIONS, batch_size=2)
+    second_batch = second.claim(LOCATIONS, batch_size=10)
+    assert list(first_batch["location_name"]) == ["Amsterdam", "Berlin"]
+    assert list(second_batch["location_name"]) == ["Cairo", "Delhi", "Essen"]
+    # locations which were tried before are not tried again
+    assert first.claim(LOCATIONS, batch_size=10).empty
+
+    first.release()
+    with engine.connect() as connection:
+        claimed = connection.execute(select(DBLocationClaim.location_name)).scalars().all()
+    assert sorted(claimed) == ["Cairo", "Delhi", "Essen"]
+    assert list(first.claim(LOCATIONS, batch_size=10)["location_name"]) == ["Amsterdam", "Berlin"]
+
+
+def test_stale_claims_are_taken_over(tmp_path):
+    engine = sqlite_engine(tmp_path)
+    with engine.begin() as connection:
+        connection.execute(
+            DBLocationClaim.__table__.insert(),
+            {"location_name": "Berlin", "worker": "dead-worker", "claimed_at": 0},
+        )
+    assert list(LocationClaims(engine).claim(LOCATIONS)["location_name"]) == list(
+        LOCATIONS["location_name"]
+    )
+
+
+def test_staging_sql_runs_as_text(tmp_path, monkeypatch):
+    engine = sqlite_engine(tmp_path)
+    table = DBForecastFingerprint.__table__
+    rows = [
+        {"location_name": "Amsterdam", "window_start": 1, "fingerprint": "new"},
+        {"location_name": "Berlin", "window_start": 1, "fingerprint": "new"},
+    ]
+
+    def copy_into_staging_table(connection, table, rows, table_name=None):
+        # COPY is PostgreSQL only, so the rows go into the staging table with a plain insert
+        connection.execute(staging_table.insert(), rows)
+
+    monkeypatch.setattr(dbconfig, "_copy_rows", copy_into_staging_table)
+    with engine.begin() as connection:
+        # a staging table like the one _create_staging_table makes (LIKE is PostgreSQL only)
+        staging_table = table.to_metadata(MetaData(), name="%s_staging" % table.name)
+        staging_table.create(connection)
+        connection.execute(
+            table.insert(), {"location_name": "Amsterdam", "window_start": 1, "fingerprint": "old"}
+        )
+        assert dbconfig._copy_rows_skipping_existing(connection, table, rows) == 1
+        assert connection.execute(select(func.count()).select_from(staging_table)).scalar() == 0
+        fingerprints = dict(connection.execute(select(table.c.location_name, table.c.fingerprint)).all())
+    assert fingerprints == {"Amsterdam": "old", "Berlin": "new"}
+
+
+def test_staging_table_is_created_through_text():
+    class RecordingConnection:
+        def __init__(self):
+            self.statements = []
+
+        def execute(self, statement, *args):
+            self.statements.append(statement)
+
+    connection = RecordingConnection()
+    dbconfig._create_staging_table(connection, DBForecastFingerprint.__table__)
+    assert isinstance(connection.statements[0], TextClause)
+    assert "forecast_fingerprint_staging (LIKE forecast_fingerprint" in connection.statements[0].text
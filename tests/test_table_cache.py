@@ -0,0 +1,18 @@
+import os
+
+import pandas as pd
+
+from weatherforecast.utils import table_cache
+
+
+def test_cache_depends_on_how_the_table_is_read(tmp_path, monkeypatch):
+    monkeypatch.setattr(table_cache, "path_to_cache", lambda: str(tmp_path / "cache"))
+    csv_path = str(tmp_path / "table.csv")
+    pd.DataFrame({"a": [1, 2], "b": [3, 4]}).to_csv(csv_path, index=False)
+
+    assert table_cache.read_csv_cached(csv_path).columns.tolist() == ["a", "b"]
+    assert table_cache.read_csv_cached(csv_path, usecols=["a"]).columns.tolist() == ["a"]
+    # both read from their own cache now
+    assert table_cache.read_csv_cached(csv_path).columns.tolist() == ["a", "b"]
+    assert len(os.listdir(str(tmp_path / "cache"))) == 2
+    assert not any(name.endswith(".tmp") for name in os.listdir(str(tmp_path / "cache")))
@@ -16,7 +16,9 @@ if __name__ == "__main__":
 
     logging.info("Number of locations in {}: {}".format(location, locations.shape[0]))
     optimal_locations_finder = OptimalLocationsFinder(locations, 60)
-    optimal_locations = optimal_locations_finder.find_optimal_locations()
+    optimal_locations = optimal_locations_finder.find_optimal_locations(
+        population_size=500, generations=10, seed=169, processes=4, runs=4
+    )
 
     location_utility.plot_locations_on_map(location, optimal_locations)
     # location_utility.plot_locations_on_map(location, locations)
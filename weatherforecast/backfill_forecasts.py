@@ -0,0 +1,226 @@
+from typing import Callable, Dict, Iterator, List, Set, Tuple
+import argparse
+import os
+import re
+import logging
+import threading
+from datetime import datetime
+from multiprocessing import Pool
+
+import pytz
+import pandas as pd
+
+try:
+    from orjson import loads as json_loads  # much faster, if installed
+except ImportError:
+    from json import loads as json_loads
+
+from weatherforecast.utils import get_settings, location_utility, Settings
+from weatherforecast.utils.weather_forecast_utility import (
+    ARCHIVE_DIRECTORY_FORMAT,
+    create_forecasts_from_responses,
+)
+from weatherforecast.utils.dbconfig import create_db_and_session
+from weatherforecast.utils.forecast_archive import (
+    FETCH_TIME_FORMAT,
+    INDEX_FILE_NAME,
+    ForecastArchive,
+)
+from weatherforecast.get_new_forecasts import (
+    create_file_store,
+    filter_out_known_forecast,
+    save_forecasts,
+)
+
+"""
+This module loads forecasts which were archived as JSON files (see save_forecasts_as_json) into the
+database or file store, as if they had been fetched at the time in the name of their directory.
+Directories are parsed in a process pool and loaded one at a time. Each loaded directory is recorded in a
+checkpoint file, so an interrupted backfill can be started again and continues where it stopped:
+
+    python weatherforecast/backfill_forecasts.py /path/to/archive --processes 4
+
+An archive of compressed segments (see ForecastArchive) is loaded the same way, one fetch run at a time,
+if the directory holds its index file.
+"""
+
+FILE_NAME_PATTERN = re.compile(r"^forecast_lat_(.+)_lng_(.+)\.json$")
+CHECKPOINT_FILE_NAME = "backfill_checkpoint.txt"
+
+
+def archive_directories(data_path: str) -> List[str]:
+    """Names of the archive directories in data_path, oldest first"""
+    names = []
+    for name in os.listdir(data_path):
+        try:
+            datetime.strptime(name, ARCHIVE_DIRECTORY_FORMAT)
+        except ValueError:
+            continue
+        if os.path.isdir(os.path.join(data_path, name)):
+            names.append(name)
+    return sorted(names)
+
+
+def read_checkpoint(data_path: str) -> Set[str]:
+    checkpoint_path = os.path.join(data_path, CHECKPOINT_FILE_NAME)
+    if not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path) as checkpoint_file:
+        return {line.strip() for line in checkpoint_file if line.strip() != ""}
+
+
+def mark_done(data_path: str, directory_name: str):
+    with open(os.path.join(data_path, CHECKPOINT_FILE_NAME), "a") as checkpoint_file:
+        checkpoint_file.write(directory_name + "\n")
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+
+
+def parse_archive_directory(
+    args: Tuple[str, str, int, List[str]]
+) -> Tuple[str, List[Tuple[float, float, dict]]]:
+    """Parse all forecast files in one archive directory (this runs in a worker process).
+    Only the hours and sensors we need are kept, which keeps the result small to send back."""
+    data_path, directory_name, num_hours, sensor_names = args
+    directory_path = os.path.join(data_path, directory_name)
+    parsed = []
+    for file_name in sorted(os.listdir(directory_path)):
+        match = FILE_NAME_PATTERN.match(file_name)
+        if match is None:
+            continue
+        with open(os.path.join(directory_path, file_name), "rb") as forecast_file:
+            forecasts = json_loads(forecast_file.read())
+        parsed.append(
+            (
+                float(match.group(1)),
+                float(match.group(2)),
+                _keep_needed(forecasts, num_hours, sensor_names),
+            )
+        )
+    return directory_name, parsed
+
+
+def parse_archive_run(
+    args: Tuple[str, str, List[Tuple[float, float, str, int, int]], int, List[str]]
+) -> Tuple[str, List[Tuple[float, float, dict]]]:
+    """Like parse_archive_directory, for the responses of one fetch run in a ForecastArchive"""
+    data_path, fetch_time_str, entries, num_hours, sensor_names = args
+    archive = ForecastArchive(data_path)
+    parsed = [
+        (
+            latitude,
+            longitude,
+            _keep_needed(archive.read_entry(segment, offset, length), num_hours, sensor_names),
+        )
+        for latitude, longitude, segment, offset, length in entries
+    ]
+    return fetch_time_str, parsed
+
+
+def _keep_needed(forecasts: dict, num_hours: int, sensor_names: List[str]) -> dict:
+    hourly_data = [
+        dict(time=hour["time"], **{name: hour[name] for name in sensor_names if name in hour})
+        for hour in forecasts.get("hourly", {}).get("data", [])[:num_hours]
+    ]
+    return {"hourly": {"data": hourly_data}}
+
+
+def location_names_by_coordinates() -> Dict[Tuple[float, float], str]:
+    locations = location_utility.get_all_cities_locations()
+    return dict(
+        zip(
+            zip(locations["latitude"], locations["longitude"]),
+            locations["location_name"],
+        )
+    )
+
+
+def _imap_bounded(pool: Pool, function: Callable, tasks: List, max_pending: int) -> Iterator:
+    """Like pool.imap, but at most max_pending tasks are handed out and not yet consumed. Plain imap hands out
+    all tasks at once, so parsed directories would pile up in memory whenever saving is slower than parsing."""
+    slots = threading.Semaphore(max_pending)
+    stopped = threading.Event()
+
+    def handed_out():
+        for task in tasks:
+            slots.acquire()
+            if stopped.is_set():
+                return
+            yield task
+
+    try:
+        for result in pool.imap(function, handed_out()):
+            yield result
+            slots.release()
+    finally:
+        # let the task handler of the pool finish, also when the consumer failed
+        stopped.set()
+        slots.release()
+
+
+def backfill(
+    data_path: str, processes: int = 4, num_hours: int = 12, settings: Settings = None
+):
+    if settings is None:
+        settings = get_settings()
+    sensor_names = settings.sensor_names
+    if settings.persistence_type == "file":
+        store = create_file_store(settings)
+    else:
+        store = create_db_and_session()
+
+    done = read_checkpoint(data_path)
+    if os.path.exists(os.path.join(data_path, INDEX_FILE_NAME)):
+        # the responses of each fetch run are read from the segments
+        runs = ForecastArchive(data_path).runs()
+        pending = [name for name in runs if name not in done]
+        tasks = [(data_path, name, runs[name], num_hours, sensor_names) for name in pending]
+        parse, name_format = parse_archive_run, FETCH_TIME_FORMAT
+    else:
+        pending = [name for name in archive_directories(data_path) if name not in done]
+        tasks = [(data_path, name, num_hours, sensor_names) for name in pending]
+        parse, name_format = parse_archive_directory, ARCHIVE_DIRECTORY_FORMAT
+    logging.info(
+        "Backfilling %d archived fetch runs (%d done before) ..." % (len(pending), len(done))
+    )
+    location_names = location_names_by_coordinates()
+
+    with Pool(processes) as pool:
+        for directory_name, parsed in _imap_bounded(pool, parse, tasks, processes * 2):
+            belief_time = datetime.strptime(directory_name, name_format).replace(tzinfo=pytz.utc)
+            location_rows = []
+            responses = []
+            for latitude, longitude, forecasts in parsed:
+                location_name = location_names.get((latitude, longitude))
+                if location_name is None:
+                    logging.warning(
+                        "Skipping unknown location (%s, %s) in %s"
+                        % (latitude, longitude, directory_name)
+                    )
+                    continue
+                location_rows.append((latitude, longitude, location_name))
+                responses.append((belief_time, forecasts))
+            locations = pd.DataFrame(
+                location_rows, columns=["latitude", "longitude", "location_name"]
+            )
+            beliefs = create_forecasts_from_responses(
+                locations, responses, sensor_names, num_hours, settings, store=store
+            )
+            new_entries = filter_out_known_forecast(beliefs, store, settings)
+            store = save_forecasts(new_entries, store, settings)
+            mark_done(data_path, directory_name)
+            logging.info("Backfilled %s (%d locations)" % (directory_name, len(responses)))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Load archived DarkSky JSON responses into the forecast store."
+    )
+    parser.add_argument(
+        "data_path", help="directory which holds the archive directories, or the archive segments"
+    )
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--hours", type=int, default=12, help="hours to load per response")
+    args = parser.parse_args()
+    backfill(args.data_path, processes=args.processes, num_hours=args.hours)
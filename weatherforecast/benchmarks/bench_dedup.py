@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+from typing import List
+import logging
+import time
+
+import pytz
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from timely_beliefs import DBBeliefSource, DBTimedBelief
+from timely_beliefs.db_base import Base as TBBase
+
+from weatherforecast.get_new_forecasts import db_forecast_is_new, db_forecasts_are_new
+from weatherforecast.utils.dbconfig import DBLocatedSensor
+from weatherforecast.utils.Sensor import SensorName
+
+"""
+Compare the per-belief novelty check with the batched one, on an in-memory SQLite database:
+
+    python -m weatherforecast.benchmarks.bench_dedup
+"""
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            self.count += 1
+
+
+def make_beliefs(
+    sensors: List[DBLocatedSensor],
+    source: DBBeliefSource,
+    belief_time: datetime,
+    num_hours: int,
+    offset: float,
+) -> List[DBTimedBelief]:
+    first_hour = belief_time.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    return [
+        DBTimedBelief(
+            event_start=first_hour + timedelta(hours=h),
+            belief_time=belief_time,
+            source=source,
+            sensor=sensor,
+            # every other sensor changes its mind
+            event_value=float(h) + (offset if i % 2 else 0),
+        )
+        for i, sensor in enumerate(sensors)
+        for h in range(num_hours)
+    ]
+
+
+def run(num_cities: int, num_hours: int = 12):
+    engine = create_engine("sqlite://")
+    TBBase.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    source = DBBeliefSource(name="DarkSky")
+    session.add(source)
+    sensors = [
+        DBLocatedSensor(
+            name=sensor_name,
+            latitude=float(c),
+            longitude=float(c),
+            location_name="city_%d" % c,
+            event_resolution=timedelta(minutes=15),
+        )
+        for c in range(num_cities)
+        for sensor_name in SensorName.ALL.value
+    ]
+    session.add_all(sensors)
+    session.commit()
+
+    # an earlier run, which the next run is checked against
+    earlier = datetime(2019, 3, 1, 10, 5, tzinfo=pytz.utc)
+    session.add_all(make_beliefs(sensors, source, earlier, num_hours, 0))
+    session.commit()
+
+    counter = QueryCounter(engine)
+    later = earlier + timedelta(minutes=30)
+    results = {}
+    for name, check in (
+        ("per belief", lambda fcs: [db_forecast_is_new(session, fc) for fc in fcs]),
+        ("batched", lambda fcs: db_forecasts_are_new(session, fcs)),
+    ):
+        current_forecasts = make_beliefs(sensors, source, later, num_hours, 1)
+        counter.count = 0
+        start = time.perf_counter()
+        are_new = check(current_forecasts)
+        duration = time.perf_counter() - start
+        results[name] = are_new
+        logging.info(
+            "%4d cities, %6d beliefs, %-10s: %6d queries, %.3f s, %d new"
+            % (num_cities, len(current_forecasts), name, counter.count, duration, sum(are_new))
+        )
+        session.rollback()
+    assert results["per belief"] == results["batched"]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    for num_cities in (1, 10, 100):
+        run(num_cities)
@@ -0,0 +1,33 @@
+import logging
+import time
+
+from weatherforecast.benchmarks.fake_darksky import FakeDarkSky
+from weatherforecast.utils.weather_forecast_utility import fetch_forecasts
+
+"""
+Compare serial and concurrent DarkSky fetching against a fake provider with simulated latency:
+
+    python -m weatherforecast.benchmarks.bench_fetch
+"""
+
+
+def time_fetch(num_locations: int, max_workers: int, latency: float) -> float:
+    provider = FakeDarkSky(latency=latency)
+    locations = [(52.0 + i * 0.01, 4.0 + i * 0.01) for i in range(num_locations)]
+    start = time.perf_counter()
+    fetched = fetch_forecasts("fake-key", locations, max_workers=max_workers, provider=provider)
+    duration = time.perf_counter() - start
+    assert len(fetched) == num_locations == provider.calls
+    return duration
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    num_locations = 100
+    latency = 0.05
+    for max_workers in (1, 4, 8, 16, 32):
+        duration = time_fetch(num_locations, max_workers, latency)
+        logging.info(
+            "%d locations, %.0f ms latency, %2d workers: %.2f s (%.1f locations/s)"
+            % (num_locations, latency * 1000, max_workers, duration, num_locations / duration)
+        )
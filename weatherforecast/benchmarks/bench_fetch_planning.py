@@ -0,0 +1,91 @@
+import logging
+import os
+import random
+import tempfile
+
+import pandas as pd
+
+from weatherforecast.benchmarks.fake_darksky import FakeDarkSky
+from weatherforecast.utils import Settings
+from weatherforecast.utils.fetch_planning import FetchPlanner
+
+"""
+Show how the fetch planner paces calls to a flaky fake DarkSky, within a rate limit and a daily quota:
+
+    python -m weatherforecast.benchmarks.bench_fetch_planning
+
+Waiting is simulated (on a virtual clock), so this runs in no time. For each failure ratio, it reports how
+many calls were made and retried, how many locations were fetched, given up on or left for later,
+and how long the run would have taken.
+"""
+
+
+class VirtualClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+def plan_run(num_locations: int, failure_ratio: float, daily_quota: int, directory: str) -> dict:
+    conf_file_path = os.path.join(directory, "configuration.ini")
+    with open(conf_file_path, "w") as conf_file:
+        conf_file.write(
+            "[DARK_SKY]\nAPI_KEY: fake-key\nmax_calls_per_second: 10\ndaily_quota: %d\n"
+            "retries: 2\nretry_delay_seconds: 1\n\n"
+            "[PRIORITIES]\ncity0: 10\n" % daily_quota
+        )
+    settings = Settings(conf_file_path)
+    locations = pd.DataFrame(
+        {
+            "latitude": [52.0 + i * 0.01 for i in range(num_locations)],
+            "longitude": [4.0 + i * 0.01 for i in range(num_locations)],
+            "location_name": ["Location %d" % i for i in range(num_locations)],
+            "location_key": ["city%d" % (i % 10) for i in range(num_locations)],
+        }
+    )
+    provider = FakeDarkSky(failure_ratio=failure_ratio, seed=169)
+    clock = VirtualClock()
+    planner = FetchPlanner(
+        settings,
+        os.path.join(directory, "fetch_state_%s.json" % failure_ratio),
+        provider,
+        clock=clock,
+        sleep=clock.sleep,
+        rng=random.Random(169),
+    )
+    kept, _ = planner.fetch(locations, settings.api_key)
+    return dict(
+        calls=provider.calls,
+        failed_calls=provider.failures,
+        fetched=kept.shape[0],
+        not_fetched=num_locations - kept.shape[0],
+        simulated_seconds=clock.now,
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)  # retries and failures are logged per location
+    num_locations = 200
+    daily_quota = 220
+    with tempfile.TemporaryDirectory() as directory:
+        for failure_ratio in (0.0, 0.05, 0.2, 0.5):
+            outcome = plan_run(num_locations, failure_ratio, daily_quota, directory)
+            print(
+                "%d locations, quota %d, %2.0f%% failing calls: %d calls (%d failed), %d fetched, "
+                "%d not fetched, %.1f s (simulated)"
+                % (
+                    num_locations,
+                    daily_quota,
+                    failure_ratio * 100,
+                    outcome["calls"],
+                    outcome["failed_calls"],
+                    outcome["fetched"],
+                    outcome["not_fetched"],
+                    outcome["simulated_seconds"],
+                )
+            )
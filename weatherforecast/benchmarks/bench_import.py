@@ -0,0 +1,30 @@
+import logging
+import statistics
+import subprocess
+import sys
+import time
+
+"""
+Time how long a fresh interpreter takes to import the forecasting script:
+
+    python -m weatherforecast.benchmarks.bench_import
+"""
+
+
+def time_import(module: str, repeats: int = 10) -> list:
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import %s" % module], check=True)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    for module in ("weatherforecast.utils", "weatherforecast.get_new_forecasts"):
+        durations = time_import(module)
+        logging.info(
+            "import %s: median %.3f s, min %.3f s over %d runs"
+            % (module, statistics.median(durations), min(durations), len(durations))
+        )
@@ -0,0 +1,73 @@
+from datetime import datetime
+from typing import List
+import json
+import logging
+import time
+
+import pytz
+
+from weatherforecast.benchmarks.fake_darksky import FakeDarkSky
+from weatherforecast.utils import UNUSED_DARKSKY_BLOCKS
+from weatherforecast.utils.Sensor import SensorName
+
+"""
+Compare ingestion profiles (see the INGESTION section of the config file) on fake DarkSky responses:
+how many bytes each response takes, how long parsing the responses takes, and how many values are extracted:
+
+    python -m weatherforecast.benchmarks.bench_ingestion
+"""
+
+PROFILES = [
+    ("all blocks, 168 hours, all sensors", None, ["hourly"], SensorName.ALL.value),
+    ("hourly only, 48 hours, all sensors", UNUSED_DARKSKY_BLOCKS, None, SensorName.ALL.value),
+    (
+        "hourly only, 48 hours, 3 sensors",
+        UNUSED_DARKSKY_BLOCKS,
+        None,
+        ["temperature", "windSpeed", "cloudCover"],
+    ),
+]
+
+
+def time_profile(
+    num_locations: int, num_hours: int, exclude: List[str], extend: List[str], sensor_names: List[str]
+) -> dict:
+    provider = FakeDarkSky()
+    bodies = [
+        json.dumps(
+            provider("fake-key", (52.0 + i * 0.01, 4.0 + i * 0.01), exclude=exclude, extend=extend)
+        )
+        for i in range(num_locations)
+    ]
+    start = time.perf_counter()
+    num_values = 0
+    for body in bodies:
+        forecasts = json.loads(body)
+        for forecast in forecasts["hourly"]["data"][:num_hours]:
+            datetime.fromtimestamp(int(forecast["time"]), tz=pytz.utc)
+            for sensor_name in sensor_names:
+                forecast[sensor_name]
+                num_values += 1
+    return dict(
+        bytes_per_response=sum(len(body) for body in bodies) / num_locations,
+        seconds=time.perf_counter() - start,
+        values=num_values,
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    num_locations = 1000
+    num_hours = 12
+    for name, exclude, extend, sensor_names in PROFILES:
+        outcome = time_profile(num_locations, num_hours, exclude, extend, sensor_names)
+        logging.info(
+            "%s: %.1f kB per response, parsed %d responses in %.2f s, %d values"
+            % (
+                name,
+                outcome["bytes_per_response"] / 1000,
+                num_locations,
+                outcome["seconds"],
+                outcome["values"],
+            )
+        )
@@ -0,0 +1,42 @@
+import logging
+import time
+
+from weatherforecast.utils import location_utility
+from weatherforecast.utils.k_center_locations_finder import KCenterLocationsFinder, coverage_radius_km
+from weatherforecast.utils.optimal_locations_finder import OptimalLocationsFinder
+
+"""
+Compare the genetic search with the k-center selection, in quality and runtime, on several countries:
+
+    python -m weatherforecast.benchmarks.bench_location_selection
+
+Quality is reported as the GA's own fitness (higher is better) and as the coverage radius,
+the largest distance from any city to its nearest selected city (lower is better).
+"""
+
+
+COUNTRIES = ["Netherlands", "Belgium", "Switzerland", "Germany", "France"]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    new_locations_size = 60
+    print("%-12s %6s %-8s %8s %14s %14s" % ("country", "cities", "method", "seconds", "fitness", "coverage (km)"))
+    for country in COUNTRIES:
+        locations = location_utility.get_cities_locations_by_country(country)
+        if locations.shape[0] < new_locations_size:
+            continue
+        genetic_finder = OptimalLocationsFinder(locations, new_locations_size)
+        k_center_finder = KCenterLocationsFinder(locations, new_locations_size)
+        for method, find in (
+            ("genetic", lambda: genetic_finder.find_optimal_locations(seed=169)),
+            ("k-center", k_center_finder.find_optimal_locations),
+        ):
+            start = time.perf_counter()
+            selected = find()
+            duration = time.perf_counter() - start
+            indices = [locations.index.get_loc(i) for i in selected.index]
+            fitness = genetic_finder._eval_solution(indices)[0]
+            coverage = coverage_radius_km(genetic_finder.coordinates, indices)
+            print("%-12s %6d %-8s %8.2f %14.1f %14.1f"
+                  % (country, locations.shape[0], method, duration, fitness, coverage))
@@ -0,0 +1,44 @@
+import logging
+import time
+
+from weatherforecast.utils import location_utility
+
+"""
+Time city lookups over the full city list, with the prebuilt index and with a DataFrame.query scan:
+
+    python -m weatherforecast.benchmarks.bench_locations
+"""
+
+
+def query_city_location(city_name: str, country_name: str):
+    """How get_city_location used to work, for comparison"""
+    df = location_utility.get_cities_df().query('city_name == @city_name & country_name == @country_name')
+    df = df[location_utility.city_location_columns].copy().reset_index(drop=True)
+    location_utility._create_location_name_column(df)
+    return df
+
+
+def time_lookups(lookup, cities: list) -> float:
+    start = time.perf_counter()
+    for city_name, country_name in cities:
+        lookup(city_name, country_name)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)  # the lookups themselves log at INFO level
+    cities_df = location_utility.get_cities_df()
+    cities = list(cities_df[['city_name', 'country_name']].dropna().itertuples(index=False, name=None))
+    scanned_cities = cities[:1000]  # scanning for all cities takes too long
+
+    indexed = time_lookups(location_utility.get_city_location, cities)
+    scanned = time_lookups(query_city_location, scanned_cities)
+    print("%d cities, indexed lookups: %.1f us per city" % (len(cities), indexed / len(cities) * 1e6))
+    print("%d cities, query scans: %.1f us per city" % (len(scanned_cities), scanned / len(scanned_cities) * 1e6))
+
+    countries = cities_df['country_name'].dropna().unique()
+    start = time.perf_counter()
+    for country_name in countries:
+        location_utility.get_cities_locations_by_country(country_name)
+    by_country = time.perf_counter() - start
+    print("%d countries, indexed lookups: %.1f us per country" % (len(countries), by_country / len(countries) * 1e6))
@@ -0,0 +1,51 @@
+import logging
+import random
+import time
+
+import numpy as np
+
+from weatherforecast.utils import location_utility
+from weatherforecast.utils.haversine import haversine_distance_vec
+from weatherforecast.utils.optimal_locations_finder import OptimalLocationsFinder
+
+"""
+Measure fitness evaluations per second of OptimalLocationsFinder, on the Netherlands example from app.py:
+
+    python -m weatherforecast.benchmarks.bench_optimal_locations
+"""
+
+
+def eval_with_locations_matrix(finder: OptimalLocationsFinder, individual) -> tuple:
+    """How fitness used to be evaluated, for comparison"""
+    selected_locations = finder.locations.iloc[individual, :].copy()
+    locations_matrix = finder.create_locations_matrix(selected_locations)
+    distances = haversine_distance_vec(locations_matrix['latitude_1'], locations_matrix['longitude_1'],
+                                       locations_matrix['latitude_2'], locations_matrix['longitude_2'])
+    return distances.median() + finder.calculate_area(selected_locations),
+
+
+def evaluations_per_second(evaluate, population: list) -> float:
+    start = time.perf_counter()
+    evaluate(population)
+    return len(population) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    country = "Netherlands"
+    new_locations_size = 60
+    locations = location_utility.get_cities_locations_by_country(country)
+    finder = OptimalLocationsFinder(locations, new_locations_size)
+    random.seed(169)
+    population = [random.sample(range(locations.shape[0]), new_locations_size) for _ in range(500)]
+
+    old = evaluations_per_second(lambda pop: [eval_with_locations_matrix(finder, ind) for ind in pop], population[:50])
+    single = evaluations_per_second(lambda pop: [finder._eval_solution(ind) for ind in pop], population)
+    batch = evaluations_per_second(finder.evaluate_population, population)
+    assert np.allclose([finder._eval_solution(ind)[0] for ind in population[:10]],
+                       [fitness[0] for fitness in finder.evaluate_population(population[:10])])
+
+    print("%s: %d locations, choosing %d" % (country, locations.shape[0], new_locations_size))
+    print("locations matrix per individual: %8.0f evaluations/s" % old)
+    print("distance matrix per individual:  %8.0f evaluations/s" % single)
+    print("distance matrix per population:  %8.0f evaluations/s" % batch)
@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+import pytz
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from timely_beliefs import DBBeliefSource, DBTimedBelief
+from timely_beliefs.db_base import Base as TBBase
+
+from weatherforecast.get_new_forecasts import query_known_beliefs
+from weatherforecast.utils.db_schema import create_belief_indexes
+from weatherforecast.utils.dbconfig import DBLocatedSensor
+from weatherforecast.utils.forecast_query import latest_beliefs_query
+
+"""
+Time the novelty check and the read of the latest beliefs on a large synthetic belief table
+(in a temporary SQLite file), before and after creating the belief indexes:
+
+    python -m weatherforecast.benchmarks.bench_schema [--sensors 250] [--days 90] [--runs 4]
+
+With the defaults, the table holds 250 sensors x 90 days x 24 hours x 4 runs = 2,160,000 beliefs.
+"""
+
+
+def fill_belief_table(
+    engine, num_sensors: int, num_days: int, runs_per_event: int, chunk_size: int = 50000
+):
+    session = sessionmaker(bind=engine)()
+    source = DBBeliefSource(name="DarkSky")
+    sensors = [
+        DBLocatedSensor(
+            name="temperature",
+            latitude=float(s),
+            longitude=float(s),
+            location_name="city_%d" % s,
+            event_resolution=timedelta(hours=1),
+        )
+        for s in range(num_sensors)
+    ]
+    session.add(source)
+    session.add_all(sensors)
+    session.commit()
+
+    insert = DBTimedBelief.__table__.insert()
+    first_event = datetime(2019, 1, 1, tzinfo=pytz.utc)
+    rows = []
+    with engine.begin() as connection:
+        for sensor in sensors:
+            for h in range(num_days * 24):
+                for run in range(runs_per_event):
+                    rows.append(
+                        dict(
+                            event_start=first_event + timedelta(hours=h),
+                            belief_horizon=timedelta(hours=run * 6),
+                            cumulative_probability=0.5,
+                            event_value=float(h + run),
+                            sensor_id=sensor.id,
+                            source_id=source.id,
+                        )
+                    )
+                if len(rows) >= chunk_size:
+                    connection.execute(insert, rows)
+                    rows = []
+        if rows:
+            connection.execute(insert, rows)
+    return session, sensors, source, first_event
+
+
+def time_queries(session, sensors, source, first_event, num_days: int):
+    # the novelty check of one fetch run: all sensors, the next two days
+    check_start = first_event + timedelta(days=num_days - 2)
+    start = time.perf_counter()
+    known = query_known_beliefs(
+        session,
+        {sensor.id for sensor in sensors},
+        {source.id},
+        check_start,
+        check_start + timedelta(hours=48),
+    )
+    dedup_duration = time.perf_counter() - start
+
+    # a model training read: the latest beliefs of ten sensors over a week
+    start = time.perf_counter()
+    latest = session.connection().execute(
+        latest_beliefs_query(
+            sensors[:10],
+            first_event,
+            first_event + timedelta(days=7),
+            belief_horizon=timedelta(hours=6),
+        )
+    ).fetchall()
+    read_duration = time.perf_counter() - start
+    return (len(known), dedup_duration), (len(latest), read_duration)
+
+
+def run(num_sensors: int = 250, num_days: int = 90, runs_per_event: int = 4):
+    db_file, db_path = tempfile.mkstemp(suffix=".db")
+    os.close(db_file)
+    try:
+        engine = create_engine("sqlite:///%s" % db_path)
+        TBBase.metadata.create_all(engine)
+        start = time.perf_counter()
+        session, sensors, source, first_event = fill_belief_table(
+            engine, num_sensors, num_days, runs_per_event
+        )
+        logging.info(
+            "Inserted %d beliefs in %.1f s"
+            % (num_sensors * num_days * 24 * runs_per_event, time.perf_counter() - start)
+        )
+        for label in ("without indexes", "with indexes"):
+            if label == "with indexes":
+                start = time.perf_counter()
+                create_belief_indexes(engine)
+                logging.info("Created indexes in %.1f s" % (time.perf_counter() - start))
+            (num_known, dedup_duration), (num_latest, read_duration) = time_queries(
+                session, sensors, source, first_event, num_days
+            )
+            logging.info(
+                "%-16s: novelty check %.3f s (%d rows), latest beliefs %.3f s (%d rows)"
+                % (label, dedup_duration, num_known, read_duration, num_latest)
+            )
+        session.close()
+    finally:
+        os.remove(db_path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Time belief table reads before and after creating the belief indexes."
+    )
+    parser.add_argument("--sensors", type=int, default=250)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--runs", type=int, default=4, help="beliefs per event")
+    args = parser.parse_args()
+    run(args.sensors, args.days, args.runs)
@@ -0,0 +1,297 @@
+from typing import List
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+from timely_beliefs.db_base import Base as TBBase
+
+from weatherforecast.benchmarks.fake_darksky import FakeDarkSky
+from weatherforecast.get_new_forecasts import run_forecast_cycle
+from weatherforecast.utils import Settings, dbconfig
+from weatherforecast.utils.db_schema import setup_schema
+from weatherforecast.utils.file_store import PartitionedFileStore
+from weatherforecast.utils.helping_tables_utility import create_sensor_location_id
+from weatherforecast.utils.location_utility import CityIndex, selected_columns
+
+"""
+Offline benchmarks of the whole flow, on synthetic city sets and a fake DarkSky provider:
+
+    python -m weatherforecast.benchmarks.bench_suite --cities 10 100 1000 --runs 3 --output results.jsonl
+
+For each number of cities, the get_new_forecasts flow (fetch, novelty check, save) runs several times
+against a fresh SQLite database and a fresh file store, for both kinds of extraction and for the pipeline
+(see forecast_pipeline). Between runs, some of the fake forecasts change, so later runs find a realistic mix
+of new and known forecasts. Pass --latency to let each fake call take a while, as real ones do; then the
+pipeline overlaps fetching with the novelty check and saving.
+Location lookups and OptimalLocationsFinder are measured as well.
+
+Each measurement is one JSON line with the same keys (see RESULT_KEYS), so results of different
+versions can be compared line by line. Peak memory is measured with tracemalloc, which slows things
+down a bit; pass --no-memory for timings without it.
+"""
+
+RESULT_KEYS = [
+    "benchmark",
+    "variant",
+    "size",
+    "run",
+    "seconds",
+    "items",
+    "items_per_second",
+    "peak_memory_mb",
+    "details",
+]
+
+
+def synthetic_cities(num_cities: int, num_countries: int = 20, seed: int = 169) -> pd.DataFrame:
+    """A table like the city table (see location_utility.selected_columns), with made-up cities."""
+    rng = np.random.RandomState(seed)
+    countries = rng.randint(num_countries, size=num_cities)
+    return pd.DataFrame(
+        {
+            "continent_name": ["Continent %d" % (c % 5) for c in countries],
+            "country_name": ["Country %d" % c for c in countries],
+            "subdivision_1_name": ["Subdivision %d" % s for s in rng.randint(100, size=num_cities)],
+            "city_name": ["City %d" % i for i in range(num_cities)],
+            "time_zone": ["Zone/%d" % (c % 10) for c in countries],
+            "is_in_european_union": (countries % 2).astype(str),
+            # cities of a country lie close together
+            "latitude": np.round(-60 + countries * 6 + rng.uniform(0, 4, num_cities), 4),
+            "longitude": np.round(-150 + countries * 15 + rng.uniform(0, 8, num_cities), 4),
+        },
+        columns=selected_columns,
+    )
+
+
+class Measurement:
+    """Wall time, and (with trace_memory) peak memory of the Python heap, of a block."""
+
+    def __init__(self, trace_memory: bool = True) -> None:
+        self.trace_memory = trace_memory
+        self.seconds = None
+        self.peak_memory_mb = None
+
+    def __enter__(self) -> "Measurement":
+        if self.trace_memory:
+            tracemalloc.start()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.perf_counter() - self._start
+        if self.trace_memory:
+            self.peak_memory_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+
+
+def result(
+    benchmark: str, variant: str, size: int, run: int, measurement: Measurement, items: int, **details
+) -> dict:
+    return dict(
+        benchmark=benchmark,
+        variant=variant,
+        size=size,
+        run=run,
+        seconds=round(measurement.seconds, 4),
+        items=items,
+        items_per_second=round(items / measurement.seconds, 1) if measurement.seconds > 0 else None,
+        peak_memory_mb=None
+        if measurement.peak_memory_mb is None
+        else round(measurement.peak_memory_mb, 1),
+        details=details,
+    )
+
+
+def write_settings(directory: str, persistence_type: str, name: str, extraction: str) -> Settings:
+    """extraction can also be "pipelined" (see forecast_pipeline), which extracts into columns."""
+    pipelined = extraction == "pipelined"
+    if pipelined:
+        extraction = "columnar"
+    conf_file_path = os.path.join(directory, "configuration.ini")
+    with open(conf_file_path, "w") as conf_file:
+        conf_file.write(
+            "[DARK_SKY]\nAPI_KEY: fake-key\nconcurrency: 8\nfetch_state: %s\n\n"
+            "[PERSISTENCE]\ntype: %s\nname: %s\nbulk_insert: yes\nextraction: %s\ncreate_indexes: yes\n\n"
+            "[PIPELINE]\nenabled: %s\n\n"
+            "[REPORTING]\nrun_report: %s\n"
+            % (
+                os.path.join(directory, "fetch_state.json"),
+                persistence_type,
+                name,
+                extraction,
+                "yes" if pipelined else "no",
+                os.path.join(directory, "run_reports.jsonl"),
+            )
+        )
+    return Settings(conf_file_path)
+
+
+def open_sqlite_store(settings: Settings) -> Session:
+    """Like create_db_and_session, for the SQLite database in the settings,
+    but without touching the session of dbconfig."""
+    engine = create_engine(settings.persistence_name)
+    setup_schema(engine, TBBase.metadata, create_indexes=settings.create_indexes)
+    session = sessionmaker(bind=engine, expire_on_commit=False)()
+    dbconfig.create_darksky_source(session)
+    dbconfig.sensor_registry.warm(session)
+    return session
+
+
+def last_run_report(settings: Settings) -> dict:
+    with open(settings.run_report_path) as report_file:
+        return json.loads(report_file.readlines()[-1])
+
+
+def bench_flow(
+    backend: str,
+    extraction: str,
+    locations: pd.DataFrame,
+    runs: int,
+    change_ratio: float,
+    trace_memory: bool,
+    latency: float = 0.0,
+) -> List[dict]:
+    results = []
+    provider = FakeDarkSky(latency=latency, change_ratio=change_ratio)
+    with tempfile.TemporaryDirectory() as directory:
+        if backend == "sqlite":
+            settings = write_settings(
+                directory, "db", "sqlite:///%s" % os.path.join(directory, "forecasts.db"), extraction
+            )
+            store = open_sqlite_store(settings)
+        else:
+            settings = write_settings(directory, "file", "forecasts.csv", extraction)
+            # The synthetic cities are not in the sensor/location mapping table,
+            # but their ids are made the same way as those in the table.
+            store = PartitionedFileStore(
+                os.path.join(directory, "forecasts"), sensor_ids=create_sensor_location_id
+            )
+        for run in range(runs):
+            provider.revision = run
+            with Measurement(trace_memory) as measurement:
+                store = run_forecast_cycle(store, locations, settings=settings, provider=provider)
+            report = last_run_report(settings)
+            counters = report["counters"]
+            results.append(
+                result(
+                    "flow",
+                    "%s/%s" % (backend, extraction),
+                    locations.shape[0],
+                    run,
+                    measurement,
+                    counters.get("beliefs_created", 0),
+                    written=counters.get("beliefs_written", 0),
+                    deduped=counters.get("beliefs_deduped", 0),
+                    queries=report["queries"],
+                )
+            )
+        if backend == "sqlite":
+            store.close()
+    return results
+
+
+def bench_location_lookups(num_cities: int, num_lookups: int, trace_memory: bool) -> List[dict]:
+    cities = synthetic_cities(num_cities)
+    with Measurement(trace_memory) as measurement:
+        city_index = CityIndex(cities)
+    results = [result("locations", "build index", num_cities, 0, measurement, num_cities)]
+    keys = list(zip(cities["city_name"], cities["country_name"]))[:num_lookups]
+    with Measurement(trace_memory) as measurement:
+        for key in keys:
+            city_index.locations_at(city_index.by_city.get(key))
+    results.append(result("locations", "city lookup", num_cities, 0, measurement, len(keys)))
+    countries = cities["country_name"].unique()
+    with Measurement(trace_memory) as measurement:
+        for country_name in countries:
+            city_index.locations_at(city_index.by_country.get(country_name))
+    results.append(result("locations", "country lookup", num_cities, 0, measurement, len(countries)))
+    return results
+
+
+def bench_optimal_locations(
+    num_locations: int, new_locations_size: int, generations: int, trace_memory: bool
+) -> List[dict]:
+    # the finder needs deap (and area), which the fetch benchmarks do not
+    from weatherforecast.utils.optimal_locations_finder import OptimalLocationsFinder
+
+    locations = CityIndex(synthetic_cities(num_locations, num_countries=1)).locations
+    with Measurement(trace_memory) as measurement:
+        finder = OptimalLocationsFinder(locations, new_locations_size)
+    results = [result("optimal_locations", "distance matrix", num_locations, 0, measurement, num_locations)]
+    random.seed(169)
+    population = [random.sample(range(num_locations), new_locations_size) for _ in range(500)]
+    with Measurement(trace_memory) as measurement:
+        finder.evaluate_population(population)
+    results.append(result("optimal_locations", "evaluations", num_locations, 0, measurement, len(population)))
+    with Measurement(trace_memory) as measurement:
+        finder.find_optimal_locations(population_size=100, generations=generations, seed=169)
+    results.append(result("optimal_locations", "generations", num_locations, 0, measurement, generations))
+    return results
+
+
+def print_result(line: dict):
+    print(
+        "%-18s %-18s %6d %3d %9.3f s %12s items/s %8s MB  %s"
+        % (
+            line["benchmark"],
+            line["variant"],
+            line["size"],
+            line["run"],
+            line["seconds"],
+            line["items_per_second"],
+            line["peak_memory_mb"],
+            json.dumps(line["details"], sort_keys=True) if line["details"] else "",
+        )
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Offline benchmarks of fetching, deduplication and saving.")
+    parser.add_argument("--cities", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--runs", type=int, default=3, help="fetch runs per city set")
+    parser.add_argument("--change-ratio", type=float, default=0.2, help="share of forecasts changing per run")
+    parser.add_argument("--backends", nargs="+", default=["sqlite", "file"], choices=["sqlite", "file"])
+    parser.add_argument(
+        "--extractions",
+        nargs="+",
+        default=["columnar", "objects", "pipelined"],
+        choices=["columnar", "objects", "pipelined"],
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds each fake DarkSky call takes"
+    )
+    parser.add_argument("--output", help="append the results as JSON lines to this file")
+    parser.add_argument("--no-memory", action="store_true", help="do not measure peak memory")
+    args = parser.parse_args()
+    trace_memory = not args.no_memory
+
+    results = []
+    for num_cities in args.cities:
+        locations = CityIndex(synthetic_cities(num_cities)).locations
+        for backend in args.backends:
+            for extraction in args.extractions:
+                results += bench_flow(
+                    backend, extraction, locations, args.runs, args.change_ratio, trace_memory, args.latency
+                )
+    results += bench_location_lookups(100000, 10000, trace_memory)
+    try:
+        results += bench_optimal_locations(1000, 60, 5, trace_memory)
+    except ImportError as e:
+        logging.warning("Skipping the optimal locations benchmark: %s" % e)
+
+    for line in results:
+        print_result(line)
+    if args.output is not None:
+        with open(args.output, "a") as output_file:
+            for line in results:
+                output_file.write(json.dumps({key: line[key] for key in RESULT_KEYS}, sort_keys=True) + "\n")
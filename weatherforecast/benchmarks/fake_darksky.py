@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta
+from typing import List, Tuple
+import math
+import random
+import threading
+import time
+
+import pytz
+
+from weatherforecast.utils.Sensor import SensorName
+
+"""
+A stand-in for the DarkSky API, so fetching can be exercised and benchmarked offline.
+An instance can be passed wherever a provider with the signature of call_darksky is expected.
+Responses are deterministic and shaped like DarkSky's (currently, minutely, hourly and daily blocks).
+Like call_darksky, it takes exclude and extend, so it can stand in for darksky_provider as well.
+"""
+
+
+class FakeDarkSky:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        num_hours: int = 48,
+        change_ratio: float = 0.0,
+        seed: int = 0,
+        failure_ratio: float = 0.0,
+    ):
+        """latency is the number of seconds each call blocks, to mimic a network round-trip.
+        Raise revision to mimic a later fetch: then a change_ratio share of the hourly values differ
+        from those of the previous revision.
+        A failure_ratio share of the calls fails (which ones depends only on the seed and the call count)."""
+        self.latency = latency
+        self.num_hours = num_hours
+        self.change_ratio = change_ratio
+        self.seed = seed
+        self.failure_ratio = failure_ratio
+        self.revision = 0
+        self.calls = 0
+        self.failures = 0
+        # calls come from several fetch threads at once (see fetch_forecasts)
+        self._lock = threading.Lock()
+
+    def __call__(
+        self,
+        api_key: str,
+        location: Tuple[float, float],
+        exclude: List[str] = None,
+        extend: List[str] = None,
+    ) -> dict:
+        with self._lock:
+            self.calls += 1
+            call_number = self.calls
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if random.Random("%d,%d" % (self.seed, call_number)).random() < self.failure_ratio:
+            with self._lock:
+                self.failures += 1
+            raise Exception("Fake DarkSky failure for %s" % (location,))
+        now = datetime.utcnow().replace(tzinfo=pytz.utc)
+        first_hour = now.replace(minute=0, second=0, microsecond=0)
+        return make_forecast_payload(
+            location,
+            first_hour,
+            168 if extend is not None and "hourly" in extend else self.num_hours,
+            revision=self.revision,
+            change_ratio=self.change_ratio,
+            seed=self.seed,
+            exclude=exclude,
+        )
+
+
+def _data_point(location: Tuple[float, float], moment: datetime, offset: float) -> dict:
+    phase = (location[0] + location[1] + moment.hour) / 24 * 2 * math.pi
+    point = {
+        "time": int(moment.timestamp()),
+        "summary": "Partly Cloudy",
+        "icon": "partly-cloudy-day",
+    }
+    for j, sensor_name in enumerate(SensorName.ALL.value):
+        point[sensor_name] = round(10 + 5 * math.sin(phase + j) + offset, 2)
+    return point
+
+
+def make_forecast_payload(
+    location: Tuple[float, float],
+    first_hour: datetime,
+    num_hours: int = 48,
+    revision: int = 0,
+    change_ratio: float = 0.0,
+    seed: int = 0,
+    exclude: List[str] = None,
+) -> dict:
+    """Build a response shaped like DarkSky's, with values depending only on location, hour and revision.
+    Blocks in exclude are left out."""
+    hourly = []
+    for i in range(num_hours):
+        event_start = first_hour + timedelta(hours=i)
+        offset = 0.0
+        for r in range(1, revision + 1):
+            # whether this hour changed in revision r depends only on location, hour, r and seed
+            rng = random.Random(
+                "%s,%s,%d,%d,%d"
+                % (location[0], location[1], int(event_start.timestamp()), r, seed)
+            )
+            if rng.random() < change_ratio:
+                offset += 0.1
+        hourly.append(_data_point(location, event_start, offset))
+    minutely = [
+        {
+            "time": int((first_hour + timedelta(minutes=m)).timestamp()),
+            "precipIntensity": 0,
+            "precipProbability": 0,
+        }
+        for m in range(61)
+    ]
+    daily = []
+    for d in range(8):
+        day = first_hour.replace(hour=0) + timedelta(days=d)
+        point = _data_point(location, day, 0.0)
+        point.update(
+            temperatureHigh=point["temperature"] + 4,
+            temperatureLow=point["temperature"] - 4,
+            sunriseTime=int((day + timedelta(hours=6)).timestamp()),
+            sunsetTime=int((day + timedelta(hours=18)).timestamp()),
+            moonPhase=round((d % 29) / 29, 2),
+        )
+        daily.append(point)
+    payload = {
+        "latitude": location[0],
+        "longitude": location[1],
+        "timezone": "UTC",
+        "offset": 0,
+        "currently": _data_point(location, first_hour, 0.0),
+        "minutely": {"summary": "Fake weather", "icon": "partly-cloudy-day", "data": minutely},
+        "hourly": {"summary": "Fake weather", "icon": "partly-cloudy-day", "data": hourly},
+        "daily": {"summary": "Fake weather", "icon": "partly-cloudy-day", "data": daily},
+        "flags": {"sources": ["fake"], "nearest-station": 1.0, "units": "si"},
+    }
+    for block in exclude or []:
+        payload.pop(block, None)
+    return payload
@@ -0,0 +1,202 @@
+from typing import Tuple, Union
+import argparse
+import os
+import signal
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import pytz
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from weatherforecast.utils import get_settings, location_utility, path_to_data, Settings
+from weatherforecast.utils.cycle_lock import CycleLock, shard_lock_path
+from weatherforecast.utils.sharding import select_shard
+from weatherforecast.utils.file_store import PartitionedFileStore
+from weatherforecast.utils.helping_tables_utility import get_sensor_location_id_maps
+from weatherforecast.utils.dbconfig import create_db_and_session
+from weatherforecast.get_new_forecasts import (
+    create_file_store,
+    find_locations,
+    run_forecast_cycle,
+)
+
+"""
+A resident alternative to running get_new_forecasts.py as an hourly cron job. The process stays up, so the
+database engine (with its connection pool), the sensor cache and the location tables are loaded only once:
+
+    python weatherforecast/forecast_scheduler.py
+
+Fetch cycles start at slots aligned to the hour (see the SCHEDULER section of the config file).
+The last finished slot is recorded in a state file, so if slots were missed (the process was down, or a
+cycle took longer than the interval), one cycle is run right away to catch up. DarkSky only tells us about
+the current forecasts, so several missed slots are caught up on by a single cycle.
+Cycles never overlap, also not with a get_new_forecasts.py run started by cron (see CycleLock).
+"""
+
+STATE_FILE_NAME = "scheduler_state.txt"
+STATE_TIME_FORMAT = "%Y-%m-%dT%H:%M"
+
+
+def slot_of(moment: datetime, interval: timedelta, offset: timedelta) -> datetime:
+    """The start of the slot which moment is in. Slots are counted from midnight UTC, shifted by offset."""
+    day_start = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day_start + offset + ((moment - day_start - offset) // interval) * interval
+
+
+class ForecastScheduler:
+    def __init__(
+        self,
+        settings: Settings = None,
+        state_path: str = None,
+        shard_index: int = 0,
+        shard_count: int = 1,
+    ) -> None:
+        """With shard_count > 1, the scheduler only fetches its own part of the locations (see select_shard)."""
+        if settings is None:
+            settings = get_settings()
+        if state_path is None:
+            state_name = STATE_FILE_NAME
+            if shard_count > 1:
+                state_name = "scheduler_state_shard_%d_of_%d.txt" % (shard_index, shard_count)
+            state_path = os.path.join(path_to_data(), state_name)
+        self.settings = settings
+        self.state_path = state_path
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.lock = CycleLock(shard_lock_path(shard_index, shard_count))
+        self.stopped = threading.Event()
+        self.store: Union[Session, PartitionedFileStore] = None
+        self._locations_key: Tuple[str, ...] = None
+        self._locations: pd.DataFrame = None
+
+    @property
+    def interval(self) -> timedelta:
+        return timedelta(minutes=self.settings.schedule_interval_minutes)
+
+    @property
+    def offset(self) -> timedelta:
+        return timedelta(minutes=self.settings.schedule_offset_minutes)
+
+    def prepare(self):
+        """Open the store and load the location tables, once for the lifetime of the process."""
+        if self.settings.persistence_type == "file":
+            self.store = create_file_store(self.settings)
+            get_sensor_location_id_maps()
+        else:
+            self.store = create_db_and_session()
+        location_utility.get_city_index()
+
+    def locations(self) -> pd.DataFrame:
+        """The configured locations, looked up again only when the LOCATIONS section has changed."""
+        key = tuple(self.settings.location_entries.items())
+        if key != self._locations_key:
+            self._locations = find_locations(self.settings)
+            if self._locations is not None and self.shard_count > 1:
+                self._locations = select_shard(
+                    self._locations, self.shard_index, self.shard_count
+                )
+            self._locations_key = key
+        return self._locations
+
+    def read_last_slot(self) -> datetime:
+        if not os.path.exists(self.state_path):
+            return None
+        with open(self.state_path) as state_file:
+            content = state_file.read().strip()
+        if content == "":
+            return None
+        return datetime.strptime(content, STATE_TIME_FORMAT).replace(tzinfo=pytz.utc)
+
+    def write_last_slot(self, slot: datetime):
+        with open(self.state_path, "w") as state_file:
+            state_file.write(slot.strftime(STATE_TIME_FORMAT))
+
+    def run_cycle(self, slot: datetime) -> bool:
+        """Run one fetch cycle for the slot. Returns whether it finished."""
+        locations = self.locations()
+        if locations is None:
+            logging.warning("None of the configured locations can be found, so there is nothing to fetch.")
+            return True
+        with self.lock as acquired:
+            if not acquired:
+                logging.warning(
+                    "Another fetch cycle is running, so we skip the one for %s." % slot
+                )
+                return False
+            started = datetime.now(pytz.utc)
+            try:
+                self.store = run_forecast_cycle(self.store, locations, settings=self.settings)
+            except Exception:
+                logging.exception("The fetch cycle for %s failed." % slot)
+                if isinstance(self.store, Session):
+                    self.store.rollback()
+                return False
+        logging.info(
+            "Finished the fetch cycle for %s in %.1f s"
+            % (slot, (datetime.now(pytz.utc) - started).total_seconds())
+        )
+        return True
+
+    def reload_settings(self):
+        """Pick up edits to the configuration file. An edit which cannot be parsed is logged,
+        and the cycles go on with the previous settings until the file is fixed."""
+        try:
+            self.settings.reload_if_changed()
+        except Exception:
+            logging.exception(
+                "Cannot reload the configuration file, so we keep the previous settings."
+            )
+
+    def run(self, retry_seconds: int = 60):
+        """Run fetch cycles until stop is called."""
+        self.prepare()
+        last_slot = self.read_last_slot()
+        while not self.stopped.is_set():
+            self.reload_settings()
+            now = datetime.now(pytz.utc)
+            slot = slot_of(now, self.interval, self.offset)
+            next_slot = slot + self.interval
+            if last_slot is None or last_slot < slot:
+                if last_slot is not None and slot - last_slot > self.interval:
+                    logging.info(
+                        "Catching up on %d missed slot(s) since %s"
+                        % ((slot - last_slot) // self.interval - 1, last_slot)
+                    )
+                if self.run_cycle(slot):
+                    last_slot = slot
+                    self.write_last_slot(slot)
+                else:
+                    # try again a bit later, but not past the next slot
+                    next_slot = min(
+                        datetime.now(pytz.utc) + timedelta(seconds=retry_seconds),
+                        next_slot,
+                    )
+            wait_seconds = (next_slot - datetime.now(pytz.utc)).total_seconds()
+            if wait_seconds > 0:
+                self.stopped.wait(wait_seconds)
+        logging.info("Scheduler stopped.")
+
+    def stop(self, *args):
+        self.stopped.set()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Fetch new forecasts from DarkSky at regular intervals, in one resident process."
+    )
+    parser.add_argument(
+        "--retry-seconds",
+        type=int,
+        default=60,
+        help="how long to wait before trying a failed or skipped cycle again",
+    )
+    parser.add_argument("--shard-count", type=int, default=1)
+    parser.add_argument("--shard-index", type=int, default=0)
+    args = parser.parse_args()
+    scheduler = ForecastScheduler(shard_index=args.shard_index, shard_count=args.shard_count)
+    signal.signal(signal.SIGINT, scheduler.stop)
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    scheduler.run(retry_seconds=args.retry_seconds)
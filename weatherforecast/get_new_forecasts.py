@@ -1,8 +1,11 @@
-from typing import List, Union
+from typing import Any, Callable, Dict, List, Tuple, Union
+import argparse
 import os
 import logging
 from datetime import datetime, timedelta
 
+import pytz
+import numpy as np
 import pandas as pd
 from timely_beliefs import TimedBelief, DBTimedBelief
 from sqlalchemy.orm import Session
@@ -10,12 +13,29 @@ from sqlalchemy.orm import Session
 from weatherforecast.utils import (
     path_to_data,
     location_utility,
-    get_config,
+    get_settings,
+    Settings,
     cols as df_cols,
 )
-from weatherforecast.utils.Sensor import SensorName
-from weatherforecast.utils.weather_forecast_utility import create_forecasts
-from weatherforecast.utils.dbconfig import create_db_and_session
+from weatherforecast.utils.db_schema import ensure_future_partitions
+from weatherforecast.utils.cycle_lock import CycleLock, shard_lock_path
+from weatherforecast.utils.sharding import LocationClaims, select_shard
+from weatherforecast.utils import run_report
+from weatherforecast.utils.file_store import PartitionedFileStore, migrate_from_csv
+from weatherforecast.utils.fingerprints import FingerprintCache
+from weatherforecast.utils.forecast_archive import ForecastArchive
+from weatherforecast.utils.fetch_planning import FetchPlanner
+from weatherforecast.utils.forecast_pipeline import ForecastPipeline
+from weatherforecast.utils.weather_forecast_utility import (
+    darksky_provider,
+    create_forecasts,
+    create_forecast_frame,
+)
+from weatherforecast.utils.dbconfig import (
+    create_db_and_session,
+    bulk_insert_beliefs,
+    bulk_insert_frame,
+)
 
 """
 This module can be used to get new forecasts from DarkSkye and add them to either a csv file
@@ -24,111 +44,391 @@ You'd probably call this once per hour, which is DarkSkye's resolution.
 """
 
 
-def forecast_is_new(store: Union[Session, pd.DataFrame], fc: TimedBelief) -> bool:
+def forecast_is_new(
+    store: Union[Session, PartitionedFileStore],
+    fc: TimedBelief,
+    settings: Settings = None,
+) -> bool:
     """Find out if this specific forecast has already been added.
     We take the belief horizon into account. We only want to compare to the latest relevant belief.
     For instance, we believed x, later y and even later x again. That is all valuable knowledge.
     Should be rare, as beliefs usually become more accurate over time, but still.
     """
-    persistence_type = get_config("PERSISTENCE", "type")
-    if persistence_type == "file":  # store is a DataFrame
-        if store.empty:
-            return True
-        query = (  # TODO: only take latest belief into account, see db
-            "event_start == @fc.event_start & source == @fc.source.id &"
-            " sensor_id == @fc.sensor.id & event_value == @fc.event_value"
-        )
-        temp = store.query(query)
-        return temp.shape[0] == 0
+    if settings is None:
+        settings = get_settings()
+    persistence_type = settings.persistence_type
+    if persistence_type == "file":  # store is a PartitionedFileStore
+        return file_forecasts_are_new(store, [fc])[0]
     elif persistence_type == "db":  # store is a db session
-        latestRelevantBelief = (
-            store.query(DBTimedBelief)
+        return db_forecast_is_new(store, fc)
+    else:
+        raise Exception("Unkown persistence type: %s" % persistence_type)
+
+
+def db_forecast_is_new(session: Session, fc: TimedBelief) -> bool:
+    """Find out if this forecast is new, with one query against the database."""
+    latestRelevantBelief = (
+        session.query(DBTimedBelief)
+        .filter(
+            DBTimedBelief.event_start == fc.event_start,
+            DBTimedBelief.source_id == fc.source.id,
+            DBTimedBelief.sensor_id == fc.sensor.id,
+            DBTimedBelief.belief_horizon != fc.belief_horizon,
+        )
+        .order_by(DBTimedBelief.belief_horizon.asc())
+        .first()
+    )
+    if latestRelevantBelief is None:
+        return True
+    return latestRelevantBelief.event_value != fc.event_value
+
+
+def _as_utc(dt: datetime) -> datetime:
+    """Some databases (e.g. SQLite) hand back naive datetimes, which we know to be in UTC."""
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=pytz.utc)
+    return dt.astimezone(pytz.utc)
+
+
+def find_known_beliefs(
+    session: Session, current_forecasts: List[TimedBelief], chunk_size: int = 500
+) -> Dict[Tuple[int, datetime, int], List[Tuple[timedelta, float]]]:
+    """Look up all stored beliefs about the events in current_forecasts, with one query per chunk of sensors.
+    Returns the (belief_horizon, event_value) pairs per (sensor_id, event_start, source_id)."""
+    known_beliefs = {}
+    if len(current_forecasts) == 0:
+        return known_beliefs
+    event_starts = [fc.event_start for fc in current_forecasts]
+    rows = query_known_beliefs(
+        session,
+        {fc.sensor.id for fc in current_forecasts},
+        {fc.source.id for fc in current_forecasts},
+        min(event_starts),
+        max(event_starts),
+        chunk_size,
+    )
+    for sensor_id, event_start, source_id, belief_horizon, event_value in rows:
+        key = (sensor_id, _as_utc(event_start), source_id)
+        known_beliefs.setdefault(key, []).append((belief_horizon, event_value))
+    return known_beliefs
+
+
+def query_known_beliefs(
+    session: Session,
+    sensor_ids: set,
+    source_ids: set,
+    start: datetime,
+    end: datetime,
+    chunk_size: int = 500,
+) -> List[Tuple[int, datetime, int, timedelta, float]]:
+    """Stored (sensor_id, event_start, source_id, belief_horizon, event_value) of beliefs about events
+    between start and end (inclusive), with one query per chunk of sensors."""
+    sensor_ids = sorted(sensor_ids)
+    rows = []
+    for i in range(0, len(sensor_ids), chunk_size):
+        rows += (
+            session.query(
+                DBTimedBelief.sensor_id,
+                DBTimedBelief.event_start,
+                DBTimedBelief.source_id,
+                DBTimedBelief.belief_horizon,
+                DBTimedBelief.event_value,
+            )
             .filter(
-                DBTimedBelief.event_start == fc.event_start,
-                DBTimedBelief.source_id == fc.source.id,
-                DBTimedBelief.sensor_id == fc.sensor.id,
-                DBTimedBelief.belief_horizon != fc.belief_horizon,
+                DBTimedBelief.sensor_id.in_(sensor_ids[i : i + chunk_size]),
+                DBTimedBelief.source_id.in_(source_ids),
+                DBTimedBelief.event_start >= start,
+                DBTimedBelief.event_start <= end,
             )
-            .order_by(DBTimedBelief.belief_horizon.asc())
-            .first()
+            .all()
         )
-        if latestRelevantBelief is None:
-            return True
-        return latestRelevantBelief.event_value != fc.event_value
-    else:
-        raise Exception("Unkown persistence type: %s" % persistence_type)
+    return rows
+
+
+def _belief_time(fc: TimedBelief) -> datetime:
+    return fc.sensor.knowledge_time(fc.event_start) - fc.belief_horizon
+
+
+def _pick_new_forecasts(
+    current_forecasts: List[TimedBelief],
+    known_beliefs: Dict[tuple, List[Tuple[Any, float]]],
+    key_of: Callable[[TimedBelief], tuple],
+    recency_of: Callable[[TimedBelief], Any],
+) -> List[bool]:
+    """Compare each forecast to the latest relevant known belief about the same event.
+    known_beliefs holds (recency, event_value) pairs, where higher recency means believed later.
+    Known beliefs exactly as recent as the forecast itself are not relevant."""
+    are_new = []
+    for fc in current_forecasts:
+        recency = recency_of(fc)
+        relevant_beliefs = [
+            (belief_recency, event_value)
+            for belief_recency, event_value in known_beliefs.get(key_of(fc), [])
+            if belief_recency != recency
+        ]
+        if len(relevant_beliefs) == 0:
+            are_new.append(True)
+            continue
+        _, latest_value = max(relevant_beliefs, key=lambda belief: belief[0])
+        are_new.append(latest_value != fc.event_value)
+    return are_new
+
+
+def db_forecasts_are_new(
+    session: Session, current_forecasts: List[TimedBelief]
+) -> List[bool]:
+    """Batched version of db_forecast_is_new: find out for each forecast whether it is new.
+    The latest relevant belief is picked in memory, with the same rules as db_forecast_is_new."""
+    known_beliefs = {
+        key: [(-belief_horizon, event_value) for belief_horizon, event_value in beliefs]
+        for key, beliefs in find_known_beliefs(session, current_forecasts).items()
+    }
+    return _pick_new_forecasts(
+        current_forecasts,
+        known_beliefs,
+        key_of=lambda fc: (fc.sensor.id, _as_utc(fc.event_start), fc.source.id),
+        recency_of=lambda fc: -fc.belief_horizon,
+    )
 
 
+def file_forecasts_are_new(
+    store: PartitionedFileStore, current_forecasts: List[TimedBelief]
+) -> List[bool]:
+    """Find out for each forecast whether it is new, reading only the partitions of the forecast window."""
+    if len(current_forecasts) == 0:
+        return []
+    event_starts = [_as_utc(fc.event_start) for fc in current_forecasts]
+    known_beliefs = store.known_beliefs(
+        min(event_starts),
+        max(event_starts),
+        {fc.sensor.id for fc in current_forecasts},
+    )
+    return _pick_new_forecasts(
+        current_forecasts,
+        known_beliefs,
+        key_of=lambda fc: (fc.sensor.id, _as_utc(fc.event_start), fc.source.name),
+        recency_of=lambda fc: _as_utc(_belief_time(fc)),
+    )
+
+
+def beliefs_to_frame(beliefs: List[TimedBelief]) -> pd.DataFrame:
+    """Rows for file-based storage, with the columns in utils.cols"""
+    return pd.DataFrame(
+        [
+            (
+                _as_utc(fc.event_start),
+                _as_utc(_belief_time(fc)),
+                fc.source.name,
+                fc.sensor.id,
+                fc.event_value,
+            )
+            for fc in beliefs
+        ],
+        columns=df_cols,
+    )
+
+
+@run_report.stage("filter_out_known_forecast")
 def filter_out_known_forecast(
-    current_forecasts: List[TimedBelief], store: Union[Session, pd.DataFrame]
+    current_forecasts: List[TimedBelief],
+    store: Union[Session, PartitionedFileStore],
+    settings: Settings = None,
 ) -> List[TimedBelief]:
+    if settings is None:
+        settings = get_settings()
+    persistence_type = settings.persistence_type
+    if persistence_type == "db":
+        are_new = db_forecasts_are_new(store, current_forecasts)
+    elif persistence_type == "file":
+        are_new = file_forecasts_are_new(store, current_forecasts)
+    else:
+        raise Exception("Unkown persistence type: %s" % persistence_type)
+
     new_entries_list = []
-    for fc in current_forecasts:
-        if forecast_is_new(store, fc):
-            logging.debug("Adding new forecast: %s" % fc)
+    for fc, is_new in zip(current_forecasts, are_new):
+        if is_new:
+            logging.debug("Adding new forecast: %s", fc)
             new_entries_list.append(fc)
         else:
-            logging.debug("Did not add this new forecast: %s" % fc)
-            if get_config("PERSISTENCE", "type") == "db":
-                # is already in session because the linked sensor and source are
+            logging.debug("Did not add this new forecast: %s", fc)
+            if persistence_type == "db" and isinstance(fc, DBTimedBelief) and fc in store:
+                # is already in session if the linked sensor and source cascaded it there (SQLAlchemy < 2)
                 store.delete(fc)
 
+    run_report.count_per_city(
+        "beliefs_deduped",
+        [fc.sensor.id for fc, is_new in zip(current_forecasts, are_new) if not is_new],
+    )
     return new_entries_list
 
 
+@run_report.stage("save_forecasts")
 def save_forecasts(
-    new_entries: List[TimedBelief], store: Union[Session, pd.DataFrame]
-) -> Union[Session, pd.DataFrame]:
-    """Save forecasts which are deemed novel, to either file or database.
-       In the former case, the returned store object has been updated."""
+    new_entries: List[TimedBelief],
+    store: Union[Session, PartitionedFileStore],
+    settings: Settings = None,
+) -> Union[Session, PartitionedFileStore]:
+    """Save forecasts which are deemed novel, to either file or database."""
+    if settings is None:
+        settings = get_settings()
     if len(new_entries) > 0:
         logging.info("Adding {} new entries.".format(len(new_entries)))
-        persistence_type = get_config("PERSISTENCE", "type")
-        if persistence_type == "file":  # store is a DataFrame
-            new_entries_df = pd.DataFrame(
-                new_entries, columns=df_cols
-            )  # TODO: make work
-            store = store.append(new_entries_df, ignore_index=True, sort=True)
-            store.to_csv(
-                "%s/%s" % (path_to_data(), get_config("PERSISTENCE", "name")),
-                index=False,
-                columns=new_entries.columns,
-            )
+        persistence_type = settings.persistence_type
+        if persistence_type == "file":  # store is a PartitionedFileStore
+            inserted = store.append(beliefs_to_frame(new_entries))
+            logging.info("Appended {} entries.".format(inserted))
         elif persistence_type == "db":  # store is a db session
-            for belief in new_entries:
-                store.add(belief)
+            if settings.bulk_insert:
+                inserted = bulk_insert_beliefs(
+                    store,
+                    new_entries,
+                    chunk_size=settings.bulk_chunk_size,
+                    skip_existing=settings.idempotent_insert,
+                )
+            else:
+                for belief in new_entries:
+                    store.add(belief)
+                inserted = len(new_entries)
             store.commit()
+            logging.info("Inserted {} entries.".format(inserted))
         else:
             raise Exception("Unkown persistence type: %s" % persistence_type)
+        run_report.count_per_city("beliefs_written", [fc.sensor.id for fc in new_entries])
     else:
         logging.info("No new entries.")
     return store
 
 
-if __name__ == "__main__":
-    """
-    """
-    logging.basicConfig(level=logging.INFO)
-    sensor_names = SensorName.ALL.value
+# A row in a forecast frame is about the event identified by these columns
+FRAME_KEY_COLUMNS = ["sensor_id", "event_start", "source_id"]
 
-    store = None  # this determines where we keep forecasts
-    if get_config("PERSISTENCE", "type") == "file":
-        # reading historical forecasts once, which we will need for file-based storage
-        logging.info("Reading in existing forecasts ...")
-        if os.path.exists("%s/forecasts.csv" % path_to_data()):
-            store = pd.read_csv("%s/forecasts.csv" % path_to_data())
-        else:
-            store = pd.DataFrame()
+
+def select_new_forecasts(
+    frame: pd.DataFrame, known: pd.DataFrame, recency_column: str, latest_is_smallest: bool
+) -> pd.DataFrame:
+    """Keep the forecasts in frame which are new, compared to the known beliefs about the same events.
+    Like _pick_new_forecasts, but set-based: each forecast is compared to the latest relevant known belief,
+    i.e. the one with the smallest or largest recency_column (belief_horizon or belief_time),
+    leaving out known beliefs exactly as recent as the forecast itself."""
+    if frame.empty or known.empty:
+        return frame
+    current = frame[FRAME_KEY_COLUMNS + [recency_column]].copy()
+    current["row"] = np.arange(frame.shape[0])
+    merged = current.merge(
+        known[FRAME_KEY_COLUMNS + [recency_column, "event_value"]],
+        on=FRAME_KEY_COLUMNS,
+        suffixes=("", "_known"),
+    )
+    merged = merged[merged[recency_column + "_known"] != merged[recency_column]]
+    latest = merged.sort_values(
+        recency_column + "_known", ascending=latest_is_smallest
+    ).drop_duplicates("row")
+    rows = latest["row"].values
+    is_new = np.ones(frame.shape[0], dtype=bool)
+    is_new[rows] = latest["event_value"].values != frame["event_value"].values[rows]
+    return frame[is_new]
+
+
+@run_report.stage("filter_out_known_forecast_frame")
+def filter_out_known_forecast_frame(
+    frame: pd.DataFrame,
+    store: Union[Session, PartitionedFileStore],
+    settings: Settings = None,
+) -> pd.DataFrame:
+    """Like filter_out_known_forecast, for forecasts extracted as a frame."""
+    if settings is None:
+        settings = get_settings()
+    if frame.empty:
+        return frame
+    start = frame["event_start"].min().to_pydatetime()
+    end = frame["event_start"].max().to_pydatetime()
+    if settings.persistence_type == "db":
+        known = pd.DataFrame(
+            query_known_beliefs(
+                store,
+                {int(sensor_id) for sensor_id in frame["sensor_id"].unique()},
+                {int(source_id) for source_id in frame["source_id"].unique()},
+                start,
+                end,
+            ),
+            columns=FRAME_KEY_COLUMNS + ["belief_horizon", "event_value"],
+        )
+        known["event_start"] = pd.to_datetime(known["event_start"], utc=True)
+        known["belief_horizon"] = pd.to_timedelta(known["belief_horizon"])
+        new_frame = select_new_forecasts(
+            frame, known, "belief_horizon", latest_is_smallest=True
+        )
+    elif settings.persistence_type == "file":
+        known = store.read(start, end).rename(columns={"source": "source_id"})
+        known = known[known["sensor_id"].isin(frame["sensor_id"].unique())]
+        new_frame = select_new_forecasts(
+            frame, known, "belief_time", latest_is_smallest=False
+        )
     else:
-        store = create_db_and_session()
+        raise Exception("Unkown persistence type: %s" % settings.persistence_type)
+    logging.debug(
+        "{} of {} forecasts are new.".format(new_frame.shape[0], frame.shape[0])
+    )
+    run_report.count_per_city(
+        "beliefs_deduped", frame.loc[~frame.index.isin(new_frame.index), "sensor_id"]
+    )
+    return new_frame
 
-    for forecast_location in get_config("LOCATIONS"):
-        city, country = [s.strip() for s in forecast_location.split(",")]
-        logging.info("Getting weather forecasts for %s (%s) ..." % (city, country))
 
-        logging.info(
-            "Asking DarkSky for forecasts and finding out which ones are novel ..."
+@run_report.stage("save_forecast_frame")
+def save_forecast_frame(
+    new_entries: pd.DataFrame,
+    store: Union[Session, PartitionedFileStore],
+    settings: Settings = None,
+) -> Union[Session, PartitionedFileStore]:
+    """Like save_forecasts, for forecasts extracted as a frame. Database writes always go in bulk."""
+    if settings is None:
+        settings = get_settings()
+    if new_entries.empty:
+        logging.info("No new entries.")
+        return store
+    logging.info("Adding {} new entries.".format(new_entries.shape[0]))
+    if settings.persistence_type == "file":
+        inserted = store.append(new_entries.rename(columns={"source_id": "source"}))
+        logging.info("Appended {} entries.".format(inserted))
+    elif settings.persistence_type == "db":
+        inserted = bulk_insert_frame(
+            store,
+            new_entries,
+            chunk_size=settings.bulk_chunk_size,
+            skip_existing=settings.idempotent_insert,
         )
+        store.commit()
+        logging.info("Inserted {} entries.".format(inserted))
+    else:
+        raise Exception("Unkown persistence type: %s" % settings.persistence_type)
+    run_report.count_per_city("beliefs_written", new_entries["sensor_id"])
+    return store
+
+
+def create_file_store(settings: Settings = None) -> PartitionedFileStore:
+    """The directory of the file store is named after the configured file (e.g. forecasts.csv -> forecasts/).
+    If only a single forecasts file exists from before, it is migrated once."""
+    if settings is None:
+        settings = get_settings()
+    file_name = settings.persistence_name
+    legacy_csv_path = "%s/%s" % (path_to_data(), file_name)
+    store = PartitionedFileStore(
+        "%s/%s" % (path_to_data(), os.path.splitext(file_name)[0])
+    )
+    if os.path.isfile(legacy_csv_path) and not os.path.exists(store.directory):
+        migrate_from_csv(legacy_csv_path, store)
+    return store
+
+
+def find_locations(settings: Settings = None) -> pd.DataFrame:
+    """All locations of the cities in the LOCATIONS section, in one frame (None if none were found).
+    The last column (location_key) holds the key of each city in the LOCATIONS section."""
+    if settings is None:
+        settings = get_settings()
+    city_locations_list = []
+    for location_key, forecast_location in settings.location_entries.items():
+        city, country = [s.strip() for s in forecast_location.split(",")]
         city_locations = location_utility.get_city_location(city, country)
         if city_locations.index.size == 0:
             logging.warning(
@@ -136,8 +436,199 @@ if __name__ == "__main__":
                 " Maybe you misspelled it." % (city, country)
             )
             continue
-        current_forecasts = create_forecasts(
-            city_locations, sensor_names, 12
-        )  # TODO: make number of hours configurable
-        new_entries = filter_out_known_forecast(current_forecasts, store=store)
-        store = save_forecasts(new_entries, store=store)
+        city_locations_list.append(city_locations.assign(location_key=location_key))
+    if len(city_locations_list) == 0:
+        return None
+    # We ask DarkSky about all locations in one go, so requests can run concurrently
+    return pd.concat(city_locations_list, ignore_index=True)
+
+
+def run_forecast_cycle(
+    store: Union[Session, PartitionedFileStore],
+    locations: pd.DataFrame,
+    settings: Settings = None,
+    num_hours: int = None,
+    provider: Callable[[str, Tuple[float, float]], dict] = None,
+) -> Union[Session, PartitionedFileStore]:
+    """Fetch forecasts for the locations and save the novel ones to the store.
+    The number of hours, the sensors and the provider (call_darksky, see darksky_provider)
+    follow the INGESTION section of the config file, unless given.
+    The run is reported as configured in the REPORTING section (see run_report)."""
+    if settings is None:
+        settings = get_settings()
+    if num_hours is None:
+        num_hours = settings.num_hours
+    report = run_report.start_run_report()
+    if isinstance(store, Session):
+        run_report.watch_queries(store.get_bind())
+    try:
+        with report.stage("run"):
+            if isinstance(store, Session):
+                # a long-running scheduler never runs setup_schema again, so partitions are added here
+                ensure_future_partitions(store.get_bind(), settings.partition_months_ahead)
+            return _fetch_and_save(store, locations, settings, num_hours, provider)
+    finally:
+        run_report.finish_run_report()
+        try:
+            publish_run_report(report, settings)
+        except Exception:
+            # reporting must not hide the outcome of the run
+            logging.exception("Could not publish the run report.")
+
+
+def _fetch_and_save(
+    store: Union[Session, PartitionedFileStore],
+    locations: pd.DataFrame,
+    settings: Settings,
+    num_hours: int,
+    provider: Callable[[str, Tuple[float, float]], dict],
+) -> Union[Session, PartitionedFileStore]:
+    sensor_names = settings.sensor_names
+    logging.info(
+        "Asking DarkSky for forecasts for %d locations and finding out which ones are novel ..."
+        % locations.index.size
+    )
+    fingerprints = FingerprintCache(store) if settings.skip_unchanged else None
+    archive = None
+    if settings.archive_path != "":
+        archive = ForecastArchive(
+            os.path.join(path_to_data(), settings.archive_path),
+            segment_per_day=settings.archive_segment_per_day,
+        )
+    planner = FetchPlanner(
+        settings,
+        os.path.join(path_to_data(), settings.fetch_state_path),
+        provider if provider is not None else darksky_provider(settings),
+    )
+    try:
+        if settings.pipelined:
+            pipeline = ForecastPipeline(
+                store,
+                settings,
+                planner,
+                dedup=filter_out_known_forecast_frame,
+                write=save_forecast_frame,
+                sensor_names=sensor_names,
+                num_hours=num_hours,
+                fingerprints=fingerprints,
+                archive=archive,
+            )
+            store = pipeline.run(locations)
+        elif settings.extraction == "columnar":
+            forecast_frame = create_forecast_frame(
+                locations,
+                sensor_names,
+                num_hours,
+                settings=settings,
+                fingerprints=fingerprints,
+                planner=planner,
+                archive=archive,
+                store=store,
+            )
+            new_frame = filter_out_known_forecast_frame(
+                forecast_frame, store=store, settings=settings
+            )
+            store = save_forecast_frame(new_frame, store=store, settings=settings)
+        else:
+            current_forecasts = create_forecasts(
+                locations,
+                sensor_names,
+                num_hours,
+                settings=settings,
+                fingerprints=fingerprints,
+                planner=planner,
+                archive=archive,
+                store=store,
+            )
+            new_entries = filter_out_known_forecast(
+                current_forecasts, store=store, settings=settings
+            )
+            store = save_forecasts(new_entries, store=store, settings=settings)
+    except Exception:
+        # the calls count towards the quota, but the locations are fetched again next time
+        planner.commit(mark_fetched=False)
+        if fingerprints is not None:
+            fingerprints.discard()
+        raise
+    # only now that the forecasts are saved
+    planner.commit()
+    if fingerprints is not None:
+        fingerprints.commit()
+    return store
+
+
+def run_claimed_forecast_cycles(
+    session: Session,
+    locations: pd.DataFrame,
+    settings: Settings = None,
+    batch_size: int = 50,
+) -> Session:
+    """Run fetch cycles for batches of locations, as long as this worker can claim locations
+    which no other worker has claimed (see LocationClaims)."""
+    claims = LocationClaims(session.get_bind())
+    try:
+        batch = claims.claim(locations, batch_size)
+        while batch.index.size > 0:
+            session = run_forecast_cycle(session, batch, settings=settings)
+            batch = claims.claim(locations, batch_size)
+    finally:
+        claims.release()
+    return session
+
+
+def publish_run_report(report: run_report.RunReport, settings: Settings):
+    """Append the report to the JSON lines file and write the Prometheus textfile, if configured.
+    Relative paths are relative to the data directory."""
+    if settings.run_report_path != "":
+        report.append_to_json_lines(os.path.join(path_to_data(), settings.run_report_path))
+    if settings.prometheus_textfile != "":
+        report.write_prometheus_textfile(
+            os.path.join(path_to_data(), settings.prometheus_textfile)
+        )
+
+
+if __name__ == "__main__":
+    """
+    """
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Get new forecasts from DarkSky and save the novel ones."
+    )
+    parser.add_argument(
+        "--shard-count",
+        type=int,
+        default=1,
+        help="run as one of this many workers, each with its own part of the locations",
+    )
+    parser.add_argument("--shard-index", type=int, default=0, help="the part of this worker")
+    parser.add_argument(
+        "--claim",
+        action="store_true",
+        help="claim locations while running (through PostgreSQL advisory locks, or a claims table), "
+        "instead of taking a fixed part",
+    )
+    parser.add_argument("--claim-batch-size", type=int, default=50)
+    args = parser.parse_args()
+    settings = get_settings()
+    if args.claim and settings.persistence_type != "db":
+        parser.error("Locations can only be claimed with database persistence.")
+
+    store = None  # this determines where we keep forecasts
+    if settings.persistence_type == "file":
+        store = create_file_store(settings)
+    else:
+        store = create_db_and_session()
+
+    locations = find_locations(settings)
+    if locations is not None and args.claim:
+        store = run_claimed_forecast_cycles(
+            store, locations, settings=settings, batch_size=args.claim_batch_size
+        )
+    elif locations is not None:
+        if args.shard_count > 1:
+            locations = select_shard(locations, args.shard_index, args.shard_count)
+        with CycleLock(shard_lock_path(args.shard_index, args.shard_count)) as acquired:
+            if not acquired:
+                logging.warning("Another fetch cycle is running, so we skip this one.")
+            else:
+                store = run_forecast_cycle(store, locations, settings=settings)
@@ -1,21 +1,196 @@
+from typing import Dict, List
 import os.path
 import configparser
 
+from weatherforecast.utils.Sensor import SensorName
+
 
 cols = ["event_start", "belief_time", "source", "sensor_id", "event_value"]
 
+# blocks of a DarkSky response besides hourly, which we do not read
+UNUSED_DARKSKY_BLOCKS = ["currently", "minutely", "daily", "alerts", "flags"]
+
+
+def _parse_list(value: str) -> List[str]:
+    return [item.strip() for item in value.split(",") if item.strip() != ""]
+
+
+def _parse_sensor_names(value: str, option: str) -> List[str]:
+    sensor_names = _parse_list(value)
+    for sensor_name in sensor_names:
+        if sensor_name not in SensorName.ALL.value:
+            raise Exception(
+                "Unknown sensor %s for %s in the configuration file. Known sensors are: %s"
+                % (sensor_name, option, ", ".join(SensorName.ALL.value))
+            )
+    return sensor_names
+
+
+class Settings:
+    """The configuration file, parsed once into typed attributes.
+    Call reload_if_changed to pick up edits to the file (e.g. in long-running processes)."""
+
+    def __init__(self, conf_file_path: str) -> None:
+        if not os.path.exists(conf_file_path):
+            raise Exception("Cannot find configuration file at %s" % conf_file_path)
+        self.conf_file_path = conf_file_path
+        self.mtime = None
+        self.config = None
+        self.reload_if_changed()
+
+    def reload_if_changed(self) -> bool:
+        """Parse the configuration file again if it was modified since we last read it.
+        If the file cannot be parsed, the settings stay as they were (and the file is parsed again next time)."""
+        mtime = os.path.getmtime(self.conf_file_path)
+        if mtime == self.mtime:
+            return False
+        config = configparser.ConfigParser()
+        config.read(self.conf_file_path)
+        parsed = Settings.__new__(Settings)
+        parsed._parse(config)
+        self.__dict__.update(parsed.__dict__)
+        self.config = config
+        self.mtime = mtime
+        return True
+
+    def _parse(self, config: configparser.ConfigParser):
+        """Set the typed attributes from the configuration, raising if it is not valid."""
+        self.api_key: str = config.get("DARK_SKY", "API_KEY", fallback="")
+        self.concurrency: int = config.getint("DARK_SKY", "concurrency", fallback=1)
+        self.max_calls_per_second: float = config.getfloat(
+            "DARK_SKY", "max_calls_per_second", fallback=0
+        )
+        self.daily_quota: int = config.getint("DARK_SKY", "daily_quota", fallback=0)
+        self.retries: int = config.getint("DARK_SKY", "retries", fallback=2)
+        self.retry_delay_seconds: float = config.getfloat(
+            "DARK_SKY", "retry_delay_seconds", fallback=1.0
+        )
+        self.request_timeout_seconds: float = config.getfloat(
+            "DARK_SKY", "request_timeout_seconds", fallback=10.0
+        )
+        self.fetch_state_path: str = config.get(
+            "DARK_SKY", "fetch_state", fallback="fetch_state.json"
+        )
+        self.location_entries: Dict[str, str] = (
+            dict(config.items("LOCATIONS")) if config.has_section("LOCATIONS") else {}
+        )
+        self.locations: List[str] = list(self.location_entries.values())
+        self.refresh_hours: Dict[str, float] = (
+            {k: config.getfloat("REFRESH_HOURS", k) for k in config.options("REFRESH_HOURS")}
+            if config.has_section("REFRESH_HOURS")
+            else {}
+        )
+        self.priorities: Dict[str, int] = (
+            {k: config.getint("PRIORITIES", k) for k in config.options("PRIORITIES")}
+            if config.has_section("PRIORITIES")
+            else {}
+        )
+        self.num_hours: int = config.getint("INGESTION", "hours", fallback=12)
+        self.sensor_names: List[str] = (
+            _parse_sensor_names(config.get("INGESTION", "sensors"), "INGESTION")
+            if config.has_option("INGESTION", "sensors")
+            else list(SensorName.ALL.value)
+        )
+        self.sensors_per_location: Dict[str, List[str]] = (
+            {
+                k: _parse_sensor_names(config.get("SENSORS", k), k)
+                for k in config.options("SENSORS")
+            }
+            if config.has_section("SENSORS")
+            else {}
+        )
+        self.excluded_blocks: List[str] = _parse_list(
+            config.get("INGESTION", "exclude", fallback=", ".join(UNUSED_DARKSKY_BLOCKS))
+        )
+        self.persistence_type: str = config.get("PERSISTENCE", "type", fallback="db")
+        self.persistence_name: str = config.get("PERSISTENCE", "name", fallback="")
+        self.bulk_insert: bool = config.getboolean(
+            "PERSISTENCE", "bulk_insert", fallback=False
+        )
+        self.bulk_chunk_size: int = config.getint(
+            "PERSISTENCE", "bulk_chunk_size", fallback=5000
+        )
+        self.idempotent_insert: bool = config.getboolean(
+            "PERSISTENCE", "idempotent_insert", fallback=False
+        )
+        self.skip_unchanged: bool = config.getboolean(
+            "PERSISTENCE", "skip_unchanged", fallback=False
+        )
+        self.extraction: str = config.get(
+            "PERSISTENCE", "extraction", fallback="objects"
+        )
+        self.create_indexes: bool = config.getboolean(
+            "PERSISTENCE", "create_indexes", fallback=False
+        )
+        self.partition_months_ahead: int = config.getint(
+            "PERSISTENCE", "partition_months_ahead", fallback=0
+        )
+        self.archive_path: str = config.get("PERSISTENCE", "archive", fallback="")
+        self.archive_segment_per_day: bool = config.getboolean(
+            "PERSISTENCE", "archive_segment_per_day", fallback=False
+        )
+        self.pipelined: bool = config.getboolean("PIPELINE", "enabled", fallback=False)
+        self.pipeline_batch_size: int = config.getint(
+            "PIPELINE", "batch_size", fallback=50
+        )
+        self.pipeline_queue_size: int = config.getint(
+            "PIPELINE", "queue_size", fallback=100
+        )
+        self.pipeline_write_rows: int = config.getint(
+            "PIPELINE", "write_rows", fallback=50000
+        )
+        if (
+            self.idempotent_insert
+            and not self.bulk_insert
+            and self.persistence_type == "db"
+            and self.extraction == "objects"
+            and not self.pipelined
+        ):
+            # belief objects added to the session one by one cannot skip existing beliefs
+            raise Exception(
+                "idempotent_insert needs bulk_insert (or columnar extraction) in the PERSISTENCE section "
+                "of the configuration file."
+            )
+        self.schedule_interval_minutes: int = config.getint(
+            "SCHEDULER", "interval_minutes", fallback=60
+        )
+        self.schedule_offset_minutes: int = config.getint(
+            "SCHEDULER", "offset_minutes", fallback=0
+        )
+        self.run_report_path: str = config.get(
+            "REPORTING", "run_report", fallback=""
+        )
+        self.prometheus_textfile: str = config.get(
+            "REPORTING", "prometheus_textfile", fallback=""
+        )
+
+    def get(self, section: str, option: str = None, fallback: str = None):
+        if option is None:
+            return [v for _, v in self.config.items(section)]
+        if fallback is not None:
+            return self.config.get(section, option, fallback=fallback)
+        return self.config.get(section, option)
+
+
+_settings: Settings = None
+
+
+def get_settings(reload: bool = False) -> Settings:
+    """The settings of this process, parsed when first needed.
+    With reload=True, they are re-parsed if the configuration file has changed in the meantime.
+    Long-running processes do that once per cycle (see ForecastScheduler.run), not on every call."""
+    global _settings
+    if _settings is None:
+        _settings = Settings("%s/configuration.ini" % path_to_config())
+    elif reload:
+        _settings.reload_if_changed()
+    return _settings
+
 
-def get_config(section: str = None, option: str = None) -> str:
+def get_config(section: str = None, option: str = None, fallback: str = None) -> str:
     if section is None:
         raise Exception("Cannot get config when section is None ...")
-    conf_file_path = "%s/configuration.ini" % path_to_config()
-    if not os.path.exists(conf_file_path):
-        raise Exception("Cannot find configuration file at %s" % conf_file_path)
-    config = configparser.ConfigParser()
-    config.read(conf_file_path)
-    if option is None:
-        return [v for _, v in config.items(section)]
-    return config.get(section, option)
+    return get_settings().get(section, option, fallback=fallback)
 
 
 def _path_to_main() -> str:
@@ -0,0 +1,67 @@
+import os
+import logging
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+from weatherforecast.utils import path_to_data
+
+"""
+A lock which makes sure only one fetch cycle runs at a time, also across processes
+(e.g. a cron job and the scheduler daemon). It is an advisory lock (flock) on a file in the data directory,
+so the operating system releases it when a process dies, and a stale lock file does no harm.
+"""
+
+LOCK_FILE_NAME = "fetch_cycle.lock"
+
+
+def shard_lock_path(shard_index: int = 0, shard_count: int = 1) -> str:
+    """Workers of different shards (see sharding.select_shard) may run at the same time, so each shard has its own lock."""
+    if shard_count <= 1:
+        return os.path.join(path_to_data(), LOCK_FILE_NAME)
+    return os.path.join(
+        path_to_data(), "fetch_cycle_shard_%d_of_%d.lock" % (shard_index, shard_count)
+    )
+
+
+class CycleLock:
+    def __init__(self, lock_path: str = None) -> None:
+        if lock_path is None:
+            lock_path = os.path.join(path_to_data(), LOCK_FILE_NAME)
+        self.lock_path = lock_path
+        self._lock_file = None
+
+    def acquire(self, blocking: bool = False) -> bool:
+        """Take the lock, by default without waiting. Returns False if another process holds it."""
+        if self._lock_file is not None:
+            return False
+        lock_file = open(self.lock_path, "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(
+                    lock_file.fileno(),
+                    fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB,
+                )
+            except OSError:
+                lock_file.close()
+                return False
+        else:
+            logging.warning("Cannot lock %s on this platform." % self.lock_path)
+        self._lock_file = lock_file
+        return True
+
+    def release(self):
+        if self._lock_file is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+        self._lock_file.close()
+        self._lock_file = None
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
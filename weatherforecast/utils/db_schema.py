@@ -0,0 +1,146 @@
+from datetime import date, datetime
+from typing import List
+import logging
+
+from sqlalchemy import MetaData, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateTable
+from timely_beliefs import DBTimedBelief
+
+"""
+Optional schema setup for the belief table, beyond what metadata.create_all does.
+The indexes serve the novelty check (filter on sensor, source and event start, order by belief horizon)
+and reads of the latest beliefs per event (see forecast_query). On PostgreSQL, the belief table can be
+partitioned by month of event start, so old months can be detached or dropped cheaply.
+"""
+
+BELIEF_INDEXES = {
+    "ix_timed_beliefs_sensor_source_event_horizon": [
+        "sensor_id",
+        "source_id",
+        "event_start",
+        "belief_horizon",
+    ],
+    "ix_timed_beliefs_event_start_sensor": ["event_start", "sensor_id"],
+}
+
+
+def create_belief_indexes(engine: Engine):
+    table_name = DBTimedBelief.__tablename__
+    with engine.begin() as connection:
+        for index_name, columns in BELIEF_INDEXES.items():
+            logging.info("Creating index %s (if it does not exist yet) ..." % index_name)
+            connection.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS %s ON %s (%s)"
+                    % (index_name, table_name, ", ".join(columns))
+                )
+            )
+
+
+def belief_table_is_partitioned(engine: Engine) -> bool:
+    if engine.dialect.name != "postgresql":
+        return False
+    with engine.begin() as connection:
+        return connection.execute(
+            text(
+                "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid"
+                " WHERE c.relname = :name)"
+            ),
+            {"name": DBTimedBelief.__tablename__},
+        ).scalar()
+
+
+def create_partitioned_belief_table(engine: Engine) -> bool:
+    """On PostgreSQL, create the belief table partitioned by range of event start.
+    The tables it refers to (sensors and sources) have to exist already. An existing belief table is left alone (turning it into a partitioned table is a manual migration).
+    Returns whether the belief table is partitioned."""
+    if engine.dialect.name != "postgresql":
+        logging.warning("Partitioning of the belief table is only supported on PostgreSQL.")
+        return False
+    table = DBTimedBelief.__table__
+    with engine.connect() as connection:
+        table_exists = engine.dialect.has_table(connection, table.name)
+    if table_exists:
+        partitioned = belief_table_is_partitioned(engine)
+        if not partitioned:
+            logging.warning(
+                "Table %s already exists without partitions, so it is not partitioned." % table.name
+            )
+        return partitioned
+    ddl = str(CreateTable(table).compile(dialect=engine.dialect)).rstrip()
+    with engine.begin() as connection:
+        connection.execute(text("%s PARTITION BY RANGE (event_start)" % ddl))
+        connection.execute(
+            text(
+                "CREATE TABLE IF NOT EXISTS %s_default PARTITION OF %s DEFAULT"
+                % (table.name, table.name)
+            )
+        )
+    return True
+
+
+def month_starts(first_month: date, months: int) -> List[date]:
+    starts = []
+    year, month = first_month.year, first_month.month
+    for _ in range(months + 1):
+        starts.append(date(year, month, 1))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return starts
+
+
+def create_future_partitions(engine: Engine, months_ahead: int = 3, today: date = None):
+    """Make sure there is a partition of the belief table for this month and the next months_ahead months.
+    Run it regularly, so new beliefs never end up in the default partition (run_forecast_cycle does so
+    through ensure_future_partitions)."""
+    if today is None:
+        today = datetime.utcnow().date()
+    table_name = DBTimedBelief.__tablename__
+    starts = month_starts(today, months_ahead + 1)
+    with engine.begin() as connection:
+        for start, end in zip(starts[:-1], starts[1:]):
+            connection.execute(
+                text(
+                    "CREATE TABLE IF NOT EXISTS %s_y%04dm%02d PARTITION OF %s"
+                    " FOR VALUES FROM ('%s') TO ('%s')"
+                    % (
+                        table_name,
+                        start.year,
+                        start.month,
+                        table_name,
+                        start.isoformat(),
+                        end.isoformat(),
+                    )
+                )
+            )
+
+
+def ensure_future_partitions(engine: Engine, months_ahead: int):
+    """Create the partitions of the coming months, if the belief table is partitioned (on PostgreSQL)."""
+    if months_ahead > 0 and belief_table_is_partitioned(engine):
+        create_future_partitions(engine, months_ahead)
+
+
+def setup_schema(
+    engine: Engine,
+    metadata: MetaData,
+    create_indexes: bool = False,
+    partition_months_ahead: int = 0,
+):
+    """Create all tables (like metadata.create_all), plus the opt-in indexes and partitions.
+    With partition_months_ahead > 0, the belief table is partitioned (on PostgreSQL),
+    with partitions up to that many months ahead."""
+    partitioned = False
+    if partition_months_ahead > 0:
+        other_tables = [
+            table
+            for table in metadata.sorted_tables
+            if table.name != DBTimedBelief.__tablename__
+        ]
+        metadata.create_all(engine, tables=other_tables)
+        partitioned = create_partitioned_belief_table(engine)
+    metadata.create_all(engine)
+    if partitioned:
+        create_future_partitions(engine, partition_months_ahead)
+    if create_indexes:
+        create_belief_indexes(engine)
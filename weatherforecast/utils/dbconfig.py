@@ -1,11 +1,16 @@
-from typing import Any, Optional, Tuple, Union, List, Callable
+from typing import Any, Optional, Tuple, Union, List, Callable, Dict
 from datetime import timedelta, datetime
+import csv
+import io
+import logging
 
-from sqlalchemy import create_engine, MetaData
-from sqlalchemy import Column, Float, String
+from sqlalchemy import create_engine, MetaData, text
+from sqlalchemy import BigInteger, Column, Float, String
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects import postgresql
 
-from weatherforecast.utils import get_config
+from weatherforecast.utils import get_config, get_settings
+from weatherforecast.utils.db_schema import setup_schema
 from timely_beliefs import DBBeliefSource, DBSensor, DBTimedBelief
 from timely_beliefs.db_base import Base as TBBase
 from weatherforecast.utils.Sensor import SensorName
@@ -44,6 +49,40 @@ class DBLocatedSensor(DBSensor):
         )
 
 
+def _accept_located_sensors():
+    """DBSensor does not load its subclasses polymorphically (it has no discriminator column),
+    so SQLAlchemy refuses to flush beliefs about located sensors unless the type check is off.
+    The relationship hands its setting to its dependency processor when it is set up, so both are changed."""
+    relationship = DBTimedBelief.sensor.property
+    relationship.enable_typechecks = False
+    relationship._dependency_processor.enable_typechecks = False
+
+
+_accept_located_sensors()
+
+
+class DBForecastFingerprint(TBBase):
+    """The fingerprint of the forecasts last saved for a location (see fingerprints.py)"""
+
+    __tablename__ = "forecast_fingerprint"
+
+    location_name = Column(String(80), primary_key=True)
+    # the first event of the forecast window, as a unix timestamp
+    window_start = Column(BigInteger(), nullable=False)
+    fingerprint = Column(String(40), nullable=False)
+
+
+class DBLocationClaim(TBBase):
+    """A location claimed by a worker, on databases without advisory locks (see sharding.py)"""
+
+    __tablename__ = "location_claim"
+
+    location_name = Column(String(80), primary_key=True)
+    worker = Column(String(80), nullable=False)
+    # when the claim was made, as a unix timestamp
+    claimed_at = Column(BigInteger(), nullable=False)
+
+
 def create_db_and_session():
     db_connection_string = get_config("PERSISTENCE", "name")
     print(
@@ -51,15 +90,25 @@ def create_db_and_session():
     )
     global SessionClass, session
 
-    engine = create_engine(db_connection_string)
+    # connections are checked before use, as long-running processes (see forecast_scheduler) keep them in a pool
+    engine = create_engine(db_connection_string, pool_pre_ping=True)
     SessionClass.configure(bind=engine)
 
-    TBBase.metadata.create_all(engine)
+    settings = get_settings()
+    setup_schema(
+        engine,
+        TBBase.metadata,
+        create_indexes=settings.create_indexes,
+        partition_months_ahead=settings.partition_months_ahead,
+    )
 
     if session is None:
-        session = SessionClass()
+        # The fetch session keeps its sensors and source loaded across commits (see SensorRegistry),
+        # instead of reloading them on next use. Other sessions expire their objects on commit, as usual.
+        session = SessionClass(expire_on_commit=False)
 
     create_darksky_source(session)
+    sensor_registry.warm(session)
 
     return session
 
@@ -72,31 +121,224 @@ def create_darksky_source(session):
         session.commit()
 
 
+class SensorRegistry:
+    """Located sensors by (name, latitude, longitude), kept in memory because they hardly ever change.
+    Warm it once with all sensors in the database, and then only unknown sensors cause database work."""
+
+    def __init__(self) -> None:
+        self.sensors: Dict[Tuple[str, float, float], DBLocatedSensor] = {}
+        self.warmed = False
+
+    def warm(self, session):
+        self.sensors = {
+            (sensor.name, sensor.latitude, sensor.longitude): sensor
+            for sensor in session.query(DBLocatedSensor).all()
+        }
+        self.warmed = True
+
+    def get_or_create_sensors_for_locations(
+        self,
+        session,
+        locations: List[Tuple[float, float, str]],
+        sensor_names: List[str] = None,
+        sensor_names_per_location: List[List[str]] = None,
+    ) -> List[List[DBLocatedSensor]]:
+        """For each (latitude, longitude, location_name), return its sensors.
+        The sensors are the same for each location, unless sensor_names_per_location is given.
+        Missing sensors for all locations are created together, with one commit."""
+        if not self.warmed:
+            self.warm(session)
+        if sensor_names is None:
+            sensor_names = SensorName.ALL.value
+        if sensor_names_per_location is None:
+            sensor_names_per_location = [sensor_names] * len(locations)
+        new_sensors = []
+        sensors_per_location = []
+        for (latitude, longitude, location_name), location_sensor_names in zip(
+            locations, sensor_names_per_location
+        ):
+            sensors = []
+            for sensor_name in location_sensor_names:
+                key = (sensor_name, latitude, longitude)
+                sensor = self.sensors.get(key)
+                if sensor is None:
+                    logging.info("Creating sensor %s at %s ..." % (sensor_name, location_name))
+                    sensor = DBLocatedSensor(
+                        name=sensor_name,
+                        latitude=latitude,
+                        longitude=longitude,
+                        location_name=location_name,
+                        event_resolution=timedelta(minutes=15),
+                    )
+                    self.sensors[key] = sensor
+                    new_sensors.append(sensor)
+                sensors.append(sensor)
+            sensors_per_location.append(sensors)
+        if len(new_sensors) > 0:
+            session.add_all(new_sensors)
+            session.commit()
+        return sensors_per_location
+
+
+sensor_registry = SensorRegistry()
+
+
 def get_or_create_sensors_for(
     session, latitude, longitude, location_name
 ) -> List[DBLocatedSensor]:
-    sensors = []
-    added_sensors_to_db = False
-    for sensor_name in SensorName.ALL.value:
-        db_sensor = (
-            session.query(DBLocatedSensor)
-            .filter_by(name=sensor_name, latitude=latitude, longitude=longitude)
-            .first()
+    return sensor_registry.get_or_create_sensors_for_locations(
+        session, [(latitude, longitude, location_name)]
+    )[0]
+
+
+def _belief_to_row(belief) -> dict:
+    return dict(
+        event_start=belief.event_start,
+        belief_horizon=belief.belief_horizon,
+        cumulative_probability=belief.cumulative_probability,
+        event_value=belief.event_value,
+        sensor_id=belief.sensor.id,
+        source_id=belief.source.id,
+    )
+
+
+def bulk_insert_beliefs(
+    session, beliefs: list, chunk_size: int = 5000, skip_existing: bool = False
+) -> int:
+    """Insert beliefs without going through the ORM unit of work (see bulk_insert_rows).
+    The beliefs only need the attributes of a TimedBelief, e.g. a BeliefRecord will do.
+    Does not commit. Returns the number of inserted beliefs."""
+    return bulk_insert_rows(
+        session,
+        [_belief_to_row(belief) for belief in beliefs],
+        chunk_size,
+        skip_existing,
+    )
+
+
+def bulk_insert_frame(
+    session, frame, chunk_size: int = 5000, skip_existing: bool = False
+) -> int:
+    """Insert beliefs given as a frame (with the columns of the belief table), see bulk_insert_rows.
+    Does not commit. Returns the number of inserted beliefs."""
+    rows = [
+        dict(
+            event_start=event_start.to_pydatetime(),
+            belief_horizon=belief_horizon.to_pytimedelta(),
+            cumulative_probability=float(cumulative_probability),
+            event_value=float(event_value),
+            sensor_id=int(sensor_id),
+            source_id=int(source_id),
+        )
+        for event_start, belief_horizon, cumulative_probability, event_value, sensor_id, source_id in zip(
+            frame["event_start"],
+            frame["belief_horizon"],
+            frame["cumulative_probability"],
+            frame["event_value"],
+            frame["sensor_id"],
+            frame["source_id"],
         )
-        if db_sensor is not None:
-            sensors.append(db_sensor)
+    ]
+    return bulk_insert_rows(session, rows, chunk_size, skip_existing)
+
+
+def bulk_insert_rows(
+    session, rows: List[dict], chunk_size: int = 5000, skip_existing: bool = False
+) -> int:
+    """Insert rows into the belief table, chunk by chunk.
+    On PostgreSQL (with psycopg2) we use COPY, elsewhere a Core-level executemany.
+    With skip_existing, rows whose primary key is already in the table are skipped instead of failing
+    the insert (ON CONFLICT DO NOTHING), so that concurrent workers can safely write the same beliefs.
+    Does not commit. Returns the number of inserted rows."""
+    table = DBTimedBelief.__table__
+    connection = session.connection()
+    use_copy = (
+        connection.dialect.name == "postgresql"
+        and connection.dialect.driver == "psycopg2"
+    )
+    if skip_existing and use_copy:
+        _create_staging_table(connection, table)
+    inserted = 0
+    for i in range(0, len(rows), chunk_size):
+        chunk = rows[i : i + chunk_size]
+        if skip_existing and use_copy:
+            inserted += _copy_rows_skipping_existing(connection, table, chunk)
+        elif use_copy:
+            _copy_rows(connection, table, chunk)
+            inserted += len(chunk)
+        elif skip_existing:
+            result = connection.execute(_insert_skipping_existing(connection, table), chunk)
+            # not all drivers count the rows of an executemany
+            inserted += result.rowcount if result.rowcount >= 0 else len(chunk)
         else:
-            print("Creating sensor %s at %s ..." % (sensor_name, location_name))
-            new_sensor = DBLocatedSensor(
-                name=sensor_name,
-                latitude=latitude,
-                longitude=longitude,
-                location_name=location_name,
-                event_resolution=timedelta(minutes=15),
-            )
-            sensors.append(new_sensor)
-            session.add(new_sensor)
-            added_sensors_to_db = True
-    if added_sensors_to_db:
-        session.commit()
-    return sensors
+            connection.execute(table.insert(), chunk)
+            inserted += len(chunk)
+    return inserted
+
+
+def _insert_skipping_existing(connection, table):
+    dialect_name = connection.dialect.name
+    if dialect_name == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect_name == "sqlite":
+        return table.insert().prefix_with("OR IGNORE")
+    if dialect_name == "mysql":
+        return table.insert().prefix_with("IGNORE")
+    raise Exception("Cannot skip existing beliefs on %s" % dialect_name)
+
+
+def _staging_table_name(table) -> str:
+    return "%s_staging" % table.name
+
+
+def _create_staging_table(connection, table):
+    """A temporary table to COPY into, before the rows are moved into the table itself."""
+    connection.execute(
+        text(
+            "CREATE TEMPORARY TABLE IF NOT EXISTS %s (LIKE %s INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+            % (_staging_table_name(table), table.name)
+        )
+    )
+
+
+def _copy_rows_skipping_existing(connection, table, rows: List[dict]) -> int:
+    staging_table_name = _staging_table_name(table)
+    _copy_rows(connection, table, rows, table_name=staging_table_name)
+    columns = ", ".join(rows[0].keys())
+    # WHERE true keeps ON CONFLICT from being parsed as a join constraint (by SQLite)
+    result = connection.execute(
+        text(
+            "INSERT INTO %s (%s) SELECT %s FROM %s WHERE true ON CONFLICT DO NOTHING"
+            % (table.name, columns, columns, staging_table_name)
+        )
+    )
+    connection.execute(text("DELETE FROM %s" % staging_table_name))
+    return result.rowcount
+
+
+def _copy_value(value):
+    """Format a value so PostgreSQL can parse it from CSV."""
+    if isinstance(value, timedelta):
+        return "%f seconds" % value.total_seconds()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _copy_rows(connection, table, rows: List[dict], table_name: str = None):
+    if table_name is None:
+        table_name = table.name
+    columns = list(rows[0].keys())
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([_copy_value(row[c]) for c in columns])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            "COPY %s (%s) FROM STDIN WITH CSV" % (table_name, ", ".join(columns)),
+            buffer,
+        )
+    finally:
+        cursor.close()
@@ -0,0 +1,289 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Tuple
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import pandas as pd
+import pytz
+
+from weatherforecast.utils import Settings, run_report
+from weatherforecast.utils.cycle_lock import CycleLock
+
+"""
+Deciding which locations to ask DarkSky about in a fetch run, and pacing the calls:
+
+- Locations can be given a refresh interval (REFRESH_HOURS section) and a priority (PRIORITIES section),
+  both keyed like the LOCATIONS section. Locations are only fetched when their refresh interval has passed,
+  those with the highest priority first.
+- Calls are limited to a rate per second (a token bucket) and to a daily quota (counted per UTC day).
+  When the quota is used up, the remaining locations are left for later.
+- Failed calls are retried with exponential backoff and jitter. A location which keeps failing is left
+  out of the run, instead of aborting it.
+
+When each location was last fetched, and how much of today's quota is used, is kept in a JSON file,
+which is shared by all workers on a machine. It is updated by commit, which should be called once the
+forecasts are saved. Workers running at the same time only see each other's calls after a commit,
+so together they can go slightly over the daily quota.
+"""
+
+STATE_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class TokenBucket:
+    """Allows rate calls per second on average, with bursts of up to capacity calls."""
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.capacity
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, waiting until there is one."""
+        while True:
+            with self._lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                # after waiting for a token, rounding can leave the bucket a hair short of one
+                if self.tokens >= 1 - 1e-9:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+class DailyQuota:
+    """At most limit calls per UTC day (no limit if limit is 0)."""
+
+    def __init__(self, limit: int, day: date = None, used: int = 0) -> None:
+        self.limit = limit
+        self.day = day
+        self.used = used
+        self.taken = 0  # by this process, since the last commit (see FetchPlanner.commit)
+        self._lock = threading.Lock()
+
+    def take(self, today: date):
+        with self._lock:
+            if today != self.day:
+                self.day = today
+                self.used = 0
+                self.taken = 0
+            if self.limit > 0 and self.used >= self.limit:
+                raise QuotaExceeded("The daily quota of %d calls is used up." % self.limit)
+            self.used += 1
+            self.taken += 1
+
+
+def backoff_delay(
+    attempt: int, base_delay: float, max_delay: float = 60.0, rng: random.Random = None
+) -> float:
+    """The exponential delay before retry number attempt (counting from 0),
+    with a random jitter between half and one and a half times it."""
+    if rng is None:
+        rng = random.Random()
+    return min(max_delay, base_delay * 2 ** attempt) * rng.uniform(0.5, 1.5)
+
+
+def backoff_delays(
+    retries: int, base_delay: float, max_delay: float = 60.0, rng: random.Random = None
+) -> List[float]:
+    """The delays before each retry (see backoff_delay)."""
+    if rng is None:
+        rng = random.Random()
+    return [backoff_delay(attempt, base_delay, max_delay, rng) for attempt in range(retries)]
+
+
+class FetchPlanner:
+    def __init__(
+        self,
+        settings: Settings,
+        state_path: str,
+        provider: Callable[[str, Tuple[float, float]], dict],
+        now: Callable[[], datetime] = lambda: datetime.now(pytz.utc),
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        rng: random.Random = None,
+    ) -> None:
+        """now, clock, sleep and rng can be replaced, e.g. to test without waiting."""
+        self.settings = settings
+        self.state_path = state_path
+        self.provider = provider
+        self.now = now
+        self.sleep = sleep
+        self.rng = rng if rng is not None else random.Random()
+        self.bucket = None
+        if settings.max_calls_per_second > 0:
+            self.bucket = TokenBucket(settings.max_calls_per_second, clock=clock, sleep=sleep)
+        self.last_fetched: Dict[str, datetime] = {}
+        self.quota = DailyQuota(settings.daily_quota)
+        self._fetched_now: Dict[str, datetime] = {}
+        self._load_state()
+
+    def _read_state(self) -> Tuple[Dict[str, datetime], date, int]:
+        """When locations were last fetched, and the quota day and its number of used calls"""
+        if not os.path.exists(self.state_path):
+            return {}, None, 0
+        with open(self.state_path) as state_file:
+            state = json.load(state_file)
+        last_fetched = {
+            location_name: datetime.strptime(fetched, STATE_TIME_FORMAT).replace(tzinfo=pytz.utc)
+            for location_name, fetched in state.get("last_fetched", {}).items()
+        }
+        quota_day = None
+        if "quota_day" in state:
+            quota_day = datetime.strptime(state["quota_day"], "%Y-%m-%d").date()
+        return last_fetched, quota_day, state.get("quota_used", 0)
+
+    def _load_state(self):
+        self.last_fetched, self.quota.day, self.quota.used = self._read_state()
+
+    def commit(self, mark_fetched: bool = True):
+        """Record the calls made since the last commit, and (with mark_fetched) which locations were fetched.
+        Calls made by other workers in the meantime are taken into account."""
+        lock = CycleLock("%s.lock" % self.state_path)
+        lock.acquire(blocking=True)
+        try:
+            last_fetched, quota_day, quota_used = self._read_state()
+            if mark_fetched:
+                last_fetched.update(self._fetched_now)
+            self._fetched_now = {}
+            if quota_day == self.quota.day:
+                self.quota.used = quota_used + self.quota.taken
+            self.quota.taken = 0
+            self.last_fetched = last_fetched
+            state = dict(
+                last_fetched={
+                    location_name: fetched.strftime(STATE_TIME_FORMAT)
+                    for location_name, fetched in last_fetched.items()
+                },
+                quota_used=self.quota.used,
+            )
+            if self.quota.day is not None:
+                state["quota_day"] = self.quota.day.isoformat()
+            temporary_path = "%s.tmp" % self.state_path
+            with open(temporary_path, "w") as state_file:
+                json.dump(state, state_file)
+            os.replace(temporary_path, self.state_path)
+        finally:
+            lock.release()
+
+    def plan(self, locations: pd.DataFrame) -> pd.DataFrame:
+        """The locations which are due, highest priority first. Locations are keyed in the config file
+        like in the LOCATIONS section (see the location_key column of find_locations)."""
+        now = self.now()
+        # a little slack, so a location refreshed every hour is due again at the next hourly run
+        slack = timedelta(minutes=5)
+        if "location_key" in locations:
+            keys = locations["location_key"]
+        else:
+            keys = [None] * locations.shape[0]
+        due = []
+        priorities = []
+        for location_name, key in zip(locations["location_name"], keys):
+            refresh_hours = self.settings.refresh_hours.get(key)
+            last_fetched = self.last_fetched.get(location_name)
+            due.append(
+                refresh_hours is None
+                or last_fetched is None
+                or now - last_fetched >= timedelta(hours=refresh_hours) - slack
+            )
+            priorities.append(self.settings.priorities.get(key, 0))
+        planned = locations.assign(priority=priorities)[due]
+        if planned.shape[0] < locations.shape[0]:
+            not_due = locations.shape[0] - planned.shape[0]
+            logging.info("%d of %d locations are not due yet" % (not_due, locations.shape[0]))
+            run_report.count("locations_not_due", not_due)
+        # a stable sort keeps the configured order among locations with the same priority
+        planned = planned.sort_values("priority", ascending=False, kind="mergesort")
+        return planned.drop(columns="priority").reset_index(drop=True)
+
+    def call(
+        self, api_key: str, location: Tuple[float, float], retries: int = None
+    ) -> Tuple[datetime, dict]:
+        """Call the provider within rate and quota, retrying failed calls (by default as configured).
+        Returns the belief time, taken right before the call which succeeded, and the forecast."""
+        if retries is None:
+            retries = self.settings.retries
+        delays = backoff_delays(retries, self.settings.retry_delay_seconds, rng=self.rng)
+        for attempt in range(len(delays) + 1):
+            self.quota.take(self.now().date())
+            if self.bucket is not None:
+                self.bucket.acquire()
+            belief_time = datetime.utcnow().replace(tzinfo=pytz.utc)
+            try:
+                return belief_time, self.provider(api_key, location)
+            except Exception as e:
+                if attempt == len(delays):
+                    raise
+                logging.warning(
+                    "Call for %s failed (%s), retrying in %.1f s" % (location, e, delays[attempt])
+                )
+                run_report.count("darksky_retries")
+                self.sleep(delays[attempt])
+
+    def fetch(
+        self, locations: pd.DataFrame, api_key: str, max_workers: int = 1
+    ) -> Tuple[pd.DataFrame, List[Tuple[datetime, dict]]]:
+        """Fetch the due locations, in order of priority. Returns the locations which could be fetched,
+        and (belief_time, forecast) for each of them (like fetch_forecasts)."""
+        planned = self.plan(locations)
+        left_for_later = []
+
+        def fetch(location: Tuple[float, float]):
+            try:
+                with run_report.stage("call_darksky"):
+                    return self.call(api_key, location)
+            except QuotaExceeded:
+                left_for_later.append(location)
+            except Exception as e:
+                logging.error("Giving up on forecasts for %s: %s" % (location, e))
+                run_report.count("darksky_failures")
+            return datetime.utcnow().replace(tzinfo=pytz.utc), None
+
+        lat_longs = [(location[1], location[2]) for location in planned.itertuples()]
+        if max_workers <= 1 or len(lat_longs) <= 1:
+            fetched = [fetch(location) for location in lat_longs]
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(lat_longs))) as executor:
+                fetched = list(executor.map(fetch, lat_longs))
+
+        kept_positions = [
+            position for position, (_, forecast) in enumerate(fetched) if forecast is not None
+        ]
+        self.report_over_quota(len(left_for_later))
+        kept = planned.iloc[kept_positions].reset_index(drop=True)
+        self.mark_fetched(kept["location_name"])
+        return kept, [fetched[position] for position in kept_positions]
+
+    def mark_fetched(self, location_names: Iterable[str]):
+        """Remember that these locations were fetched now, to be recorded by commit."""
+        fetched_at = self.now()
+        for location_name in location_names:
+            self._fetched_now[location_name] = fetched_at
+
+    def report_over_quota(self, num_locations: int):
+        if num_locations > 0:
+            logging.warning(
+                "The daily quota of %d calls is used up, so %d locations are left for later."
+                % (self.quota.limit, num_locations)
+            )
+            run_report.count("locations_over_quota", num_locations)
@@ -0,0 +1,99 @@
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+import os
+import logging
+
+import pandas as pd
+
+from weatherforecast.utils import cols
+
+# Sensor ids are hex strings, which would be read as numbers if they happen to consist of digits only
+CSV_DTYPES = {"sensor_id": str, "source": str}
+
+
+class PartitionedFileStore:
+    """Forecasts kept as one CSV file per day (by event start, in UTC) in a directory.
+    Files are only ever appended to, so saving new forecasts does not rewrite history.
+    Reading only touches the days which overlap the requested window.
+    sensor_ids makes the id of a sensor from its name and location name; by default,
+    ids are looked up in the sensor/location mapping table (see get_sensor_location_id)."""
+
+    def __init__(self, directory: str, sensor_ids: Callable[[str, str], str] = None) -> None:
+        self.directory = directory
+        self.sensor_ids = sensor_ids
+
+    def partition_path(self, day: date) -> str:
+        return os.path.join(self.directory, "%s.csv" % day.isoformat())
+
+    def partitions_between(self, start: datetime, end: datetime) -> List[str]:
+        paths = []
+        day = start.date()
+        while day <= end.date():
+            path = self.partition_path(day)
+            if os.path.exists(path):
+                paths.append(path)
+            day += timedelta(days=1)
+        return paths
+
+    def read(self, start: datetime, end: datetime) -> pd.DataFrame:
+        """Read all stored forecasts with an event start between start and end (inclusive)."""
+        frames = [
+            pd.read_csv(path, dtype=CSV_DTYPES) for path in self.partitions_between(start, end)
+        ]
+        if len(frames) == 0:
+            return pd.DataFrame(columns=cols)
+        df = pd.concat(frames, ignore_index=True)
+        df["event_start"] = pd.to_datetime(df["event_start"], utc=True)
+        df["belief_time"] = pd.to_datetime(df["belief_time"], utc=True)
+        return df[(df["event_start"] >= start) & (df["event_start"] <= end)]
+
+    def known_beliefs(
+        self, start: datetime, end: datetime, sensor_ids: set
+    ) -> Dict[Tuple[str, datetime, str], List[Tuple[datetime, float]]]:
+        """Return the (belief_time, event_value) pairs per (sensor_id, event_start, source)."""
+        df = self.read(start, end)
+        df = df[df["sensor_id"].isin(sensor_ids)]
+        known_beliefs = {}
+        for row in df.itertuples(index=False):
+            key = (row.sensor_id, row.event_start.to_pydatetime(), row.source)
+            known_beliefs.setdefault(key, []).append(
+                (row.belief_time.to_pydatetime(), row.event_value)
+            )
+        return known_beliefs
+
+    def append(self, df: pd.DataFrame) -> int:
+        """Append forecasts (with the columns in utils.cols) to the partition of their day.
+        Returns the number of written rows."""
+        if df.empty:
+            return 0
+        os.makedirs(self.directory, exist_ok=True)
+        event_starts = pd.to_datetime(df["event_start"], utc=True)
+        for day, partition in df.groupby(event_starts.dt.date):
+            path = self.partition_path(day)
+            partition.to_csv(
+                path,
+                mode="a",
+                header=not os.path.exists(path),
+                index=False,
+                columns=cols,
+            )
+        return df.shape[0]
+
+
+def migrate_from_csv(
+    csv_path: str,
+    store: PartitionedFileStore,
+    chunk_size: int = 100000,
+    source_name: str = "DarkSky",
+) -> int:
+    """One-shot migration of a single forecasts CSV file (the former file layout) into a partitioned store.
+    The CSV file is read in chunks, so it does not have to fit into memory. Returns the number of migrated rows.
+    The former file holds the id of the source, while the store holds its name. File storage only ever
+    held DarkSky forecasts, so all rows get source_name."""
+    logging.info("Migrating forecasts from %s to %s ..." % (csv_path, store.directory))
+    migrated = 0
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_size, dtype=CSV_DTYPES):
+        chunk["source"] = source_name
+        migrated += store.append(chunk)
+    logging.info("Migrated %d forecasts." % migrated)
+    return migrated
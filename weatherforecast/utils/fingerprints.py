@@ -0,0 +1,132 @@
+from hashlib import blake2b
+from typing import Dict, List, Tuple, Union
+import json
+import os
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from weatherforecast.utils.cycle_lock import CycleLock
+from weatherforecast.utils.dbconfig import DBForecastFingerprint
+from weatherforecast.utils.file_store import PartitionedFileStore
+
+"""
+Often the forecasts for a location have not changed since the last fetch. Then all of its beliefs would
+turn out to be known, so we can skip making them, checking their novelty and saving them.
+To notice this, we keep a fingerprint (a hash) of the hourly forecasts we last saved, per location and
+window of events (identified by its first event). Fingerprints are kept in the database
+(the forecast_fingerprint table) or, with file storage, in a JSON file next to the forecast files.
+
+New fingerprints are only written after the forecasts they belong to have been saved (see commit),
+so a failed run never causes forecasts to be skipped. Workers may commit fingerprints at the same time:
+in the database, each one is inserted or updated in one statement (an upsert); the JSON file is re-read
+and rewritten under a lock.
+"""
+
+FINGERPRINT_FILE_NAME = "fingerprints.json"
+
+
+def fingerprint_of(hourly_data: List[dict]) -> str:
+    """A hash of the (sliced) hourly forecasts of a DarkSky response"""
+    content = json.dumps(hourly_data, sort_keys=True).encode("utf-8")
+    return blake2b(content, digest_size=20).hexdigest()
+
+
+class FingerprintCache:
+    """The fingerprints per location name, as (window start, fingerprint), read once from the store.
+    Use a new cache for each run, as other workers may have saved newer fingerprints in the meantime."""
+
+    def __init__(self, store: Union[Session, PartitionedFileStore]) -> None:
+        self.store = store
+        self.known: Dict[str, Tuple[int, str]] = None
+        self.pending: Dict[str, Tuple[int, str]] = {}
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.store.directory, FINGERPRINT_FILE_NAME)
+
+    def load(self) -> Dict[str, Tuple[int, str]]:
+        if self.known is None:
+            if isinstance(self.store, Session):
+                self.known = {
+                    row.location_name: (row.window_start, row.fingerprint)
+                    for row in self.store.query(DBForecastFingerprint).all()
+                }
+            elif os.path.exists(self.path):
+                with open(self.path) as fingerprint_file:
+                    self.known = {
+                        location_name: tuple(entry)
+                        for location_name, entry in json.load(fingerprint_file).items()
+                    }
+            else:
+                self.known = {}
+        return self.known
+
+    def is_unchanged(self, location_name: str, window_start: int, fingerprint: str) -> bool:
+        return self.load().get(location_name) == (window_start, fingerprint)
+
+    def remember(self, location_name: str, window_start: int, fingerprint: str):
+        """Keep a new fingerprint, to be written by commit"""
+        self.pending[location_name] = (window_start, fingerprint)
+
+    def commit(self):
+        """Write the new fingerprints. Call this once their forecasts are saved."""
+        if len(self.pending) == 0:
+            return
+        if isinstance(self.store, Session):
+            rows = [
+                dict(
+                    location_name=location_name,
+                    window_start=window_start,
+                    fingerprint=fingerprint,
+                )
+                for location_name, (window_start, fingerprint) in self.pending.items()
+            ]
+            connection = self.store.connection()
+            upsert = _upsert_fingerprints(connection, DBForecastFingerprint.__table__)
+            if upsert is not None:
+                connection.execute(upsert, rows)
+            else:
+                for row in rows:
+                    self.store.merge(DBForecastFingerprint(**row))
+            self.store.commit()
+            self.load().update(self.pending)
+        else:
+            os.makedirs(self.store.directory, exist_ok=True)
+            lock = CycleLock("%s.lock" % self.path)
+            lock.acquire(blocking=True)
+            try:
+                # other workers may have written fingerprints since we read them
+                self.known = None
+                known = self.load()
+                known.update(self.pending)
+                temporary_path = "%s.tmp" % self.path
+                with open(temporary_path, "w") as fingerprint_file:
+                    json.dump(known, fingerprint_file)
+                os.replace(temporary_path, self.path)
+            finally:
+                lock.release()
+        self.pending = {}
+
+    def discard(self):
+        """Forget the new fingerprints, e.g. because saving their forecasts failed"""
+        self.pending = {}
+
+
+def _upsert_fingerprints(connection, table):
+    """An insert which updates the fingerprint of a location if it already has one,
+    or None if the dialect has no such statement."""
+    dialect_name = connection.dialect.name
+    if dialect_name == "postgresql":
+        insert = postgresql.insert(table)
+    elif dialect_name == "sqlite":
+        insert = sqlite.insert(table)
+    else:
+        return None
+    return insert.on_conflict_do_update(
+        index_elements=[table.c.location_name],
+        set_=dict(
+            window_start=insert.excluded.window_start,
+            fingerprint=insert.excluded.fingerprint,
+        ),
+    )
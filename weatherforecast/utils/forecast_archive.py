@@ -0,0 +1,110 @@
+from datetime import datetime
+from typing import Dict, List, Tuple
+import csv
+import gzip
+import json
+import os
+
+from weatherforecast.utils.cycle_lock import CycleLock
+
+"""
+A compact alternative to keeping one JSON file per location per fetch (see save_forecasts_as_json).
+All responses of a fetch run (or of a whole day) are appended to one segment file. Each response is
+compressed as a separate gzip member, so the segment as a whole is still a valid gzip file, but a single
+response can also be read with one seek. An index file records where each response is.
+Switch it on with the archive option in the PERSISTENCE section of the config file, and load an archive
+into the store with backfill_forecasts.py.
+"""
+
+INDEX_FILE_NAME = "archive_index.csv"
+INDEX_COLUMNS = ["latitude", "longitude", "fetch_time", "segment", "offset", "length"]
+FETCH_TIME_FORMAT = "%Y-%m-%dT%H-%M-%S"
+
+
+class ForecastArchive:
+    """Segments and index in one directory. Processes (e.g. workers of different shards) take turns
+    appending to it, through a lock file in the directory."""
+
+    def __init__(self, directory: str, segment_per_day: bool = False) -> None:
+        self.directory = directory
+        self.segment_per_day = segment_per_day
+        self._index: Dict[Tuple[float, float, str], Tuple[str, int, int]] = None
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.directory, INDEX_FILE_NAME)
+
+    def segment_name(self, fetch_time: datetime) -> str:
+        if self.segment_per_day:
+            return "%s.json.gz" % fetch_time.strftime("%Y-%m-%d")
+        return "%s.json.gz" % fetch_time.strftime(FETCH_TIME_FORMAT)
+
+    def append_run(
+        self, fetch_time: datetime, responses: List[Tuple[Tuple[float, float], dict]]
+    ) -> int:
+        """Append the responses of one fetch run, given as (location, response). Returns the number of bytes written."""
+        os.makedirs(self.directory, exist_ok=True)
+        lock = CycleLock(os.path.join(self.directory, "archive.lock"))
+        lock.acquire(blocking=True)
+        try:
+            return self._append_run(fetch_time, responses)
+        finally:
+            lock.release()
+
+    def _append_run(
+        self, fetch_time: datetime, responses: List[Tuple[Tuple[float, float], dict]]
+    ) -> int:
+        segment = self.segment_name(fetch_time)
+        fetch_time_str = fetch_time.strftime(FETCH_TIME_FORMAT)
+        index_rows = []
+        with open(os.path.join(self.directory, segment), "ab") as segment_file:
+            offset = segment_file.tell()
+            start = offset
+            for location, response in responses:
+                member = gzip.compress(json.dumps(response).encode("utf-8"))
+                segment_file.write(member)
+                index_rows.append(
+                    [location[0], location[1], fetch_time_str, segment, offset, len(member)]
+                )
+                offset += len(member)
+        # the index is written after the data, so it never points to data which is not there
+        write_header = not os.path.exists(self.index_path)
+        with open(self.index_path, "a", newline="") as index_file:
+            writer = csv.writer(index_file)
+            if write_header:
+                writer.writerow(INDEX_COLUMNS)
+            writer.writerows(index_rows)
+        if self._index is not None:
+            for latitude, longitude, fetch_time_str, segment, offset, length in index_rows:
+                self._index[(latitude, longitude, fetch_time_str)] = (segment, offset, length)
+        return offset - start
+
+    def load_index(self) -> Dict[Tuple[float, float, str], Tuple[str, int, int]]:
+        """(latitude, longitude, fetch time) -> (segment, offset, length), read once from the index file"""
+        if self._index is None:
+            self._index = {}
+            if os.path.exists(self.index_path):
+                with open(self.index_path, newline="") as index_file:
+                    for row in csv.DictReader(index_file):
+                        key = (float(row["latitude"]), float(row["longitude"]), row["fetch_time"])
+                        self._index[key] = (row["segment"], int(row["offset"]), int(row["length"]))
+        return self._index
+
+    def runs(self) -> Dict[str, List[Tuple[float, float, str, int, int]]]:
+        """(latitude, longitude, segment, offset, length) of the responses per fetch time, oldest first"""
+        runs = {}
+        for (latitude, longitude, fetch_time_str), (segment, offset, length) in sorted(
+            self.load_index().items(), key=lambda item: item[0][2]
+        ):
+            runs.setdefault(fetch_time_str, []).append((latitude, longitude, segment, offset, length))
+        return runs
+
+    def read(self, latitude: float, longitude: float, fetch_time: datetime) -> dict:
+        """Read a single response, with one seek into its segment"""
+        key = (latitude, longitude, fetch_time.strftime(FETCH_TIME_FORMAT))
+        return self.read_entry(*self.load_index()[key])
+
+    def read_entry(self, segment: str, offset: int, length: int) -> dict:
+        with open(os.path.join(self.directory, segment), "rb") as segment_file:
+            segment_file.seek(offset)
+            return json.loads(gzip.decompress(segment_file.read(length)).decode("utf-8"))
@@ -0,0 +1,272 @@
+from datetime import datetime
+from queue import Empty, Full, PriorityQueue, Queue
+from typing import Callable, List, Tuple, Union
+import logging
+import threading
+import time
+
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from weatherforecast.utils import Settings, run_report
+from weatherforecast.utils.file_store import PartitionedFileStore
+from weatherforecast.utils.fetch_planning import FetchPlanner, QuotaExceeded, backoff_delay
+from weatherforecast.utils.fingerprints import FingerprintCache
+from weatherforecast.utils.forecast_archive import ForecastArchive
+from weatherforecast.utils.weather_forecast_utility import (
+    archive_responses,
+    forecast_frame_from_responses,
+    skip_unchanged_responses,
+)
+
+"""
+Fetching and saving forecasts as a pipeline, so that waiting for DarkSky and working in the store overlap.
+A run then takes about as long as the slower of the two, rather than their sum:
+
+    fetch workers  --(bounded queue of responses)-->  novelty check and write
+
+- Fetch workers (as many as the concurrency setting) take one location at a time and call DarkSky within
+  the rate and quota of the fetch planner. A failed call does not hold up a worker: the location is put back
+  to be tried again after a backoff delay, and the worker goes on with the next location.
+- The store is only used from the thread which runs the pipeline, as a session (or SQLite connection)
+  cannot be shared between threads. It takes whatever responses are queued (up to batch_size cities),
+  extracts them into one frame and checks their novelty in one go. The new forecasts of several batches
+  are written together, in one transaction of at least write_rows rows (except for the last one).
+- The queue holds at most queue_size responses, so fetch workers wait when the store falls behind.
+- Every location ends up in the queue, also when its call raises something other than an Exception
+  (e.g. SystemExit or KeyboardInterrupt in a provider), as None. Should a location get lost anyway,
+  the pipeline stops waiting as soon as no worker has anything left to do, rather than hanging.
+
+Forecasts are extracted as columns (see create_forecast_frame). Switch the pipeline on in the PIPELINE
+section of the config file, then run_forecast_cycle uses it.
+"""
+
+
+# returned for a location which is put back, to be fetched again after a backoff delay
+RETRYING = object()
+
+
+class ForecastPipeline:
+    def __init__(
+        self,
+        store: Union[Session, PartitionedFileStore],
+        settings: Settings,
+        planner: FetchPlanner,
+        dedup: Callable[..., pd.DataFrame],
+        write: Callable[..., Union[Session, PartitionedFileStore]],
+        sensor_names: List[str],
+        num_hours: int,
+        fingerprints: FingerprintCache = None,
+        archive: ForecastArchive = None,
+    ) -> None:
+        """dedup and write take a forecast frame, the store and the settings
+        (see filter_out_known_forecast_frame and save_forecast_frame)."""
+        self.store = store
+        self.settings = settings
+        self.planner = planner
+        self.dedup = dedup
+        self.write = write
+        self.sensor_names = sensor_names
+        self.num_hours = num_hours
+        self.fingerprints = fingerprints
+        self.archive = archive
+        self.fetch_time: datetime = None
+        self.locations: pd.DataFrame = None
+        self.pending: PriorityQueue = None  # (ready at, position, attempt)
+        self.responses: Queue = None  # (position, (belief_time, response) or None)
+        self.remaining = 0
+        self.busy = 0  # workers holding a location (taken from pending, not yet queued or put back)
+        self.over_quota = 0
+        self.stopped = threading.Event()
+        self._workers: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def run(self, locations: pd.DataFrame) -> Union[Session, PartitionedFileStore]:
+        """Fetch the locations which are due (see FetchPlanner.plan) and save their novel forecasts.
+        Returns the store."""
+        self.fetch_time = datetime.utcnow()
+        self.locations = self.planner.plan(locations)
+        num_locations = self.locations.shape[0]
+        if num_locations == 0:
+            return self.store
+        self.pending = PriorityQueue()
+        for position in range(num_locations):
+            self.pending.put((0.0, position, 0))
+        self.responses = Queue(maxsize=max(1, self.settings.pipeline_queue_size))
+        self.remaining = num_locations
+        self.busy = 0
+        self.over_quota = 0
+        self.stopped.clear()
+        if self.fingerprints is not None:
+            # read them here, as fetch workers do not use the store
+            self.fingerprints.load()
+
+        self._workers = [
+            threading.Thread(target=self._fetch_worker, daemon=True)
+            for _ in range(max(1, min(self.settings.concurrency, num_locations)))
+        ]
+        for worker in self._workers:
+            worker.start()
+        try:
+            self._check_and_write(num_locations)
+        finally:
+            self.stopped.set()
+            for worker in self._workers:
+                worker.join()
+        self.planner.report_over_quota(self.over_quota)
+        return self.store
+
+    def _fetch_worker(self):
+        while not self.stopped.is_set():
+            with self._lock:
+                if self.remaining == 0:
+                    return
+                try:
+                    ready_at, position, attempt = self.pending.get_nowait()
+                except Empty:
+                    ready_at = None
+                else:
+                    self.busy += 1
+            if ready_at is None:
+                # the other locations are being fetched
+                self.stopped.wait(0.1)
+                continue
+            try:
+                wait = ready_at - time.monotonic()
+                if wait > 0:
+                    # the earliest retry is not due yet, so none is
+                    self.pending.put((ready_at, position, attempt))
+                    self.stopped.wait(min(wait, 0.1))
+                    continue
+                fetched = None
+                try:
+                    fetched = self._fetch_location(position, attempt)
+                except BaseException as e:
+                    # not only an Exception: a worker which dies would leave its location unaccounted for
+                    logging.error(
+                        "Giving up on forecasts for location %s: %r"
+                        % (self.locations.iloc[position]["location_name"], e)
+                    )
+                    run_report.count("darksky_failures")
+                if fetched is not RETRYING:
+                    self._put_response(position, fetched)
+            finally:
+                with self._lock:
+                    self.busy -= 1
+
+    def _fetch_location(self, position: int, attempt: int) -> Tuple[datetime, dict]:
+        """Call DarkSky for the location at position. Returns (belief_time, response), or None
+        if we give up on the location, or RETRYING if it is put back to be tried again later."""
+        location = self.locations.iloc[position]
+        lat_long = (location["latitude"], location["longitude"])
+        try:
+            with run_report.stage("call_darksky"):
+                belief_time, response = self.planner.call(
+                    self.settings.api_key, lat_long, retries=0
+                )
+        except QuotaExceeded:
+            with self._lock:
+                self.over_quota += 1
+            return None
+        except Exception as e:
+            if attempt < self.settings.retries:
+                delay = backoff_delay(
+                    attempt, self.settings.retry_delay_seconds, rng=self.planner.rng
+                )
+                logging.warning(
+                    "Call for %s failed (%s), retrying in %.1f s" % (lat_long, e, delay)
+                )
+                run_report.count("darksky_retries")
+                self.pending.put((time.monotonic() + delay, position, attempt + 1))
+                return RETRYING
+            logging.error("Giving up on forecasts for %s: %s" % (lat_long, e))
+            run_report.count("darksky_failures")
+            return None
+        run_report.count("darksky_requests", city=location["location_name"])
+        return belief_time, response
+
+    def _put_response(self, position: int, fetched: Tuple[datetime, dict]):
+        """Queue the outcome for a location, waiting while the queue is full."""
+        while not self.stopped.is_set():
+            try:
+                self.responses.put((position, fetched), timeout=0.1)
+                break
+            except Full:
+                continue
+        with self._lock:
+            self.remaining -= 1
+
+    def _next_response(self) -> Tuple[int, Tuple[datetime, dict]]:
+        """Wait for the next queued response, as long as the fetch workers may still queue one."""
+        while True:
+            try:
+                return self.responses.get(timeout=1)
+            except Empty:
+                if not self._workers_may_respond():
+                    break
+        # a worker may have queued its last response right before it stopped
+        try:
+            return self.responses.get_nowait()
+        except Empty:
+            raise Exception("The fetch workers stopped before all locations were fetched.")
+
+    def _workers_may_respond(self) -> bool:
+        """Whether a worker is alive and holds a location, or there are locations left to take."""
+        if not any(worker.is_alive() for worker in self._workers):
+            return False
+        with self._lock:
+            return self.busy > 0 or not self.pending.empty()
+
+    def _check_and_write(self, num_locations: int):
+        received = 0
+        to_write: List[pd.DataFrame] = []
+        rows_to_write = 0
+        while received < num_locations:
+            # wait for one response, then take whatever else is queued
+            batch = [self._next_response()]
+            while len(batch) < self.settings.pipeline_batch_size:
+                try:
+                    batch.append(self.responses.get_nowait())
+                except Empty:
+                    break
+            received += len(batch)
+            new_frame = self._check(
+                [position for position, fetched in batch if fetched is not None],
+                [fetched for _, fetched in batch if fetched is not None],
+            )
+            if new_frame is not None and not new_frame.empty:
+                to_write.append(new_frame)
+                rows_to_write += new_frame.shape[0]
+            if rows_to_write >= self.settings.pipeline_write_rows or received == num_locations:
+                if len(to_write) > 0:
+                    self.store = self.write(
+                        pd.concat(to_write, ignore_index=True), self.store, self.settings
+                    )
+                to_write = []
+                rows_to_write = 0
+
+    def _check(self, positions: List[int], fetched: List[Tuple[datetime, dict]]) -> pd.DataFrame:
+        """The novel forecasts of a batch of fetched locations (None if there are none)"""
+        if len(positions) == 0:
+            return None
+        locations = self.locations.iloc[positions].reset_index(drop=True)
+        self.planner.mark_fetched(locations["location_name"])
+        if self.archive is not None:
+            # all batches go into the same fetch run
+            archive_responses(self.archive, self.fetch_time, locations, fetched)
+        if self.fingerprints is not None:
+            locations, fetched = skip_unchanged_responses(
+                locations, fetched, self.num_hours, self.fingerprints
+            )
+            if locations.shape[0] == 0:
+                return None
+        with run_report.stage("create_forecast_frame"):
+            frame = forecast_frame_from_responses(
+                locations,
+                fetched,
+                self.sensor_names,
+                self.num_hours,
+                self.settings,
+                store=self.store,
+            )
+        return self.dedup(frame, self.store, self.settings)
@@ -0,0 +1,223 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List
+import logging
+
+import pandas as pd
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session
+from timely_beliefs import BeliefsDataFrame, DBBeliefSource, DBTimedBelief
+
+from weatherforecast.utils.dbconfig import DBLocatedSensor
+
+"""
+Read stored forecasts back, as they were known at some belief horizon or belief time.
+Picking the most recent belief per event happens in the database, with a window function
+(ROW_NUMBER() OVER (PARTITION BY ... ORDER BY belief_horizon)), so only the rows we need are transferred.
+Long time ranges can be read in chunks, so they never have to fit into memory all at once.
+Databases without interval arithmetic (e.g. SQLite) cannot filter on belief time, so then the beliefs
+about each chunk of events are filtered and ranked in memory instead.
+
+Belief times follow from the sensors' knowledge times, for which we assume the default (ex-post) knowledge
+horizon: beliefs about an event become knowledge once the event has ended (event_start + event_resolution).
+"""
+
+
+def find_sensors(
+    session: Session, sensor_names: List[str], location_names: List[str]
+) -> List[DBLocatedSensor]:
+    return (
+        session.query(DBLocatedSensor)
+        .filter(
+            DBLocatedSensor.name.in_(sensor_names),
+            DBLocatedSensor.location_name.in_(location_names),
+        )
+        .all()
+    )
+
+
+def beliefs_query(
+    sensors: List[DBLocatedSensor],
+    start: datetime,
+    end: datetime,
+    belief_horizon: timedelta = None,
+    belief_time: datetime = None,
+    *extra_columns
+):
+    """Select the beliefs about events in [start, end), formed at least belief_horizon before knowledge time,
+    or at or before belief_time (which needs date arithmetic in the database, e.g. PostgreSQL, not SQLite)."""
+    beliefs = DBTimedBelief.__table__
+    sensor_table = DBLocatedSensor.__table__
+    conditions = [
+        beliefs.c.sensor_id.in_([sensor.id for sensor in sensors]),
+        beliefs.c.event_start >= start,
+        beliefs.c.event_start < end,
+    ]
+    if belief_horizon is not None:
+        conditions.append(beliefs.c.belief_horizon >= belief_horizon)
+    if belief_time is not None:
+        conditions.append(
+            beliefs.c.event_start + sensor_table.c.event_resolution - beliefs.c.belief_horizon
+            <= belief_time
+        )
+    return (
+        select(
+            beliefs.c.event_start,
+            beliefs.c.belief_horizon,
+            beliefs.c.cumulative_probability,
+            beliefs.c.event_value,
+            beliefs.c.sensor_id,
+            beliefs.c.source_id,
+            *extra_columns
+        )
+        .select_from(
+            beliefs.join(sensor_table, beliefs.c.sensor_id == sensor_table.c.id)
+        )
+        .where(and_(*conditions))
+    )
+
+
+def latest_beliefs_query(
+    sensors: List[DBLocatedSensor],
+    start: datetime,
+    end: datetime,
+    belief_horizon: timedelta = None,
+    belief_time: datetime = None,
+):
+    """Select the most recent belief per event (and source) among those of beliefs_query."""
+    beliefs = DBTimedBelief.__table__
+    recency_rank = (
+        func.row_number()
+        .over(
+            partition_by=[
+                beliefs.c.sensor_id,
+                beliefs.c.source_id,
+                beliefs.c.event_start,
+                beliefs.c.cumulative_probability,
+            ],
+            order_by=beliefs.c.belief_horizon.asc(),
+        )
+        .label("recency_rank")
+    )
+    ranked = beliefs_query(
+        sensors, start, end, belief_horizon, belief_time, recency_rank
+    ).subquery("ranked_beliefs")
+    return (
+        select(*[c for c in ranked.c if c.name != "recency_rank"])
+        .where(ranked.c.recency_rank == 1)
+        .order_by(ranked.c.sensor_id, ranked.c.event_start)
+    )
+
+
+def pick_latest_beliefs(frame: pd.DataFrame) -> pd.DataFrame:
+    """Like latest_beliefs_query, in memory: the belief with the smallest horizon per event (and source)."""
+    return (
+        frame.sort_values("belief_horizon", kind="mergesort")
+        .drop_duplicates(["sensor_id", "source_id", "event_start", "cumulative_probability"])
+        .sort_values(["sensor_id", "event_start"], kind="mergesort")
+        .reset_index(drop=True)
+    )
+
+
+def iter_latest_belief_frames(
+    session: Session,
+    sensors: List[DBLocatedSensor],
+    start: datetime,
+    end: datetime,
+    belief_horizon: timedelta = None,
+    belief_time: datetime = None,
+    chunk: timedelta = timedelta(days=7),
+) -> Iterator[pd.DataFrame]:
+    """Run latest_beliefs_query for consecutive windows of events, each yielding a plain frame
+    with the columns of the belief table plus belief_time."""
+    resolutions = {sensor.id: sensor.event_resolution for sensor in sensors}
+    in_memory = belief_time is not None and session.get_bind().dialect.name != "postgresql"
+    window_start = start
+    while window_start < end:
+        window_end = min(window_start + chunk, end)
+        if in_memory:
+            query = beliefs_query(sensors, window_start, window_end, belief_horizon)
+        else:
+            query = latest_beliefs_query(
+                sensors, window_start, window_end, belief_horizon, belief_time
+            )
+        frame = pd.read_sql(query, session.connection())
+        frame["event_start"] = pd.to_datetime(frame["event_start"], utc=True)
+        frame["belief_horizon"] = pd.to_timedelta(frame["belief_horizon"])
+        frame["belief_time"] = (
+            frame["event_start"]
+            + pd.to_timedelta(frame["sensor_id"].map(resolutions))
+            - frame["belief_horizon"]
+        )
+        if in_memory:
+            frame = pick_latest_beliefs(frame[frame["belief_time"] <= belief_time])
+        logging.debug(
+            "Read %d beliefs about events in [%s, %s)" % (frame.shape[0], window_start, window_end)
+        )
+        yield frame
+        window_start = window_end
+
+
+def to_beliefs_data_frames(
+    frame: pd.DataFrame,
+    sensors: List[DBLocatedSensor],
+    sources: Dict[int, DBBeliefSource],
+) -> Dict[DBLocatedSensor, BeliefsDataFrame]:
+    """Split a frame of beliefs into one BeliefsDataFrame per sensor."""
+    bdfs = {}
+    for sensor in sensors:
+        sensor_frame = frame[frame["sensor_id"] == sensor.id].copy()
+        sensor_frame["source"] = sensor_frame["source_id"].map(sources)
+        bdfs[sensor] = BeliefsDataFrame(
+            sensor_frame[
+                ["event_start", "belief_time", "source", "cumulative_probability", "event_value"]
+            ],
+            sensor=sensor,
+        )
+    return bdfs
+
+
+def iter_forecasts(
+    session: Session,
+    sensor_names: List[str],
+    location_names: List[str],
+    start: datetime,
+    end: datetime,
+    belief_horizon: timedelta = None,
+    belief_time: datetime = None,
+    chunk: timedelta = timedelta(days=7),
+) -> Iterator[Dict[DBLocatedSensor, BeliefsDataFrame]]:
+    """Stream the most recent forecasts as of belief_horizon or belief_time, chunk by chunk of event time.
+    Each chunk holds one BeliefsDataFrame per sensor."""
+    sensors = find_sensors(session, sensor_names, location_names)
+    sources = {source.id: source for source in session.query(DBBeliefSource).all()}
+    for frame in iter_latest_belief_frames(
+        session, sensors, start, end, belief_horizon, belief_time, chunk
+    ):
+        yield to_beliefs_data_frames(frame, sensors, sources)
+
+
+def query_forecasts(
+    session: Session,
+    sensor_names: List[str],
+    location_names: List[str],
+    start: datetime,
+    end: datetime,
+    belief_horizon: timedelta = None,
+    belief_time: datetime = None,
+) -> Dict[DBLocatedSensor, BeliefsDataFrame]:
+    """Like iter_forecasts, but all at once (for time ranges which fit into memory)."""
+    chunks = list(
+        iter_forecasts(
+            session,
+            sensor_names,
+            location_names,
+            start,
+            end,
+            belief_horizon,
+            belief_time,
+            chunk=end - start,
+        )
+    )
+    if len(chunks) == 0:
+        return {}
+    return chunks[0]
@@ -1,7 +1,9 @@
-from typing import List
+from typing import Dict, List, Tuple
+from functools import lru_cache
 import os
 import logging
 
+import numpy as np
 import pandas as pd
 from hashlib import blake2b
 
@@ -9,54 +11,79 @@ from weatherforecast.utils import location_utility
 from weatherforecast.utils.Sensor import SensorName
 
 from weatherforecast.utils import path_to_data
+from weatherforecast.utils.table_cache import read_csv_cached
 
 
 def create_sensor_location_id_mapping_table(save_table: bool = True) -> pd.DataFrame:
     logging.info("Creating sensor_location_id mapping table")
     file_path: str = "%s/sensor_location_id_mapping.csv" % path_to_data()
     cols: List[str] = ["id", "sensor", "location_name", "latitude", "longitude"]
-    mapping_list = []
     locations = location_utility.get_all_cities_locations()
+    locations = locations[locations["location_name"].notnull()]
     sensor_names = SensorName.ALL.value
 
-    for location in locations.itertuples():
-        latitude = location[1]
-        longitude = location[2]
-        location_name = location[3]
-
-        if isinstance(location_name, str):
-            for sensor in sensor_names:
-                data = {
-                    "id": create_sensor_location_id(sensor, location_name),
-                    "sensor": sensor,
-                    "location_name": location_name,
-                    "latitude": latitude,
-                    "longitude": longitude,
-                }
-
-                mapping_list.append(data)
-
-    df = pd.DataFrame(data=mapping_list, columns=cols)
+    # one row per location per sensor, in that order
+    location_names = np.repeat(locations["location_name"].values, len(sensor_names))
+    sensors = np.tile(sensor_names, locations.shape[0])
+    df = pd.DataFrame(
+        data={
+            "id": [
+                _hash_sensor_location(sensor, location_name)
+                for sensor, location_name in zip(sensors, location_names)
+            ],
+            "sensor": sensors,
+            "location_name": location_names,
+            "latitude": np.repeat(locations["latitude"].values, len(sensor_names)),
+            "longitude": np.repeat(locations["longitude"].values, len(sensor_names)),
+        },
+        columns=cols,
+    )
     if save_table:
         df.to_csv(file_path, index=False)
+        get_sensor_location_id_mapping_table.cache_clear()
+        get_sensor_location_id_maps.cache_clear()
 
     return df
 
 
 def create_sensor_location_id(sensor: str, location_name: str) -> str:
     logging.debug(
-        "Creating sensor id for this sensor: {} and location: {}".format(
-            sensor, location_name
-        )
+        "Creating sensor id for this sensor: %s and location: %s", sensor, location_name
     )
-    hashing_algo = blake2b(digest_size=10)
-    mapping_id = sensor + location_name
-    hashing_algo.update(mapping_id.encode("utf-8"))
-    return hashing_algo.hexdigest()
+    return _hash_sensor_location(sensor, location_name)
+
+
+def _hash_sensor_location(sensor: str, location_name: str) -> str:
+    return blake2b((sensor + location_name).encode("utf-8"), digest_size=10).hexdigest()
 
 
 def read_sensor_location_id_mapping_table() -> pd.DataFrame:
     file_path = "%s/sensor_location_id_mapping.csv" % path_to_data()
     if not os.path.exists(file_path):
         raise Exception("File %s does not exist and needs to be created (see Readme)." % file_path)
-    return pd.read_csv(file_path)
+    return read_csv_cached(file_path)
+
+
+@lru_cache(maxsize=None)
+def get_sensor_location_id_mapping_table() -> pd.DataFrame:
+    """The mapping table, read once on first use"""
+    return read_sensor_location_id_mapping_table()
+
+
+class SensorLocationIdMaps:
+    """Lookups in both directions between mapping ids and (sensor, location_name), in constant time"""
+
+    def __init__(self, mapping_df: pd.DataFrame) -> None:
+        keys = list(zip(mapping_df["sensor"], mapping_df["location_name"]))
+        self.id_by_sensor_location: Dict[Tuple[str, str], str] = dict(
+            zip(keys, mapping_df["id"])
+        )
+        self.sensor_location_by_id: Dict[str, Tuple[str, str]] = dict(
+            zip(mapping_df["id"], keys)
+        )
+
+
+@lru_cache(maxsize=None)
+def get_sensor_location_id_maps() -> SensorLocationIdMaps:
+    """The id maps of the mapping table, built once on first use"""
+    return SensorLocationIdMaps(get_sensor_location_id_mapping_table())
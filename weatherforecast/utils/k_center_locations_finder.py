@@ -0,0 +1,66 @@
+from typing import List
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from weatherforecast.utils.haversine import haversine_distance_vec
+
+"""
+Deterministic selection of well-spread locations, next to the genetic search in optimal_locations_finder.
+It only needs numpy and scipy, not deap.
+"""
+
+
+class KCenterLocationsFinder:
+    """A deterministic, fast alternative to OptimalLocationsFinder for countries with many cities.
+    Picks well-spread locations by farthest-point selection (a greedy k-center heuristic):
+    each next location is the one farthest from all locations picked so far.
+    Each pick updates the distance of every location to its nearest picked one, with one vectorised
+    haversine pass over all locations, so selection takes O(n·k) without a spatial index."""
+
+    def __init__(self, locations: pd.DataFrame, new_locations_size: int) -> None:
+        self.locations = locations
+        self.new_locations_size = new_locations_size
+        self.coordinates: np.ndarray = locations.loc[:, ['latitude', 'longitude']].values.astype(float)
+
+    def find_optimal_locations(self, population_size: int = 500, generations: int = 10, seed: int = None,
+                               processes: int = 1, runs: int = 1) -> pd.DataFrame:
+        """Same signature as OptimalLocationsFinder.find_optimal_locations, so either finder can be used.
+        The search parameters do not apply to this selection, which is deterministic."""
+        if self.locations.shape[0] < self.new_locations_size:
+            return self.locations
+        indices = self.farthest_point_indices(self.coordinates, self.new_locations_size)
+        return self.locations.iloc[indices, :].copy()
+
+    @staticmethod
+    def farthest_point_indices(coordinates: np.ndarray, k: int) -> List[int]:
+        """Start with the location farthest from the mean coordinate, then keep adding the farthest location."""
+        latitudes = coordinates[:, 0]
+        longitudes = coordinates[:, 1]
+        center = coordinates.mean(axis=0)
+        first = int(np.argmax(haversine_distance_vec(center[0], center[1], latitudes, longitudes)))
+        indices = [first]
+        min_distances = haversine_distance_vec(latitudes[first], longitudes[first], latitudes, longitudes)
+        min_distances[first] = -1
+        while len(indices) < k:
+            next_index = int(np.argmax(min_distances))
+            if min_distances[next_index] < 0:  # only picked locations are left
+                break
+            indices.append(next_index)
+            distances = haversine_distance_vec(latitudes[next_index], longitudes[next_index], latitudes, longitudes)
+            min_distances = np.minimum(min_distances, distances)
+            min_distances[next_index] = -1
+        return indices
+
+
+def coverage_radius_km(coordinates: np.ndarray, selected_indices: List[int]) -> float:
+    """The largest distance from any location to its nearest selected location (the k-center objective).
+    Nearest neighbours are found with a KD-tree on points on the unit sphere."""
+    def to_unit_sphere(lat_lng: np.ndarray) -> np.ndarray:
+        latitudes, longitudes = np.radians(lat_lng[:, 0]), np.radians(lat_lng[:, 1])
+        return np.column_stack([np.cos(latitudes) * np.cos(longitudes),
+                                np.cos(latitudes) * np.sin(longitudes),
+                                np.sin(latitudes)])
+
+    tree = cKDTree(to_unit_sphere(coordinates[selected_indices]))
+    chord_distances, _ = tree.query(to_unit_sphere(coordinates))
+    return float(2 * 6367 * np.arcsin(np.clip(chord_distances.max() / 2, 0, 1)))
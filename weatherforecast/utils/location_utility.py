@@ -1,19 +1,17 @@
 from typing import List
+from functools import lru_cache
+import numpy as np
 import pandas as pd
 import webbrowser
-import folium
-from folium import features
 import os
 import logging
 
 from weatherforecast.utils import path_to_data, path_to_maps
+from weatherforecast.utils.table_cache import read_csv_cached
 
 
 selected_columns: List[str] = ['continent_name', 'country_name', 'subdivision_1_name', 'city_name', 'time_zone',
                                'is_in_european_union', 'latitude', 'longitude']
-cities_df: pd.DataFrame = pd.read_csv('%s/City-geolocation-en-v2.csv' % path_to_data(), usecols=selected_columns)
-cities_df[['city_name', 'subdivision_1_name']] = cities_df[['city_name', 'subdivision_1_name']].fillna('')
-
 city_location_columns: List[str] = ['city_name', 'subdivision_1_name', 'country_name', 'latitude', 'longitude']
 
 
@@ -22,63 +20,93 @@ def _create_location_name_column(df: pd.DataFrame):
     df.drop(['city_name', 'subdivision_1_name', 'country_name'], axis=1, inplace=True)
 
 
+class CityIndex:
+    """Row positions of the cities, grouped by the keys we look them up by, so lookups need no scans.
+    The location names are built once for the whole table."""
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        self.locations = df[city_location_columns].copy()
+        _create_location_name_column(self.locations)
+        self.by_city = df.groupby(['city_name', 'country_name']).indices
+        self.by_city_and_subdivision = df.groupby(['city_name', 'subdivision_1_name', 'country_name']).indices
+        self.by_continent = df.groupby('continent_name').indices
+        self.by_country = df.groupby('country_name').indices
+        self.by_subdivision = df.groupby('subdivision_1_name').indices
+        self.by_time_zone = df.groupby('time_zone').indices
+        self.in_european_union = np.flatnonzero(df['is_in_european_union'].astype(str) == '1')
+
+    def locations_at(self, positions) -> pd.DataFrame:
+        if positions is None:
+            positions = []
+        return self.locations.iloc[positions].reset_index(drop=True)
+
+
+def _fill_missing_names(df: pd.DataFrame) -> pd.DataFrame:
+    df[['city_name', 'subdivision_1_name']] = df[['city_name', 'subdivision_1_name']].fillna('')
+    return df
+
+
+@lru_cache(maxsize=None)
+def get_cities_df() -> pd.DataFrame:
+    """The city table, read on first use (through a binary cache, see read_csv_cached)."""
+    return read_csv_cached('%s/City-geolocation-en-v2.csv' % path_to_data(), prepare=_fill_missing_names,
+                           usecols=selected_columns)
+
+
+@lru_cache(maxsize=None)
+def get_city_index() -> CityIndex:
+    return CityIndex(get_cities_df())
+
+
 def get_all_cities_locations() -> pd.DataFrame:
     logging.info("Getting all cities")
-    df = cities_df[city_location_columns].copy()
-    _create_location_name_column(df)
-    return df
+    return get_city_index().locations.copy()
 
 
 def get_cities_locations_by_continent(continent_name: str) -> pd.DataFrame:
     logging.info("Getting all cities in %s", continent_name)
-    df = cities_df.query('continent_name == @continent_name')[city_location_columns].copy().reset_index(drop=True)
-    _create_location_name_column(df)
-    return df
+    city_index = get_city_index()
+    return city_index.locations_at(city_index.by_continent.get(continent_name))
 
 
 def get_cities_locations_by_country(country_name: str) -> pd.DataFrame:
     logging.info("Getting all cities in %s", country_name)
-    df = cities_df.query('country_name == @country_name')[city_location_columns].copy().reset_index(drop=True)
-    _create_location_name_column(df)
-    return df
+    city_index = get_city_index()
+    return city_index.locations_at(city_index.by_country.get(country_name))
 
 
 def get_cities_locations_by_subdivision(subdivision_name: str) -> pd.DataFrame:
     logging.info("Getting all cities in %s", subdivision_name)
-    df = cities_df.query('subdivision_1_name == @subdivision_name')[city_location_columns].copy().reset_index(
-        drop=True)
-    _create_location_name_column(df)
-    return df
+    city_index = get_city_index()
+    return city_index.locations_at(city_index.by_subdivision.get(subdivision_name))
 
 
 def get_cities_locations_by_time_zone(time_zone: str) -> pd.DataFrame:
     logging.info("Getting all cities in %s", time_zone)
-    df = cities_df.query('time_zone == @time_zone')[city_location_columns].copy().reset_index(drop=True)
-    _create_location_name_column(df)
-    return df
+    city_index = get_city_index()
+    return city_index.locations_at(city_index.by_time_zone.get(time_zone))
 
 
 def get_cities_locations_in_european_union() -> pd.DataFrame:
     logging.info("Getting all cities in the european union")
-    df = cities_df.query('is_in_european_union == "1"')[city_location_columns].copy().reset_index(drop=True)
-    _create_location_name_column(df)
-    return df
+    city_index = get_city_index()
+    return city_index.locations_at(city_index.in_european_union)
 
 
 def get_city_location(city_name: str, country_name: str, subdivision_name: str = None) -> pd.DataFrame:
     logging.info("Looking up location of %s, %s", city_name, country_name)
+    city_index = get_city_index()
     if subdivision_name is None:
-        query = 'city_name == @city_name & country_name == @country_name'
+        positions = city_index.by_city.get((city_name, country_name))
     else:
-        query = 'city_name == @city_name & subdivision_1_name == @subdivision_name & country_name == @country_name'
-
-    df = cities_df.query(query)[city_location_columns].copy().reset_index(drop=True)
-    _create_location_name_column(df)
-
-    return df
+        positions = city_index.by_city_and_subdivision.get((city_name, subdivision_name, country_name))
+    return city_index.locations_at(positions)
 
 
 def plot_locations_on_map(file_name: str, locations: pd.DataFrame):
+    import folium  # only needed for plotting, and slow to import
+    from folium import features
+
     logging.info("Plotting locations on map")
     file_name += '.html'
     start_location = locations.iloc[0, :]
@@ -1,6 +1,8 @@
 import array
 import random
-from typing import List, Tuple
+import multiprocessing
+from functools import partial
+from typing import Callable, List, Optional, Tuple
 import numpy as np
 from deap import algorithms
 from deap import base
@@ -9,8 +11,45 @@ from deap import tools
 import pandas as pd
 from scipy.spatial.qhull import ConvexHull
 from area import area
-# import multiprocessing
 from weatherforecast.utils.haversine import haversine_distance_vec
+# the deterministic alternative, importable from here as well
+from weatherforecast.utils.k_center_locations_finder import KCenterLocationsFinder, coverage_radius_km
+
+
+# Above this many locations, we do not keep all pairwise distances in memory (it would take over 100 MB)
+MAX_LOCATIONS_FOR_DISTANCE_MATRIX = 5000
+
+
+def _create_deap_types():
+    """DEAP's creator warns if these are created again, e.g. when the finder is used more than once"""
+    if not hasattr(creator, 'FitnessMax'):
+        creator.create("FitnessMax", base.Fitness, weights=(1.0,))
+    if not hasattr(creator, 'Individual'):
+        creator.create("Individual", array.array, typecode='i', fitness=creator.FitnessMax)
+
+
+# In pool workers, the finder is set once by the initializer, so locations and distances are not sent with each task
+_worker_finder = None
+
+
+def _init_worker(finder: 'OptimalLocationsFinder'):
+    global _worker_finder
+    _create_deap_types()
+    _worker_finder = finder
+
+
+def _evaluate_in_worker(population: List[List[int]]) -> List[Tuple[float]]:
+    return _worker_finder.evaluate_population(population)
+
+
+def _run_in_worker(args: Tuple[int, int, Optional[int]]) -> Tuple[List[int], float]:
+    return _worker_finder.run_genetic_search(*args)
+
+
+def _evaluate_in_pool(pool: multiprocessing.Pool, processes: int, population: list) -> List[Tuple[float]]:
+    chunk_size = -(-len(population) // processes)
+    chunks = [[list(ind) for ind in population[i:i + chunk_size]] for i in range(0, len(population), chunk_size)]
+    return [fitness for chunk_fitnesses in pool.map(_evaluate_in_worker, chunks) for fitness in chunk_fitnesses]
 
 
 class OptimalLocationsFinder:
@@ -18,6 +57,36 @@ class OptimalLocationsFinder:
     def __init__(self, locations: pd.DataFrame, new_locations_size: int) -> None:
         self.locations = locations
         self.new_locations_size = new_locations_size
+        self.coordinates: np.ndarray = locations.loc[:, ['latitude', 'longitude']].values.astype(float)
+        self.distances: np.ndarray = None
+        if locations.shape[0] <= MAX_LOCATIONS_FOR_DISTANCE_MATRIX:
+            self.distances = self.create_distance_matrix(self.coordinates)
+        self._upper_triangle = np.triu_indices(new_locations_size, 1)
+
+    @staticmethod
+    def create_distance_matrix(coordinates: np.ndarray) -> np.ndarray:
+        """Distances in km between all pairs of (latitude, longitude) coordinates"""
+        latitudes = coordinates[:, 0]
+        longitudes = coordinates[:, 1]
+        return haversine_distance_vec(latitudes[:, np.newaxis], longitudes[:, np.newaxis],
+                                      latitudes[np.newaxis, :], longitudes[np.newaxis, :]).astype(np.float32)
+
+    def _pair_distances(self, indices: np.ndarray) -> np.ndarray:
+        """Distances between all pairs of the selected locations, for one (1D) or many (2D) selections"""
+        upper_triangle = self._upper_triangle
+        if indices.shape[-1] != self.new_locations_size:
+            upper_triangle = np.triu_indices(indices.shape[-1], 1)
+        if self.distances is not None:
+            pair_distances = self.distances[indices[..., :, np.newaxis], indices[..., np.newaxis, :]]
+        else:
+            selected = self.coordinates[indices]
+            pair_distances = haversine_distance_vec(selected[..., :, np.newaxis, 0], selected[..., :, np.newaxis, 1],
+                                                    selected[..., np.newaxis, :, 0], selected[..., np.newaxis, :, 1])
+        return pair_distances[..., upper_triangle[0], upper_triangle[1]]
+
+    def _area_of(self, indices: np.ndarray) -> float:
+        points = self.coordinates[indices][:, ::-1]  # longitude, latitude
+        return self._area_sq_km(points)
 
     def _eval_solution(self, individual: List[int]) -> Tuple[float]:
         if len(individual) == 1:
@@ -26,33 +95,79 @@ class OptimalLocationsFinder:
         if len(individual) > len(set(individual)):
             return -6371,
 
-        selected_locations: pd.DataFrame = self.locations.iloc[individual, :].copy()
-        locations_matrix = self.create_locations_matrix(selected_locations)
-        distances = haversine_distance_vec(locations_matrix['latitude_1'], locations_matrix['longitude_1'],
-                                           locations_matrix['latitude_2'], locations_matrix['longitude_2'])
-        mean_distance = distances.median()
+        indices = np.asarray(individual)
+        mean_distance = float(np.median(self._pair_distances(indices)))
 
         if len(individual) > 4:
-            area_sq_km = self.calculate_area(selected_locations)
-            fitness = mean_distance + area_sq_km
+            fitness = mean_distance + self._area_of(indices)
         else:
             fitness = mean_distance
 
         return fitness,
 
-    def find_optimal_locations(self):
-        IND_SIZE = self.new_locations_size
-
-        if self.locations.shape[0] < IND_SIZE:
+    def evaluate_population(self, population: List[List[int]]) -> List[Tuple[float]]:
+        """Like _eval_solution for each individual, but with the distances of the whole population at once"""
+        fitnesses = [None] * len(population)
+        valid = []
+        for i, individual in enumerate(population):
+            if len(individual) == self.new_locations_size > 1 and len(individual) == len(set(individual)):
+                valid.append(i)
+            else:
+                fitnesses[i] = self._eval_solution(individual)
+        if len(valid) == 0:
+            return fitnesses
+
+        indices = np.array([population[i] for i in valid])
+        median_distances = np.median(self._pair_distances(indices), axis=1)
+        for i, individual_indices, median_distance in zip(valid, indices, median_distances):
+            fitness = float(median_distance)
+            if self.new_locations_size > 4:
+                fitness += self._area_of(individual_indices)
+            fitnesses[i] = fitness,
+        return fitnesses
+
+    def _map(self, evaluate_population: Callable[[list], List[Tuple[float]]], func, individuals) -> list:
+        """Used as the toolbox's map, so that evaluation can be done for all individuals at once"""
+        if getattr(func, 'func', func) == self._eval_solution:  # the toolbox wraps functions in partials
+            return evaluate_population(list(individuals))
+        return list(map(func, individuals))
+
+    def find_optimal_locations(self, population_size: int = 500, generations: int = 10, seed: int = None,
+                               processes: int = 1, runs: int = 1) -> pd.DataFrame:
+        """Search for the best spread locations with a genetic algorithm.
+        With processes > 1, a process pool either evaluates the population of a single run in parallel,
+        or (with runs > 1) does independent runs in parallel. Of several runs, the best result is kept.
+        Run i is seeded with seed + i, if a seed is given."""
+        if self.locations.shape[0] < self.new_locations_size:
             return self.locations
 
-        creator.create("FitnessMax", base.Fitness, weights=(1.0,))
-        creator.create("Individual", array.array, typecode='i', fitness=creator.FitnessMax)
+        _create_deap_types()
+        seeds = [None if seed is None else seed + run for run in range(runs)]
+        if processes <= 1:
+            results = [self.run_genetic_search(population_size, generations, run_seed) for run_seed in seeds]
+        else:
+            with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(self,)) as pool:
+                if runs > 1:
+                    results = pool.map(_run_in_worker, [(population_size, generations, run_seed)
+                                                        for run_seed in seeds])
+                else:
+                    results = [self.run_genetic_search(population_size, generations, seed,
+                                                       partial(_evaluate_in_pool, pool, processes))]
+
+        optimal_locations_indices, _ = max(results, key=lambda result: result[1])
+
+        return self.locations.iloc[optimal_locations_indices, :].copy()
+
+    def run_genetic_search(self, population_size: int = 500, generations: int = 10, seed: int = None,
+                           evaluate_population: Callable[[list], List[Tuple[float]]] = None
+                           ) -> Tuple[List[int], float]:
+        """A single run of the genetic algorithm. Returns the indices of the best individual and its fitness."""
+        IND_SIZE = self.new_locations_size
+        _create_deap_types()
 
         toolbox = base.Toolbox()
 
-        # pool = multiprocessing.Pool()
-        # toolbox.register("map", pool.map)
+        toolbox.register("map", self._map, evaluate_population or self.evaluate_population)
 
         # Attribute generator
         toolbox.register("indices", random.sample, range(self.locations.shape[0]), IND_SIZE)
@@ -66,9 +181,10 @@ class OptimalLocationsFinder:
         toolbox.register("select", tools.selTournament, tournsize=5)
         toolbox.register("evaluate", self._eval_solution)
 
-        # random.seed(169)
+        if seed is not None:
+            random.seed(seed)
 
-        pop = toolbox.population(n=500)
+        pop = toolbox.population(n=population_size)
 
         hof = tools.HallOfFame(1)
         stats = tools.Statistics(lambda ind: ind.fitness.values)
@@ -77,12 +193,11 @@ class OptimalLocationsFinder:
         stats.register("min", np.min)
         stats.register("max", np.max)
 
-        algorithms.eaSimple(pop, toolbox, 0.2, 0.4, 10, stats=stats,
+        algorithms.eaSimple(pop, toolbox, 0.2, 0.4, generations, stats=stats,
                             halloffame=hof)
 
-        optimal_locations_indices = hof.items[0]
-
-        return self.locations.iloc[optimal_locations_indices, :].copy()
+        best = hof.items[0]
+        return list(best), best.fitness.values[0]
 
     @staticmethod
     def create_locations_matrix(selected_locations: pd.DataFrame) -> pd.DataFrame:
@@ -106,6 +221,9 @@ class OptimalLocationsFinder:
 
     def calculate_area(self, selected_locations: pd.DataFrame) -> float:
         points = selected_locations.loc[:, ['longitude', 'latitude']].values
+        return self._area_sq_km(points)
+
+    def _area_sq_km(self, points: np.ndarray) -> float:
         hull = self.calculate_convex_hull(points)
         geojson_object = {'type': 'Polygon', 'coordinates': [hull.tolist()]}
         area_sq_km = area(geojson_object) / 1e+6
@@ -0,0 +1,216 @@
+from typing import Any, Dict, Iterable
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import os
+import threading
+import time
+
+import pytz
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+"""
+Instrumentation of fetch runs: wall time, number of calls and number of database queries per stage,
+and counters (requests, beliefs created, deduped and written) per run and per city.
+A report is collected while it is active (see start_run_report); without an active report,
+stage and count do nothing. Finished reports can be appended to a JSON lines file
+and written as a Prometheus textfile (for the textfile collector of the node exporter).
+
+Queries are counted with SQLAlchemy's before_cursor_execute event, so COPY statements issued
+directly on the DBAPI connection (see bulk_insert_rows) are not counted.
+"""
+
+PROMETHEUS_PREFIX = "weatherforecast"
+
+
+class RunReport:
+    def __init__(self) -> None:
+        self.started = datetime.now(pytz.utc)
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, int] = {}
+        self.city_counters: Dict[str, Dict[str, int]] = {}
+        self.city_of_sensor: Dict[Any, str] = {}
+        self.queries = 0
+        self._lock = threading.Lock()
+        self._open_stages = threading.local()
+
+    def _stage_stack(self) -> list:
+        if not hasattr(self._open_stages, "names"):
+            self._open_stages.names = []
+        return self._open_stages.names
+
+    def _stage_entry(self, name: str) -> Dict[str, float]:
+        return self.stages.setdefault(name, dict(seconds=0.0, calls=0, queries=0))
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a stage. Stages which run in several threads at once add up their times."""
+        stack = self._stage_stack()
+        stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            with self._lock:
+                entry = self._stage_entry(name)
+                entry["seconds"] += duration
+                entry["calls"] += 1
+
+    def count(self, name: str, n: int = 1, city: str = None):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+            if city is not None:
+                city_counters = self.city_counters.setdefault(city, {})
+                city_counters[name] = city_counters.get(name, 0) + n
+
+    def map_sensors_to_city(self, sensor_ids: Iterable, city: str):
+        for sensor_id in sensor_ids:
+            self.city_of_sensor[sensor_id] = city
+
+    def count_per_city(self, name: str, sensor_ids: Iterable):
+        """Count one for each sensor id (e.g. one per belief), in total and for the city of the sensor."""
+        per_city = {}
+        total = 0
+        for sensor_id in sensor_ids:
+            city = self.city_of_sensor.get(sensor_id)
+            per_city[city] = per_city.get(city, 0) + 1
+            total += 1
+        self.count(name, total)
+        with self._lock:
+            for city, n in per_city.items():
+                if city is None:
+                    continue
+                city_counters = self.city_counters.setdefault(city, {})
+                city_counters[name] = city_counters.get(name, 0) + n
+
+    def on_query(self):
+        with self._lock:
+            self.queries += 1
+            for name in set(self._stage_stack()):
+                self._stage_entry(name)["queries"] += 1
+
+    def as_dict(self) -> dict:
+        return dict(
+            started=self.started.isoformat(),
+            queries=self.queries,
+            stages=self.stages,
+            counters=self.counters,
+            cities=self.city_counters,
+        )
+
+    def append_to_json_lines(self, path: str):
+        with open(path, "a") as report_file:
+            report_file.write(json.dumps(self.as_dict()) + "\n")
+
+    def write_prometheus_textfile(self, path: str):
+        """Write the report in the Prometheus text format. The file is replaced at once,
+        so the node exporter never reads half of it."""
+        lines = []
+
+        def metric(name: str, help_text: str, samples: Dict[str, float]):
+            full_name = "%s_%s" % (PROMETHEUS_PREFIX, name)
+            lines.append("# HELP %s %s" % (full_name, help_text))
+            lines.append("# TYPE %s gauge" % full_name)
+            for labels, value in samples.items():
+                lines.append("%s%s %s" % (full_name, labels, value))
+
+        metric(
+            "last_run_timestamp_seconds",
+            "Start of the last fetch run.",
+            {"": self.started.timestamp()},
+        )
+        metric("run_queries", "Database queries in the last run.", {"": self.queries})
+        for field, help_text in (
+            ("seconds", "Wall time per stage in the last run."),
+            ("calls", "Calls per stage in the last run."),
+            ("queries", "Database queries per stage in the last run."),
+        ):
+            metric(
+                "stage_%s" % field,
+                help_text,
+                {
+                    '{stage="%s"}' % _escape_label(name): entry[field]
+                    for name, entry in self.stages.items()
+                },
+            )
+        for name, value in self.counters.items():
+            description = name.replace("_", " ")
+            metric(name, "Count of %s in the last run." % description, {"": value})
+            metric(
+                "city_%s" % name,
+                "Count of %s per city in the last run." % description,
+                {
+                    '{city="%s"}' % _escape_label(city): city_counters[name]
+                    for city, city_counters in self.city_counters.items()
+                    if name in city_counters
+                },
+            )
+
+        temporary_path = "%s.tmp" % path
+        with open(temporary_path, "w") as textfile:
+            textfile.write("\n".join(lines) + "\n")
+        os.replace(temporary_path, path)
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_active_report: RunReport = None
+
+
+def start_run_report() -> RunReport:
+    global _active_report
+    _active_report = RunReport()
+    return _active_report
+
+
+def finish_run_report() -> RunReport:
+    global _active_report
+    report = _active_report
+    _active_report = None
+    return report
+
+
+def get_run_report() -> RunReport:
+    """The active report, or None"""
+    return _active_report
+
+
+@contextmanager
+def stage(name: str):
+    report = _active_report
+    if report is None:
+        yield
+        return
+    with report.stage(name):
+        yield
+
+
+def count(name: str, n: int = 1, city: str = None):
+    if _active_report is not None:
+        _active_report.count(name, n, city)
+
+
+def count_per_city(name: str, sensor_ids: Iterable):
+    if _active_report is not None:
+        _active_report.count_per_city(name, sensor_ids)
+
+
+def map_sensors_to_city(sensor_ids: Iterable, city: str):
+    if _active_report is not None:
+        _active_report.map_sensors_to_city(sensor_ids, city)
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if _active_report is not None:
+        _active_report.on_query()
+
+
+def watch_queries(engine: Engine):
+    """Count the queries of this engine in the active report (the hook is installed once per engine)."""
+    if not event.contains(engine, "before_cursor_execute", _count_query):
+        event.listen(engine, "before_cursor_execute", _count_query)
@@ -0,0 +1,108 @@
+from hashlib import blake2b
+from typing import Set
+import logging
+import os
+import socket
+import time
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+
+from weatherforecast.utils.dbconfig import DBLocationClaim
+
+"""
+Splitting the configured locations over several worker processes, so each location is handled by one worker.
+Either each worker is given a fixed shard (by index and count), or workers claim locations while they run,
+through PostgreSQL advisory locks. Claiming balances the work between workers which are started together;
+the locks are held until the worker releases them at the end of its run.
+Other databases (e.g. SQLite, for trying out claims locally) fall back to rows in a claims table. A worker which
+dies leaves its rows behind, so claims older than claim_timeout_seconds can be taken over by another worker.
+"""
+
+
+def _location_hash(location_name: str) -> bytes:
+    return blake2b(location_name.encode("utf-8"), digest_size=8).digest()
+
+
+def shard_of(location_name: str, shard_count: int) -> int:
+    """The shard of a location. It only depends on the location name, not on the order of the locations."""
+    return int.from_bytes(_location_hash(location_name), "big") % shard_count
+
+
+def select_shard(locations: pd.DataFrame, shard_index: int, shard_count: int) -> pd.DataFrame:
+    if not 0 <= shard_index < shard_count:
+        raise Exception("Shard index %d is not within a shard count of %d" % (shard_index, shard_count))
+    in_shard = [
+        shard_of(location_name, shard_count) == shard_index
+        for location_name in locations["location_name"]
+    ]
+    return locations[in_shard].reset_index(drop=True)
+
+
+def advisory_lock_key(location_name: str) -> int:
+    """A key for pg_try_advisory_lock (a signed 64-bit integer)."""
+    return int.from_bytes(_location_hash(location_name), "big", signed=True)
+
+
+class LocationClaims:
+    """Locations claimed by this worker, as advisory locks on a connection of its own
+    (or as rows in the claims table, on databases other than PostgreSQL)."""
+
+    def __init__(self, engine: Engine, claim_timeout_seconds: int = 3600) -> None:
+        self.engine = engine
+        self.use_advisory_locks = engine.dialect.name == "postgresql"
+        self.connection = engine.connect() if self.use_advisory_locks else None
+        self.worker = "%s:%d" % (socket.gethostname(), os.getpid())
+        self.claim_timeout_seconds = claim_timeout_seconds
+        self.tried: Set[str] = set()
+
+    def claim(self, locations: pd.DataFrame, batch_size: int = 50) -> pd.DataFrame:
+        """Claim up to batch_size of the locations which this worker has not tried to claim before.
+        Locations which another worker holds are left to that worker."""
+        claimed_rows = []
+        for position, location_name in enumerate(locations["location_name"]):
+            if len(claimed_rows) == batch_size:
+                break
+            if location_name in self.tried:
+                continue
+            self.tried.add(location_name)
+            if self._try_claim(location_name):
+                claimed_rows.append(position)
+        logging.info("Claimed %d locations" % len(claimed_rows))
+        return locations.iloc[claimed_rows].reset_index(drop=True)
+
+    def _try_claim(self, location_name: str) -> bool:
+        if self.use_advisory_locks:
+            return self.connection.execute(
+                text("SELECT pg_try_advisory_lock(:key)"),
+                {"key": advisory_lock_key(location_name)},
+            ).scalar()
+        table = DBLocationClaim.__table__
+        now = int(time.time())
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(
+                    table.delete().where(
+                        (table.c.location_name == location_name)
+                        & (table.c.claimed_at < now - self.claim_timeout_seconds)
+                    )
+                )
+                connection.execute(
+                    table.insert(),
+                    {"location_name": location_name, "worker": self.worker, "claimed_at": now},
+                )
+        except IntegrityError:
+            return False
+        return True
+
+    def release(self):
+        if self.use_advisory_locks:
+            self.connection.execute(text("SELECT pg_advisory_unlock_all()"))
+            self.connection.close()
+        else:
+            table = DBLocationClaim.__table__
+            with self.engine.begin() as connection:
+                connection.execute(table.delete().where(table.c.worker == self.worker))
+        self.tried = set()
@@ -0,0 +1,54 @@
+from hashlib import blake2b
+from typing import Callable
+import os
+import logging
+
+import pandas as pd
+
+from weatherforecast.utils import path_to_data
+
+
+def path_to_cache() -> str:
+    return os.path.join(path_to_data(), "cache")
+
+
+def cache_key(
+    csv_path: str, prepare: Callable[[pd.DataFrame], pd.DataFrame] = None, **read_csv_kwargs
+) -> str:
+    """The cached copy depends on the CSV file, and on how it is read and prepared."""
+    description = repr(
+        (
+            os.path.abspath(csv_path),
+            None if prepare is None else "%s.%s" % (prepare.__module__, prepare.__qualname__),
+            sorted(read_csv_kwargs.items()),
+        )
+    )
+    digest = blake2b(description.encode("utf-8"), digest_size=8).hexdigest()
+    return "%s.%s" % (os.path.basename(csv_path), digest)
+
+
+def read_csv_cached(
+    csv_path: str,
+    prepare: Callable[[pd.DataFrame], pd.DataFrame] = None,
+    **read_csv_kwargs
+) -> pd.DataFrame:
+    """Read a CSV file through a pickled copy in data/cache, which is much faster to load.
+    The pickle is rebuilt whenever the CSV file is newer than it.
+    The optional prepare function is applied before pickling, so its work is cached as well.
+    Each combination of prepare and read_csv_kwargs has its own pickle."""
+    cache_path = os.path.join(
+        path_to_cache(), "%s.pkl" % cache_key(csv_path, prepare, **read_csv_kwargs)
+    )
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(csv_path):
+        return pd.read_pickle(cache_path)
+
+    logging.info("Building cache of %s ..." % csv_path)
+    df = pd.read_csv(csv_path, **read_csv_kwargs)
+    if prepare is not None:
+        df = prepare(df)
+    os.makedirs(path_to_cache(), exist_ok=True)
+    # other processes may read the cache at the same time, so they should never see a half-written file
+    temporary_path = "%s.%d.tmp" % (cache_path, os.getpid())
+    df.to_pickle(temporary_path)
+    os.replace(temporary_path, cache_path)
+    return df
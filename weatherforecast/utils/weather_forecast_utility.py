@@ -1,12 +1,15 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import os
 import logging
-from typing import Tuple, List
+from typing import Callable, NamedTuple, Sequence, Tuple, List, Union
 import json
 
 import pytz
 import pandas as pd
-from forecastiopy import ForecastIO
+import requests
+from sqlalchemy.orm import Session
 from timely_beliefs import (
     BeliefsDataFrame,
     TimedBelief,
@@ -16,45 +19,158 @@ from timely_beliefs import (
     DBBeliefSource,
 )
 
-from weatherforecast.utils.dbconfig import DBLocatedSensor, get_or_create_sensors_for
-from weatherforecast.utils.helping_tables_utility import (
-    read_sensor_location_id_mapping_table,
+from weatherforecast.utils.dbconfig import (
+    DBLocatedSensor,
+    get_or_create_sensors_for,
+    sensor_registry,
 )
+from weatherforecast.utils.helping_tables_utility import get_sensor_location_id_maps
+from weatherforecast.utils.file_store import PartitionedFileStore
+from weatherforecast.utils.forecast_archive import ForecastArchive, FETCH_TIME_FORMAT
+from weatherforecast.utils import run_report
+from weatherforecast.utils.fingerprints import FingerprintCache, fingerprint_of
+from weatherforecast.utils.fetch_planning import FetchPlanner
 from weatherforecast.utils import (
     cols,
     get_config,
+    get_settings,
+    Settings,
     path_to_data,
     path_to_config,
     dbconfig,
 )
 
 
-sensor_location_id_mapping_df = read_sensor_location_id_mapping_table()
+# Directories of save_forecasts_as_json are named after the UTC time of fetching, in this format
+ARCHIVE_DIRECTORY_FORMAT = FETCH_TIME_FORMAT
 
 
-def call_darksky(api_key: str, location: Tuple[float, float]) -> dict:
-    """Make a single call to the Dark Sky API and return the result parsed as dict"""
+# Columns of forecasts extracted as a frame (see forecast_frame_from_responses)
+FORECAST_FRAME_COLUMNS = [
+    "event_start",
+    "belief_time",
+    "belief_horizon",
+    "cumulative_probability",
+    "event_value",
+    "sensor_id",
+    "source_id",
+]
+
+
+class FileSensor(Sensor):
+    """A sensor for file-based storage, identified by its id in the sensor/location mapping table"""
+
+    def __init__(self, id: str, **kwargs):
+        Sensor.__init__(self, **kwargs)
+        self.id = id
+
+
+class BeliefRecord(NamedTuple):
+    """Plain stand-in for a DBTimedBelief which will only be inserted (see bulk_insert_beliefs).
+    It has the same attributes, but building it skips the ORM."""
+
+    event_start: datetime
+    belief_horizon: timedelta
+    event_value: float
+    sensor: Sensor
+    source: BeliefSource
+    cumulative_probability: float = 0.5
+
+
+DARKSKY_URL = "https://api.darksky.net/forecast/%s/%s,%s"
+
+
+def call_darksky(
+    api_key: str,
+    location: Tuple[float, float],
+    exclude: List[str] = None,
+    extend: List[str] = None,
+    timeout: float = 10,
+) -> dict:
+    """Make a single call to the Dark Sky API and return the result parsed as dict.
+    Blocks in exclude (e.g. "minutely") are left out of the response, blocks in extend
+    (only "hourly") are extended to 168 hours.
+    A call which fails or takes longer than timeout seconds raises an exception (from requests),
+    which callers like fetch_forecasts and FetchPlanner.call treat as a failed call."""
     logging.debug("Forecasting for this location {}".format(location))
-    return ForecastIO.ForecastIO(
-        api_key,
-        units=ForecastIO.ForecastIO.UNITS_SI,
-        lang=ForecastIO.ForecastIO.LANG_ENGLISH,
-        latitude=location[0],
-        longitude=location[1],
-        extend="hourly",
-    ).forecast
+    params = dict(units="si", lang="en")
+    if exclude:
+        params["exclude"] = ",".join(exclude)
+    if extend:
+        params["extend"] = ",".join(extend)
+    response = requests.get(
+        DARKSKY_URL % (api_key, location[0], location[1]),
+        params=params,
+        headers={"Accept-Encoding": "gzip, deflate"},
+        timeout=timeout,
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def darksky_provider(settings: Settings) -> Callable[[str, Tuple[float, float]], dict]:
+    """call_darksky, asking only for what we save (see the INGESTION section of the config file)"""
+    return partial(
+        call_darksky,
+        exclude=settings.excluded_blocks,
+        # without extending, DarkSky gives 48 hours
+        extend=["hourly"] if settings.num_hours > 48 else None,
+        timeout=settings.request_timeout_seconds,
+    )
+
+
+def fetch_forecasts(
+    api_key: str,
+    locations: List[Tuple[float, float]],
+    max_workers: int = 1,
+    provider: Callable[[str, Tuple[float, float]], dict] = None,
+) -> List[Tuple[datetime, dict]]:
+    """Ask DarkSky for forecasts for all locations, with at most max_workers requests in flight.
+    Returns (belief_time, forecast) pairs in the order of the given locations.
+    Each belief time is taken right before the request for that location is made.
+    If the request for a location fails, its forecast is None, so the other locations can still be saved."""
+    if provider is None:
+        provider = call_darksky
+
+    def fetch(location: Tuple[float, float]) -> Tuple[datetime, dict]:
+        belief_time = datetime.utcnow().replace(tzinfo=pytz.utc)
+        try:
+            with run_report.stage("call_darksky"):
+                return belief_time, provider(api_key, location)
+        except Exception as e:
+            logging.error("Could not get forecasts for %s: %s" % (location, e))
+            run_report.count("darksky_failures")
+            return belief_time, None
+
+    if max_workers <= 1 or len(locations) <= 1:
+        return [fetch(location) for location in locations]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(locations))) as executor:
+        return list(executor.map(fetch, locations))
 
 
 def save_forecasts_as_json(
-    api_key: str, locations: List[Tuple[float, float]], data_path: str
+    api_key: str,
+    locations: List[Tuple[float, float]],
+    data_path: str,
+    max_workers: int = 1,
+    archive: ForecastArchive = None,
 ):
-    """Get forecasts, then store each as a JSON file"""
+    """Get forecasts, then store each as a JSON file.
+    If an archive is given, the forecasts are appended to it instead (in one compressed segment)."""
 
     # UTC timestamp to remember when data was fetched.
-    now_str = datetime.utcnow().strftime("%Y-%m-%dT%H-%M-%S")
+    now = datetime.utcnow()
+    fetched = fetch_forecasts(api_key, locations, max_workers=max_workers)
+    locations, fetched = _without_failures(locations, fetched)
+    if archive is not None:
+        responses = [
+            (location, forecasts) for location, (_, forecasts) in zip(locations, fetched)
+        ]
+        archive.append_run(now, responses)
+        return
+    now_str = now.strftime(ARCHIVE_DIRECTORY_FORMAT)
     os.mkdir("%s/%s" % (data_path, now_str))
-    for location in locations:
-        forecasts = call_darksky(api_key, location)
+    for location, (_, forecasts) in zip(locations, fetched):
         forecasts_file = "%s/%s/forecast_lat_%s_lng_%s.json" % (
             data_path,
             now_str,
@@ -66,62 +182,228 @@ def save_forecasts_as_json(
 
 
 def get_sensor_location_id(sensor: str, location_name: str) -> str:
-    logging.debug("Getting sensor id for %s %s", sensor, location_name)
-    query = "sensor == @sensor  & location_name == @location_name"
-    return sensor_location_id_mapping_df.query(query)["id"].values[0]
+    return get_sensor_location_id_maps().id_by_sensor_location[(sensor, location_name)]
 
 
 def get_sensor_location_by_id(sensor_id: str) -> (str, str):
-    query = "id == @sensor_id"
-    results = sensor_location_id_mapping_df.query(query)[
-        ["sensor", "location_name"]
-    ].values
-    sensor = results[0, 0]
-    location_name = results[0, 1]
-    return sensor, location_name
+    return get_sensor_location_id_maps().sensor_location_by_id[sensor_id]
 
 
+@run_report.stage("create_forecasts")
 def create_forecasts(
-    locations: pd.DataFrame, sensor_names: List[str], num_hours_to_save: int = 6
+    locations: pd.DataFrame,
+    sensor_names: List[str],
+    num_hours_to_save: int = 6,
+    settings: Settings = None,
+    provider: Callable[[str, Tuple[float, float]], dict] = None,
+    fingerprints: FingerprintCache = None,
+    planner: FetchPlanner = None,
+    archive: ForecastArchive = None,
+    store: Union[Session, PartitionedFileStore] = None,
 ) -> List[TimedBelief]:
+    """Fetch forecasts and turn them into beliefs.
+    With fingerprints, locations whose forecasts have not changed since they were last saved are left out.
+    With a planner, only the locations which are due are fetched, within rate and quota (see FetchPlanner).
+    With an archive, the responses are also appended to it, as one fetch run.
+    Sensors are looked up in the store (see _source_and_sensors)."""
     logging.debug(
         "Creating forecasts using these sensors: {} "
         "and saving the next {} hours".format(sensor_names, num_hours_to_save)
     )
+    if settings is None:
+        settings = get_settings()
 
-    if get_config("PERSISTENCE", "type") == "file":
-        source = BeliefSource(name="DarkSky")
+    logging.debug(
+        "Getting forecasts for {} locations, {} at a time ...".format(
+            locations.index.size, settings.concurrency
+        )
+    )
+    locations, fetched = _fetch(locations, settings, provider, planner, archive)
+    if fingerprints is not None:
+        locations, fetched = skip_unchanged_responses(
+            locations, fetched, num_hours_to_save, fingerprints
+        )
+    return create_forecasts_from_responses(
+        locations, fetched, sensor_names, num_hours_to_save, settings, store=store
+    )
+
+
+def _fetch(
+    locations: pd.DataFrame,
+    settings: Settings,
+    provider: Callable[[str, Tuple[float, float]], dict],
+    planner: FetchPlanner,
+    archive: ForecastArchive = None,
+) -> Tuple[pd.DataFrame, List[Tuple[datetime, dict]]]:
+    """The locations which were fetched, and (belief_time, response) for each of them"""
+    fetch_time = datetime.utcnow()
+    if planner is not None:
+        locations, fetched = planner.fetch(
+            locations, settings.api_key, max_workers=settings.concurrency
+        )
     else:
-        # session = dbconfig.create_db_and_session()
-        from weatherforecast.utils.dbconfig import session
+        lat_longs = [(location[1], location[2]) for location in locations.itertuples()]
+        fetched = fetch_forecasts(
+            settings.api_key,
+            lat_longs,
+            max_workers=settings.concurrency,
+            provider=provider,
+        )
+        kept_positions, fetched = _without_failures(range(len(fetched)), fetched)
+        locations = locations.iloc[kept_positions].reset_index(drop=True)
+    _count_requests(locations)
+    if archive is not None:
+        archive_responses(archive, fetch_time, locations, fetched)
+    return locations, fetched
 
-        source = session.query(DBBeliefSource).filter_by(name="DarkSky").first()
 
-    api_key = get_config("DARK_SKY", "API_KEY")
-    forecast_list = []
+def archive_responses(
+    archive: ForecastArchive,
+    fetch_time: datetime,
+    locations: pd.DataFrame,
+    fetched: List[Tuple[datetime, dict]],
+):
+    with run_report.stage("archive"):
+        archive.append_run(
+            fetch_time,
+            [
+                ((location[1], location[2]), forecasts)
+                for location, (_, forecasts) in zip(locations.itertuples(), fetched)
+            ],
+        )
+
+
+def _without_failures(
+    locations: Sequence, fetched: List[Tuple[datetime, dict]]
+) -> Tuple[list, List[Tuple[datetime, dict]]]:
+    """Leave out the locations for which fetch_forecasts got no forecasts"""
+    kept = [
+        (location, response)
+        for location, response in zip(locations, fetched)
+        if response[1] is not None
+    ]
+    return [location for location, _ in kept], [response for _, response in kept]
+
+
+def _count_requests(locations: pd.DataFrame):
     for location in locations.itertuples():
-        lat_long = (location[1], location[2])
+        run_report.count("darksky_requests", city=location[3])
+
+
+def skip_unchanged_responses(
+    locations: pd.DataFrame,
+    responses: List[Tuple[datetime, dict]],
+    num_hours_to_save: int,
+    fingerprints: FingerprintCache,
+) -> Tuple[pd.DataFrame, List[Tuple[datetime, dict]]]:
+    """Leave out the locations whose hourly forecasts (as far as we save them) have the same fingerprint
+    as those last saved. The fingerprints of the other locations are remembered in the cache."""
+    kept_positions = []
+    for position, (location, (_, forecasts)) in enumerate(
+        zip(locations.itertuples(), responses)
+    ):
         location_name = location[3]
-        belief_time = datetime.utcnow().replace(tzinfo=pytz.utc)
+        hourly_data = forecasts["hourly"]["data"][:num_hours_to_save]
+        window_start = int(hourly_data[0]["time"]) if len(hourly_data) > 0 else 0
+        fingerprint = fingerprint_of(hourly_data)
+        if fingerprints.is_unchanged(location_name, window_start, fingerprint):
+            logging.info(
+                "Forecasts for {} have not changed since they were last saved, skipping them.".format(
+                    location_name
+                )
+            )
+            run_report.count("payloads_unchanged", city=location_name)
+            continue
+        fingerprints.remember(location_name, window_start, fingerprint)
+        kept_positions.append(position)
+    return (
+        locations.iloc[kept_positions].reset_index(drop=True),
+        [responses[position] for position in kept_positions],
+    )
 
-        logging.debug(
-            "Getting forecasts for {} at belief time {} ...".format(
-                location_name, belief_time
+
+def sensor_names_per_location(
+    locations: pd.DataFrame, sensor_names: List[str], settings: Settings
+) -> List[List[str]]:
+    """The sensors to save for each location: those set for its city in the SENSORS section of the
+    config file (keyed like the LOCATIONS section, see the location_key column of find_locations),
+    otherwise sensor_names."""
+    if "location_key" not in locations:
+        return [sensor_names] * locations.shape[0]
+    return [
+        settings.sensors_per_location.get(location_key, sensor_names)
+        for location_key in locations["location_key"]
+    ]
+
+
+def _source_and_sensors(
+    locations: pd.DataFrame,
+    sensor_names: List[str],
+    settings: Settings,
+    store: Union[Session, PartitionedFileStore] = None,
+) -> Tuple[BeliefSource, List[List[Sensor]]]:
+    """The DarkSky source, and the sensors for each location.
+    In file mode, sensor ids are made by the sensor_ids function of the store, if it has one, and otherwise
+    come from the mapping table. Otherwise, the sensors are kept in the database of the store
+    (the session of dbconfig if no store is given)."""
+    names_per_location = sensor_names_per_location(locations, sensor_names, settings)
+    if settings.persistence_type == "file":
+        source = BeliefSource(name="DarkSky")
+        sensor_id = get_sensor_location_id
+        if isinstance(store, PartitionedFileStore) and store.sensor_ids is not None:
+            sensor_id = store.sensor_ids
+        sensors_per_location = [
+            [
+                FileSensor(id=sensor_id(sname, location[3]), name=sname)
+                for sname in location_sensor_names
+            ]
+            for location, location_sensor_names in zip(
+                locations.itertuples(), names_per_location
             )
+        ]
+    else:
+        if isinstance(store, Session):
+            session = store
+        else:
+            from weatherforecast.utils.dbconfig import session
+
+        source = session.query(DBBeliefSource).filter_by(name="DarkSky").first()
+        # sensors of all locations in one go, creating missing ones in one batch
+        sensors_per_location = sensor_registry.get_or_create_sensors_for_locations(
+            session,
+            [(location[1], location[2], location[3]) for location in locations.itertuples()],
+            sensor_names_per_location=names_per_location,
         )
-        hourly_forecast_48_list = call_darksky(api_key, lat_long)["hourly"]["data"]
+    for location, sensors in zip(locations.itertuples(), sensors_per_location):
+        run_report.map_sensors_to_city([sensor.id for sensor in sensors], location[3])
+    return source, sensors_per_location
 
-        if get_config("PERSISTENCE", "type") == "file":
-            sensors = [
-                Sensor(name=sname) for sname in sensor_names
-            ]  # TODO: convey the special ID here (use a class with string ID?)
-        else:
-            sensors = get_or_create_sensors_for(
-                session, lat_long[0], lat_long[1], location_name
-            )
 
-        for i in range(0, num_hours_to_save):
-            forecast = hourly_forecast_48_list[i]
+def create_forecasts_from_responses(
+    locations: pd.DataFrame,
+    responses: List[Tuple[datetime, dict]],
+    sensor_names: List[str],
+    num_hours_to_save: int = 6,
+    settings: Settings = None,
+    store: Union[Session, PartitionedFileStore] = None,
+) -> List[TimedBelief]:
+    """Turn DarkSky responses into beliefs, given (belief_time, response) for each location.
+    The responses can be fresh (see fetch_forecasts) or read back from an archive."""
+    if settings is None:
+        settings = get_settings()
+    source, sensors_per_location = _source_and_sensors(locations, sensor_names, settings, store)
+
+    forecast_list = []
+    for location, sensors, (belief_time, forecasts) in zip(
+        locations.itertuples(), sensors_per_location, responses
+    ):
+        location_name = location[3]
+        logging.debug(
+            "Got forecasts for {} at belief time {}".format(location_name, belief_time)
+        )
+        hourly_forecast_48_list = forecasts["hourly"]["data"]
+
+        for forecast in hourly_forecast_48_list[:num_hours_to_save]:
             event_start = datetime.fromtimestamp(int(forecast["time"]), tz=pytz.utc)
             add_forecast_for_sensors(
                 event_start,
@@ -131,11 +413,87 @@ def create_forecasts(
                 source,
                 forecast_list,
                 sensors,
+                settings,
             )
 
+    run_report.count_per_city("beliefs_created", [fc.sensor.id for fc in forecast_list])
     return forecast_list
 
 
+@run_report.stage("create_forecast_frame")
+def create_forecast_frame(
+    locations: pd.DataFrame,
+    sensor_names: List[str],
+    num_hours_to_save: int = 6,
+    settings: Settings = None,
+    provider: Callable[[str, Tuple[float, float]], dict] = None,
+    fingerprints: FingerprintCache = None,
+    planner: FetchPlanner = None,
+    archive: ForecastArchive = None,
+    store: Union[Session, PartitionedFileStore] = None,
+) -> pd.DataFrame:
+    """Like create_forecasts, but the forecasts come back as columns (see forecast_frame_from_responses)."""
+    if settings is None:
+        settings = get_settings()
+    locations, fetched = _fetch(locations, settings, provider, planner, archive)
+    if fingerprints is not None:
+        locations, fetched = skip_unchanged_responses(
+            locations, fetched, num_hours_to_save, fingerprints
+        )
+    return forecast_frame_from_responses(
+        locations, fetched, sensor_names, num_hours_to_save, settings, store=store
+    )
+
+
+def forecast_frame_from_responses(
+    locations: pd.DataFrame,
+    responses: List[Tuple[datetime, dict]],
+    sensor_names: List[str],
+    num_hours_to_save: int = 6,
+    settings: Settings = None,
+    store: Union[Session, PartitionedFileStore] = None,
+) -> pd.DataFrame:
+    """Turn DarkSky responses into one frame with a row per sensor per hour per location,
+    in one pass and without making a belief object for each value.
+    The columns are in FORECAST_FRAME_COLUMNS. In file mode, sensor ids come from the mapping table
+    and the source id is the source name."""
+    if settings is None:
+        settings = get_settings()
+    source, sensors_per_location = _source_and_sensors(locations, sensor_names, settings, store)
+
+    event_starts = []
+    belief_times = []
+    belief_horizons = []
+    event_values = []
+    sensor_ids = []
+    for sensors, (belief_time, forecasts) in zip(sensors_per_location, responses):
+        for forecast in forecasts["hourly"]["data"][:num_hours_to_save]:
+            event_start = datetime.fromtimestamp(int(forecast["time"]), tz=pytz.utc)
+            for sensor in sensors:
+                event_starts.append(event_start)
+                belief_times.append(belief_time)
+                belief_horizons.append(sensor.knowledge_time(event_start) - belief_time)
+                event_values.append(forecast[sensor.name])
+                sensor_ids.append(sensor.id)
+    logging.debug(
+        "Extracted {} forecasts for {} locations".format(len(event_values), len(responses))
+    )
+
+    frame = pd.DataFrame(
+        {
+            "event_start": pd.to_datetime(event_starts, utc=True),
+            "belief_time": pd.to_datetime(belief_times, utc=True),
+            "belief_horizon": pd.to_timedelta(belief_horizons),
+            "event_value": pd.to_numeric(event_values),
+            "sensor_id": sensor_ids,
+        }
+    )
+    frame["cumulative_probability"] = 0.5
+    frame["source_id"] = source.name if settings.persistence_type == "file" else source.id
+    run_report.count_per_city("beliefs_created", frame["sensor_id"])
+    return frame[FORECAST_FRAME_COLUMNS]
+
+
 def add_forecast_for_sensors(
     event_start: datetime,
     belief_time: datetime,
@@ -144,13 +502,22 @@ def add_forecast_for_sensors(
     source: BeliefSource,
     forecast_list: List[TimedBelief],
     sensors: List[Sensor],
+    settings: Settings = None,
 ):
     """Add new forecast to the list, for each sensor"""
+    if settings is None:
+        settings = get_settings()
     for sensor in sensors:
         # sensor_id = get_sensor_location_id(sensor.name, location_name)
         event_value = forecast[sensor.name]
         append_forecast_entry(
-            event_start, belief_time, event_value, sensor, source, forecast_list
+            event_start,
+            belief_time,
+            event_value,
+            sensor,
+            source,
+            forecast_list,
+            settings,
         )
 
 
@@ -160,16 +527,31 @@ def append_forecast_entry(
     event_value: float,
     sensor: Sensor,
     source: BeliefSource,
-    forecast_list: List[TimedBelief],
+    forecast_list: List[Union[TimedBelief, BeliefRecord]],
+    settings: Settings = None,
 ):
-    """Decide which TimedBelief class we need and make an instance."""
+    """Decide which TimedBelief class we need and make an instance.
+    For bulk inserts into the database, we make a BeliefRecord instead."""
+    if settings is None:
+        settings = get_settings()
     logging.debug(
         "Adding a forecast to temporary list: {}, {}, {}, {}, {}".format(
             event_start, belief_time, source, sensor, event_value
         )
     )
-    if get_config("PERSISTENCE", "type") == "file":
+    if settings.persistence_type == "file":
         tb_class = TimedBelief
+    elif settings.bulk_insert:
+        forecast_list.append(
+            BeliefRecord(
+                event_start=event_start,
+                belief_horizon=sensor.knowledge_time(event_start) - belief_time,
+                event_value=event_value,
+                sensor=sensor,
+                source=source,
+            )
+        )
+        return
     else:
         tb_class = DBTimedBelief
     forecast_list.append(
@@ -178,6 +560,6 @@ def append_forecast_entry(
             belief_time=belief_time,
             source=source,
             sensor=sensor,
-            value=event_value,
+            event_value=event_value,
         )
     )